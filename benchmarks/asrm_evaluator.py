@@ -0,0 +1,35 @@
+"""
+Checks that the in-memory ASRM evaluation (bioscripts/a2_evaluate.py) reports the same scores as the
+Perl scripts on a prediction file, e.g., of the GE11 development set, and compares their speed
+"""
+
+import time
+import argparse
+
+from udify.dataset_readers.ge11_eval import evaluate_asrm
+
+parser = argparse.ArgumentParser()
+parser.add_argument("pred_file", type=str, help="The predictions, e.g., the dev.conllu of a trained model")
+parser.add_argument("--gold_file", default="data/GE11/masked/dev.mt.1", type=str, help="The gold file")
+
+
+def run(use_perl: bool):
+    start = time.perf_counter()
+    with open(evaluate_asrm(args.gold_file, args.pred_file, use_perl=use_perl)) as f:
+        report = f.read()
+    return report, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    perl_report, perl_time = run(use_perl=True)
+    python_report, python_time = run(use_perl=False)
+    # the Python evaluator caches the gold annotations, so time it again
+    _, cached_time = run(use_perl=False)
+
+    print(python_report)
+    assert python_report == perl_report, "The reports differ, the Perl one is:\n" + perl_report
+    print("same report as the Perl scripts")
+    print(f"perl:   {perl_time:.2f}s")
+    print(f"python: {python_time:.2f}s ({cached_time:.2f}s with the gold annotations in memory)")
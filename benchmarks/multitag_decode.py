@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of the batched multi-label decoding of MultiTagDecoder against the former per-token loop
+"""
+
+import time
+import argparse
+
+import numpy
+
+from udify.models.multitag_decoder import decode_multilabel_indices
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--batch_size", default=64, type=int, help="The number of sentences of a batch")
+parser.add_argument("--sequence_length", default=60, type=int, help="The (padded) length of the sentences")
+parser.add_argument("--num_classes", default=300, type=int, help="The number of multi-labels")
+parser.add_argument("--threshold", default=0.5, type=float, help="The decoder threshold")
+parser.add_argument("--max_heads", default=50, type=int, help="The maximum number of labels of a token")
+parser.add_argument("--repeat", default=20, type=int, help="How many batches to decode")
+parser.add_argument("--seed", default=13, type=int, help="The random seed")
+
+
+def loop_decode(predictions, threshold, max_heads, outside_index):
+    """
+    The per-token decoding loop used by MultiTagDecoder.decode before the batched version.
+    """
+    pred_over_thresh = (predictions >= threshold) * predictions
+    sequence_token_labels = []
+    maxxx = numpy.argmax(predictions, axis=-1).tolist()
+    for j, pred in enumerate(pred_over_thresh):
+        num_pred_over_thresh = numpy.count_nonzero(pred)
+        if (num_pred_over_thresh == 0) or (num_pred_over_thresh == 1):
+            pred_idx_list = [maxxx[j]]
+        else:
+            k = num_pred_over_thresh if num_pred_over_thresh <= max_heads else max_heads
+            pred_idx_list = list(numpy.argpartition(pred, -k)[-k:])
+            try:
+                outside_position = pred_idx_list.index(outside_index)
+            except ValueError:
+                outside_position = -1
+            if outside_position != -1:
+                if outside_position == len(pred_idx_list) - 1:
+                    pred_idx_list = [pred_idx_list[-1]]
+                else:
+                    pred_idx_list = pred_idx_list[outside_position + 1:]
+        sequence_token_labels.append(pred_idx_list)
+    return sequence_token_labels
+
+
+def random_predictions(rng, args):
+    """
+    Sigmoid-like probabilities where most tokens are "O" (index 0) and a few carry several labels.
+    """
+    shape = (args.batch_size * args.sequence_length, args.num_classes)
+    predictions = rng.random_sample(shape).astype(numpy.float32) * 0.3
+    multi = rng.random_sample(shape[0]) < 0.3
+    extra = (rng.random_sample(shape) < 3.0 / args.num_classes) & multi[:, numpy.newaxis]
+    predictions[extra] = 0.5 + rng.random_sample(int(extra.sum())) * 0.5
+    predictions[:, 0] = numpy.where(rng.random_sample(shape[0]) < 0.8, 0.9, 0.1)
+    return predictions
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rng = numpy.random.RandomState(args.seed)
+    batches = [random_predictions(rng, args) for _ in range(args.repeat)]
+
+    start = time.perf_counter()
+    expected = [loop_decode(batch, args.threshold, args.max_heads, 0) for batch in batches]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [decode_multilabel_indices(batch, args.threshold, args.max_heads, 0) for batch in batches]
+    batched_time = time.perf_counter() - start
+
+    for expected_batch, actual_batch in zip(expected, actual):
+        assert [[int(label) for label in labels] for labels in expected_batch] == actual_batch, \
+            "The batched decoding differs from the loop"
+
+    num_tokens = args.repeat * args.batch_size * args.sequence_length
+    print(f"loop:    {loop_time:.3f}s ({num_tokens / loop_time:.0f} tokens/s)")
+    print(f"batched: {batched_time:.3f}s ({num_tokens / batched_time:.0f} tokens/s)")
+    print(f"speedup: {loop_time / batched_time:.1f}x, same labels on {num_tokens} tokens")
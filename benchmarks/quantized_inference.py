@@ -0,0 +1,77 @@
+"""
+Compares the speed and the ASRM F1 of a trained model with and without dynamic int8 quantization (on CPU)
+"""
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import tarfile
+from pathlib import Path
+from typing import Tuple
+
+import torch
+from allennlp.common import Params
+from allennlp.common.util import import_submodules
+
+from udify import util
+from udify.predictors import UdifyPredictManager
+from udify.dataset_readers.ge11_eval import evaluate_asrm, read_asrm_scores
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("archive", type=str, help="The archive file")
+parser.add_argument("--input_file", default="data/GE11/masked/dev.mt.1", type=str,
+                    help="The (gold) file to predict and evaluate")
+parser.add_argument("--output_dir", default="logs/quantized_inference", type=str,
+                    help="Where to write the predictions and the evaluation reports")
+parser.add_argument("--batch_size", default=32, type=int, help="The size of each prediction batch")
+parser.add_argument("--threads", default=None, type=int, help="The number of CPU threads used by torch")
+
+
+def predict(params: Params, quantize: bool, output_dir: str) -> Tuple[float, str]:
+    """
+    Predicts the input file, returning the elapsed time (excluding the model loading) and the prediction file.
+    """
+    # Start from an empty directory, so that no file of a previous run (e.g., the merged predictions or
+    # the decoded .a2 files) ends up in the evaluation
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    predictor = util.load_predictor_with_archive("udify_predictor", params.duplicate(), args.archive,
+                                                 quantize=quantize)
+    pred_file = os.path.join(output_dir, "pred.conllu")
+    start = time.perf_counter()
+    UdifyPredictManager(predictor, args.input_file, pred_file, args.batch_size).run()
+    elapsed = time.perf_counter() - start
+    return elapsed, pred_file
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    import_submodules("udify")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    archive_dir = Path(args.archive).resolve().parent
+    if not os.path.isfile(archive_dir / "weights.th"):
+        with tarfile.open(args.archive) as tar:
+            tar.extractall(archive_dir)
+
+    params = Params.from_file(archive_dir / "config.json")
+    params["trainer"]["cuda_device"] = -1
+
+    results = {}
+    for name, quantize in [("fp32", False), ("int8", True)]:
+        elapsed, pred_file = predict(params, quantize, os.path.join(args.output_dir, name))
+        scores = read_asrm_scores(evaluate_asrm(args.input_file, pred_file))
+        results[name] = (elapsed, scores["==[ALL-TOTAL]=="][2])
+
+    for name, (elapsed, fscore) in results.items():
+        print(f"{name}: {elapsed:.1f}s, ASRM F1 {fscore:.2f}")
+    print(f"speedup: {results['fp32'][0] / results['int8'][0]:.2f}x, "
+          f"F1 delta: {results['int8'][1] - results['fp32'][1]:+.2f}")
@@ -0,0 +1,594 @@
+"""
+A Python port of the evaluation tools of the GENIA event extraction task (BioNLP Shared Task 2011),
+i.e., of bioscripts/eval/a2-normalize.pl and bioscripts/eval/a2-evaluate.pl. It evaluates the
+predicted .a2 annotations in memory, without writing the normalized files, and reports the same
+scores as the Perl scripts (e.g., "a2-evaluate.pl -t1 -sp" for the approximate span and recursive
+matching, ASRM).
+"""
+
+import os
+import re
+import glob
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+TARGET_ECLASS = ["Gene_expression", "Transcription", "Protein_catabolism", "Phosphorylation", "Localization"]
+TARGET_RCLASS = ["Regulation", "Positive_regulation", "Negative_regulation"]
+TARGET_MCLASS = ["Negation", "Speculation"]
+TARGET_CLASS = TARGET_ECLASS + ["Binding"] + TARGET_RCLASS + TARGET_MCLASS
+
+# The canonical order of the event arguments (a2-normalize.pl)
+ARGUMENT_ORDER = {"Theme": 0, "Theme1": 1, "Theme2": 2, "Theme3": 3, "Theme4": 4, "Theme5": 5, "Theme6": 6,
+                  "Cause": 7, "Site": 10, "Site1": 11, "Site2": 12, "Site3": 13, "Site4": 14, "Site5": 15,
+                  "Site6": 16, "CSite": 17, "AtLoc": 18, "ToLoc": 19}
+
+# The characters that bound the approximate span of an entity (a2-evaluate.pl, expand_span)
+SPAN_DELIMITERS = set(" .!?,\"'")
+
+REPORT_LINE = "-" * 84
+REPORT_HEADER = [REPORT_LINE,
+                 "     Event Class          gold (match)   answer (match)   recall    prec.   fscore",
+                 REPORT_LINE]
+
+
+def perl_split(string, separator):
+    """
+    Splits as Perl's ``split`` does, i.e., dropping the trailing empty fields. ``None`` is an empty string.
+    """
+    fields = string.split(separator) if string else []
+    while fields and fields[-1] == "":
+        fields.pop()
+    return fields
+
+
+def perl_number(value):
+    """
+    The numeric value of a string, as converted by Perl (the leading number, or 0).
+    """
+    match = re.match(r"\s*[-+]?\d+", value or "")
+    return int(match.group(0)) if match else 0
+
+
+def perl_true(value):
+    """
+    Whether a (string) value is true for Perl.
+    """
+    return value is not None and value != "" and value != "0"
+
+
+def fields_of(fields, size):
+    """
+    Pads the list of fields with ``None`` (Perl's undef) up to the given size.
+    """
+    return (fields + [None] * size)[:size]
+
+
+class GoldDocument:
+    """
+    The gold annotations of a document: its text, the proteins (.a1) and the events (.a2).
+    """
+    def __init__(self, doc_id, text, a1_lines, a2_lines):
+        self.doc_id = doc_id
+        self.text = text
+        self.a1_lines = a1_lines
+        self.a2_lines = a2_lines
+
+        # The proteins, as (type, begin, end, text) by id
+        self.proteins = {}
+        for line in a1_lines:
+            entity_id, annotation, extra = fields_of(perl_split(line, "\t"), 3)
+            entity_type, begin, end = fields_of(perl_split(annotation, " "), 3)
+            self.proteins[entity_id] = [entity_type, begin, end, extra]
+
+
+def read_lines(filename):
+    with open(filename, "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+_gold_cache = {}
+
+
+def load_gold_documents(gold_dir):
+    """
+    Reads (once, then from memory) the .txt, .a1 and .a2 files in the gold directory.
+    """
+    gold_dir = os.path.abspath(gold_dir)
+    if gold_dir not in _gold_cache:
+        documents = {}
+        for txt_file in sorted(glob.glob(os.path.join(gold_dir, "*.txt"))):
+            doc_id = os.path.basename(txt_file)[:-len(".txt")]
+            stem = os.path.join(gold_dir, doc_id)
+            if not os.path.exists(stem + ".a1") or not os.path.exists(stem + ".a2"):
+                logger.warning(f"Skipping the gold document {doc_id} without .a1 or .a2 file")
+                continue
+            with open(txt_file, "r") as f:
+                text = f.read()
+            documents[doc_id] = GoldDocument(doc_id, text, read_lines(stem + ".a1"), read_lines(stem + ".a2"))
+        _gold_cache[gold_dir] = documents
+    return _gold_cache[gold_dir]
+
+
+def normalize_a2(a2_lines, gold_document):
+    """
+    Normalizes the predicted .a2 lines of a document as a2-normalize.pl does: it canonicalizes the
+    order of the event arguments (and of the themes of the Binding events), and puts the referenced
+    protein first in each Equiv group. The format checks of the Perl script (which only warn) are skipped.
+    """
+    t_ids, e_ids, m_ids, equiv = [], [], [], []
+    t_anno, e_anno, m_anno = {}, {}, {}
+
+    for line in a2_lines:
+        annotation_id, annotation, extra = fields_of(perl_split(line, "\t"), 3)
+        if not re.fullmatch(r"[TEM][0-9-]+|\*", annotation_id or ""):
+            continue
+        if annotation_id.startswith("T"):
+            t_ids.append(annotation_id)
+            t_anno[annotation_id] = fields_of(re.split(" +", annotation or ""), 3) + [extra]
+        elif annotation_id.startswith("E"):
+            predicate, *arguments = perl_split(re.sub(" +", " ", annotation or ""), " ") or [None]
+            e_ids.append(annotation_id)
+            e_anno[annotation_id] = fields_of(perl_split(predicate, ":"), 2) + arguments
+        elif annotation_id.startswith("M"):
+            m_ids.append(annotation_id)
+            m_anno[annotation_id] = fields_of((annotation or "").split(), 2)
+        else:
+            equiv.append((annotation or "").split()[1:])
+
+    for event_id in e_ids:
+        event_type, trigger_id, *arguments = e_anno[event_id]
+        if trigger_id not in t_anno or t_anno[trigger_id][0] != event_type:
+            continue
+
+        arguments.sort(key=lambda argument: ARGUMENT_ORDER.get(argument.split(":")[0], 0))
+
+        if event_type == "Binding":
+            themes, sites = {}, {}
+            for argument in arguments:
+                argument_type, argument_id = fields_of(perl_split(argument, ":"), 2)
+                argument_id = re.sub(r"^T", "", argument_id or "")
+                match = re.match(r"Theme([2-5]?)", argument_type or "")
+                if match:
+                    i = int(match.group(1) or 1)
+                    if not perl_true(themes.get(i)):
+                        themes[i] = argument_id
+                match = re.match(r"Site([2-5]?)", argument_type or "")
+                if match:
+                    i = int(match.group(1) or 1)
+                    sites.setdefault(i, argument_id)
+                    themes[i] = themes.get(i, "") + "-" + argument_id
+
+            new_themes, new_sites = [], []
+            ordered = sorted(sorted(themes), key=lambda i: perl_number(themes[i].split("-")[0]))
+            for position, i in enumerate(ordered):
+                theme, site = fields_of(perl_split(themes[i], "-"), 2)
+                number = str(position + 1) if position else ""
+                new_themes.append(f"Theme{number}:T{theme or ''}")
+                if perl_true(site):
+                    new_sites.append(f"Site{number}:T{site}")
+            arguments = new_themes + new_sites
+
+        e_anno[event_id] = [f"{event_type}:{trigger_id}"] + arguments
+
+    referenced = set()
+    for event_id in e_ids:
+        for element in e_anno[event_id]:
+            fields = perl_split(element, ":")
+            if len(fields) > 1:
+                referenced.add(fields[1])
+
+    for i, group in enumerate(equiv):
+        referenced_term, others = None, []
+        for term in group:
+            if term in referenced:
+                referenced_term = term
+            else:
+                others.append(term)
+        if referenced_term:
+            equiv[i] = [referenced_term] + others
+
+    lines = ["*\tEquiv " + " ".join(group) for group in equiv]
+    for entity_id in t_ids:
+        line = entity_id + "\t" + " ".join(field or "" for field in t_anno[entity_id][:3])
+        if t_anno[entity_id][3]:
+            line += "\t" + t_anno[entity_id][3]
+        lines.append(line)
+    for event_id in e_ids:
+        lines.append(event_id + "\t" + " ".join(field or "" for field in e_anno[event_id]))
+    for modification_id in m_ids:
+        lines.append(modification_id + "\t" + " ".join(field or "" for field in m_anno[modification_id]))
+    return lines
+
+
+class DocumentEvaluation:
+    """
+    Matches the (normalized) predicted events of a document against the gold ones, as a2-evaluate.pl does.
+    """
+    def __init__(self, gold_document, a2_lines, task=1, soft_span=False, soft_span_no_trigger=False,
+                 soft_args=False):
+        self.task = task
+        self.text = gold_document.text
+        self.text_length = len(self.text)
+        self.entity_chars = set()
+        self.protein = {}
+        self.equiv = {}
+        self.num_task2_arguments = 0
+        self.num_task3_statements = 0
+
+        if soft_span_no_trigger:
+            self.eq_span = self.eq_span_soft_no_trigger
+        elif soft_span:
+            self.eq_span = self.eq_span_soft
+        else:
+            self.eq_span = self.eq_span_hard
+        self.eq_args = self.eq_args_hard
+        self.eq_rargs = self.eq_args_soft if soft_args else self.eq_args_hard
+
+        for line in gold_document.a1_lines:
+            if line.startswith("T"):
+                entity_id, annotation = fields_of(perl_split(line, "\t"), 2)
+                entity_type, begin, end = fields_of((annotation or "").split(), 3)
+                self.entity_chars.update(range(perl_number(begin), perl_number(end)))
+                self.protein[entity_id] = [entity_type, begin, end]
+
+        self.gold, self.num_gold = self.read_a2(gold_document.a2_lines, gold=True)
+        self.answer, self.num_answer = self.read_a2(a2_lines, gold=False)
+
+    def read_a2(self, lines, gold):
+        annotations = {}
+        for line in lines:
+            annotation_id, expression = fields_of(perl_split(line, "\t"), 2)
+
+            if line.startswith("T"):
+                entity_type, begin, end = fields_of((expression or "").split(), 3)
+                if gold:
+                    self.entity_chars.update(range(perl_number(begin), perl_number(end)))
+                annotations[annotation_id] = [entity_type, begin, end]
+
+            elif line.startswith("E"):
+                arguments = (expression or "").split()
+                event_type, trigger_id = fields_of(perl_split(arguments.pop(0) if arguments else None, ":"), 2)
+                new_arguments = []
+                for argument in arguments:
+                    argument_type, argument_id = fields_of(perl_split(argument, ":"), 2)
+                    argument_type = re.sub(r"^Theme[2-6]$", "Theme", argument_type or "")
+                    if self.equiv.get(argument_id):
+                        argument_id = self.equiv[argument_id]
+                    if "Site" in argument_type or "Loc" in argument_type:
+                        if self.task != 2:
+                            continue
+                        if not gold:
+                            self.num_task2_arguments += 1
+                    new_arguments.append(f"{argument_type}:{argument_id or ''}")
+                annotations[annotation_id] = [event_type, trigger_id] + new_arguments
+
+            elif line.startswith("M"):
+                modification_type, argument_id = fields_of((expression or "").split(), 2)
+                if self.task != 3:
+                    continue
+                if not gold:
+                    self.num_task3_statements += 1
+                annotations[annotation_id] = [modification_type, "", f"Theme:{argument_id or ''}"]
+
+            elif line.startswith("*"):
+                groups = (expression or "").split()
+                representative, others = fields_of(groups[1:], 1)[0], groups[2:]
+                for other in others:
+                    self.equiv[other] = representative
+
+        # Remove the duplicated events, from the innermost ones (the gold ones are only duplicated by
+        # their simplification, the predicted ones by the Equiv groups as well)
+        equiv = {} if gold else self.equiv
+        expressions = {}
+        for event_id in self.sort_events(annotations):
+            annotation = annotations[event_id]
+            for i, element in enumerate(annotation):
+                if element is None or ":" not in element:
+                    continue
+                argument_type, argument_id = fields_of(perl_split(element, ":"), 2)
+                if equiv.get(argument_id):
+                    argument_id = equiv[argument_id]
+                annotation[i] = f"{argument_type or ''}:{argument_id or ''}"
+
+            expression = ",".join(element or "" for element in annotation)
+            if expression in expressions:
+                del annotations[event_id]
+                equiv[event_id] = expressions[expression]
+            else:
+                expressions[expression] = event_id
+
+        num_events = defaultdict(int)
+        for annotation_id, annotation in annotations.items():
+            if annotation_id[:1] in ("E", "M"):
+                num_events[annotation[0]] += 1
+        return annotations, num_events
+
+    @staticmethod
+    def sort_events(annotations):
+        """
+        Sorts the events so that each one follows the events it has as arguments.
+        """
+        remaining = [annotation_id for annotation_id in annotations if annotation_id[:1] in ("E", "M")]
+        added = set()
+        ordered = []
+        while remaining:
+            changed = False
+            for event_id in list(remaining):
+                event_arguments = [element.split(":")[1] for element in annotations[event_id]
+                                   if element and re.search(r":E[0-9-]+$", element)]
+                if all(argument_id in added for argument_id in event_arguments):
+                    ordered.append(event_id)
+                    added.add(event_id)
+                    remaining.remove(event_id)
+                    changed = True
+            if not changed:
+                # circular references
+                ordered.extend(remaining)
+                remaining = []
+        return ordered
+
+    def count_match(self):
+        """
+        Returns the number of matched predicted and gold events, by class.
+        """
+        # Events only match events of the same class (eq_class_hard), so only those are compared
+        gold_by_class = defaultdict(list)
+        for gold_id, annotation in self.gold.items():
+            if gold_id[:1] in ("E", "M"):
+                gold_by_class[(gold_id[0], annotation[0] or "")].append(gold_id)
+
+        num_manswer, num_mgold = defaultdict(int), defaultdict(int)
+        matched_gold = set()
+        for answer_id, annotation in self.answer.items():
+            if answer_id[:1] not in ("E", "M"):
+                continue
+            matched = False
+            for gold_id in gold_by_class[(answer_id[0], annotation[0] or "")]:
+                if self.eq_event(answer_id, gold_id):
+                    matched = True
+                    matched_gold.add(gold_id)
+            if matched:
+                num_manswer[annotation[0]] += 1
+        for gold_id in matched_gold:
+            num_mgold[self.gold[gold_id][0]] += 1
+        return num_manswer, num_mgold
+
+    def eq_event(self, answer_id, gold_id):
+        if answer_id.startswith("E") and gold_id.startswith("E"):
+            return (self.eq_class(answer_id, gold_id) and self.eq_span(answer_id, gold_id)
+                    and self.eq_args(answer_id, gold_id))
+        elif answer_id.startswith("M") and gold_id.startswith("M"):
+            return self.eq_class(answer_id, gold_id) and self.eq_args(answer_id, gold_id)
+        return False
+
+    def eq_revent(self, answer_id, gold_id):
+        if not answer_id.startswith("E") or not gold_id.startswith("E"):
+            return False
+        return (self.eq_class(answer_id, gold_id) and self.eq_span(answer_id, gold_id)
+                and self.eq_rargs(answer_id, gold_id))
+
+    def eq_entity(self, answer_id, gold_id):
+        if not answer_id.startswith("T") or not gold_id.startswith("T"):
+            return False
+        return self.eq_class(answer_id, gold_id) and self.eq_span(answer_id, gold_id)
+
+    def eq_class(self, answer_id, gold_id):
+        if self.protein.get(answer_id):
+            return answer_id == gold_id
+        elif answer_id in self.answer:
+            return (self.answer[answer_id][0] or "") == (self.gold.get(gold_id, [None])[0] or "")
+        return False
+
+    @staticmethod
+    def get_span(annotations, annotation_id):
+        annotation = fields_of(annotations.get(annotation_id or "", []), 3)
+        return perl_number(annotation[1]), perl_number(annotation[2])
+
+    def get_spans(self, answer_id, gold_id):
+        answer_span, gold_span = None, None
+        if answer_id.startswith("T"):
+            answer_span = self.get_span(self.answer, answer_id)
+        elif answer_id.startswith("E"):
+            answer_span = self.get_span(self.answer, fields_of(self.answer.get(answer_id, []), 2)[1])
+        if gold_id.startswith("T"):
+            gold_span = self.get_span(self.gold, gold_id)
+        elif gold_id.startswith("E"):
+            gold_span = self.get_span(self.gold, fields_of(self.gold.get(gold_id, []), 2)[1])
+        return answer_span, gold_span
+
+    def eq_span_hard(self, answer_id, gold_id):
+        if answer_id.startswith("T") and self.protein.get(answer_id):
+            return answer_id == gold_id
+        answer_span, gold_span = self.get_spans(answer_id, gold_id)
+        if answer_span is None or gold_span is None:
+            logger.warning(f"failed to find the span: ({answer_id}, {gold_id})")
+            return False
+        return answer_span == gold_span
+
+    def eq_span_soft(self, answer_id, gold_id):
+        if answer_id.startswith("T") and self.protein.get(answer_id):
+            return answer_id == gold_id
+        answer_span, gold_span = self.get_spans(answer_id, gold_id)
+        if answer_span is None or gold_span is None:
+            logger.warning(f"failed to find the span: ({answer_id}, {gold_id})")
+            return False
+        gold_begin, gold_end = self.expand_span(*gold_span)
+        return answer_span[0] >= gold_begin and answer_span[1] <= gold_end
+
+    def eq_span_soft_no_trigger(self, answer_id, gold_id):
+        if answer_id.startswith("E") and gold_id.startswith("E"):
+            return True
+        return self.eq_span_soft(answer_id, gold_id)
+
+    def is_span_boundary(self, i):
+        char = self.text[i:i + 1]
+        return (char != "" and char in SPAN_DELIMITERS) or i in self.entity_chars
+
+    def expand_span(self, begin, end):
+        """
+        Expands a gold span up to the surrounding delimiters or entities.
+        """
+        expanded_begin = begin - 2
+        while expanded_begin >= 0 and not self.is_span_boundary(expanded_begin):
+            expanded_begin -= 1
+        expanded_begin += 1
+
+        expanded_end = end + 2
+        while expanded_end <= self.text_length and not self.is_span_boundary(expanded_end - 1):
+            expanded_end += 1
+        expanded_end -= 1
+
+        return expanded_begin, expanded_end
+
+    def eq_args_hard(self, answer_id, gold_id):
+        answer_arguments = self.answer[answer_id][2:]
+        gold_arguments = self.gold[gold_id][2:]
+        if len(answer_arguments) != len(gold_arguments):
+            return False
+
+        for answer_argument, gold_argument in zip(answer_arguments, gold_arguments):
+            answer_type, answer_argument_id = fields_of(perl_split(answer_argument, ":"), 2)
+            gold_type, gold_argument_id = fields_of(perl_split(gold_argument, ":"), 2)
+            if (answer_type or "") != (gold_type or ""):
+                return False
+            if not self.eq_argument(answer_argument_id or "", gold_argument_id or ""):
+                return False
+        return True
+
+    def eq_args_soft(self, answer_id, gold_id):
+        answer_arguments = self.answer[answer_id][2:]
+        gold_arguments = self.gold[gold_id][2:]
+        # Only the themes are compared (a2-evaluate.pl would loop forever on events without a theme)
+        while answer_arguments and not answer_arguments[-1].startswith("Theme:"):
+            answer_arguments.pop()
+        while gold_arguments and not gold_arguments[-1].startswith("Theme:"):
+            gold_arguments.pop()
+        if len(answer_arguments) != len(gold_arguments):
+            return False
+
+        for answer_argument, gold_argument in zip(answer_arguments, gold_arguments):
+            answer_argument_id = fields_of(perl_split(answer_argument, ":"), 2)[1] or ""
+            gold_argument_id = fields_of(perl_split(gold_argument, ":"), 2)[1] or ""
+            if not self.eq_argument(answer_argument_id, gold_argument_id):
+                return False
+        return True
+
+    def eq_argument(self, answer_argument_id, gold_argument_id):
+        # both have to be either t-entities or events
+        if answer_argument_id[:1] != gold_argument_id[:1]:
+            return False
+        if answer_argument_id.startswith("E") and not self.eq_revent(answer_argument_id, gold_argument_id):
+            return False
+        if answer_argument_id.startswith("T") and not self.eq_entity(answer_argument_id, gold_argument_id):
+            return False
+        return True
+
+
+def evaluate_a2(predictions, gold_dir, task=1, soft_span=True, soft_span_no_trigger=False, soft_args=True):
+    """
+    Evaluates the predicted .a2 annotations against those in the gold directory, as
+    "a2-normalize.pl -g gold_dir" followed by "a2-evaluate.pl -g gold_dir" (by default, with
+    the approximate span "-s" and recursive "-p" matching) would.
+    :param predictions: the lines of the predicted .a2 file of each document, by document id
+    :param gold_dir: the directory with the .txt, .a1 and .a2 gold files
+    :param task: the task (1, 2 or 3)
+    :param soft_span: match the span of the triggers and entities approximately ("-s")
+    :param soft_span_no_trigger: ignore the event triggers and match the span of the entities approximately ("-S")
+    :param soft_args: match the arguments of the nested events approximately ("-p")
+    :return: the (gold, matched gold, answer, matched answer) counts of each event class
+    """
+    gold_documents = load_gold_documents(gold_dir)
+
+    totals = {event_class: [0, 0, 0, 0] for event_class in TARGET_CLASS}
+    num_task2_arguments, num_task3_statements = 0, 0
+    for doc_id, a2_lines in predictions.items():
+        gold_document = gold_documents.get(doc_id)
+        if gold_document is None:
+            logger.warning(f"No gold annotations for the document {doc_id}")
+            continue
+        # As the Perl scripts, skip the documents without text or proteins
+        if not gold_document.text or not gold_document.a1_lines:
+            continue
+
+        evaluation = DocumentEvaluation(gold_document, normalize_a2(a2_lines, gold_document), task=task,
+                                        soft_span=soft_span, soft_span_no_trigger=soft_span_no_trigger,
+                                        soft_args=soft_args)
+        num_task2_arguments += evaluation.num_task2_arguments
+        num_task3_statements += evaluation.num_task3_statements
+        num_manswer, num_mgold = evaluation.count_match()
+
+        for event_class in TARGET_CLASS:
+            num_answer = evaluation.num_answer[event_class]
+            # adjustment for the duplication by the approximate matching
+            if num_manswer[event_class] > num_mgold[event_class]:
+                num_answer -= num_manswer[event_class] - num_mgold[event_class]
+                num_manswer[event_class] = num_mgold[event_class]
+            for i, count in enumerate([evaluation.num_gold[event_class], num_mgold[event_class],
+                                       num_answer, num_manswer[event_class]]):
+                totals[event_class][i] += count
+
+    if task == 2 and num_task2_arguments == 0:
+        raise ValueError("no argument that belongs to task 2 found")
+    if task == 3 and num_task3_statements == 0:
+        raise ValueError("no statement that belongs to task 3 found")
+    return totals
+
+
+def accuracy(num_gold, num_mgold, num_answer, num_manswer):
+    """
+    Returns the recall, precision and F1 (in percentage).
+    """
+    recall = num_mgold / num_gold if num_gold else 0
+    precision = num_manswer / num_answer if num_answer else 0
+    fscore = (2 * precision * recall) / (precision + recall) if precision + recall else 0
+    return recall * 100, precision * 100, fscore * 100
+
+
+def get_report_rows(totals, task=1):
+    """
+    Returns the rows of the a2-evaluate.pl report as (event class, counts), with ``None`` for the separators.
+    """
+    def total(event_classes):
+        return [sum(totals[event_class][i] for event_class in event_classes) for i in range(4)]
+
+    rows = []
+    if task in (1, 2):
+        rows += [(event_class, totals[event_class]) for event_class in TARGET_ECLASS]
+        rows.append(("=[SVT-TOTAL]=", total(TARGET_ECLASS)))
+        rows.append(("Binding", totals["Binding"]))
+        rows += [("==[EVT-TOTAL]==", total(TARGET_ECLASS + ["Binding"])), None]
+        rows += [(event_class, totals[event_class]) for event_class in TARGET_RCLASS]
+        rows += [("==[REG-TOTAL]==", total(TARGET_RCLASS)), None]
+        rows += [("==[ALL-TOTAL]==", total(TARGET_ECLASS + ["Binding"] + TARGET_RCLASS)), None]
+    else:
+        rows += [(event_class, totals[event_class]) for event_class in TARGET_MCLASS]
+        rows += [("==[MOD-TOTAL]==", total(TARGET_MCLASS)), None]
+    return rows
+
+
+def get_scores(totals, task=1):
+    """
+    Returns the recall, precision and F1 (in percentage) of each event class and total, by name
+    (the same as ``udify.dataset_readers.ge11_eval.read_asrm_scores`` reads from a report).
+    """
+    return {row[0]: accuracy(*row[1]) for row in get_report_rows(totals, task) if row is not None}
+
+
+def format_report(totals, task=1):
+    """
+    Formats the counts as the report printed by a2-evaluate.pl.
+    """
+    lines = list(REPORT_HEADER)
+    for row in get_report_rows(totals, task):
+        if row is None:
+            lines.append(REPORT_LINE)
+            continue
+        event_class, counts = row
+        padding = max(19 - len(event_class), 0)
+        name = " " * (padding // 2) + event_class[:19] + " " * (padding - padding // 2)
+        line = "  {}    {:5d} ({:5d})    {:5d} ({:5d})   {:6.2f}   {:6.2f}   {:6.2f}".format(
+            name, *counts, *accuracy(*counts))
+        lines.append(line.rstrip())
+    return "\n".join(lines) + "\n"
@@ -2,6 +2,7 @@ import os
 import shutil
 import argparse
 import itertools
+import multiprocessing
 
 
 TOKEN_MIN_CHARS = 2
@@ -323,7 +324,87 @@ def attach_argument(idx_list, hops, events_idx, token_info, encoding, bind_only_
                         event_idx[1].edge_types.append((span, id_, trg_type, arg, src_type))
 
 def decode(args_filepath, args_encoding="single", args_bind_strategy="strategy", 
-    args_use_dummy_args="no", args_preg_pp="yes", bind_only_tri="no"):
+    args_use_dummy_args="no", args_preg_pp="yes", bind_only_tri="no", write_output=True, workers=1,
+    max_combinations=None):
+    """
+    Decodes the events of the predictions in args_filepath. Returns the lines of the .a2 file of
+    each document, by document id, which are also written in the "output" directory next to
+    args_filepath, unless write_output is False. With workers > 1, the documents are decoded in
+    parallel by that many processes (see decode_documents).
+    """
+    decode_args = (args_encoding, args_bind_strategy, args_use_dummy_args, args_preg_pp, bind_only_tri,
+                   max_combinations)
+    with open(args_filepath, "r") as f:
+        if workers > 1:
+            a2_documents = decode_documents(f.readlines(), workers, *decode_args)
+        else:
+            a2_documents = decode_lines(f, *decode_args)
+
+    if write_output:
+        output_dir = os.path.dirname(args_filepath)
+        output_decoded = os.path.join(output_dir, "output")
+        if os.path.exists(output_decoded):
+            shutil.rmtree(output_decoded)
+        os.makedirs(output_decoded)
+
+        for id_, lines in a2_documents.items():
+            with open(os.path.join(output_decoded, id_ + ".a2"), "w") as f:
+                f.writelines(line + "\n" for line in lines)
+
+    return a2_documents
+
+
+def split_documents(lines):
+    """
+    Splits the given BeeSL lines at the "# doc_id = " lines that start a new document, so that each
+    document can be decoded on its own: the IDs of triggers and events only depend on the previous
+    sentences of the same document. Returns None if the sentences of a document are not contiguous,
+    or if a document starts before the last sentence of the previous one is closed by an empty line.
+    """
+    documents = [[]]
+    seen_ids = set()
+    doc_id = None
+    prev_line = ""
+    for line in lines:
+        if line.startswith(DOC_ID_KEY) and get_doc_id(line) != doc_id:
+            if get_doc_id(line) in seen_ids or not is_empty_line(prev_line):
+                return None
+            if doc_id is not None:
+                documents.append([])
+            doc_id = get_doc_id(line)
+            seen_ids.add(doc_id)
+        documents[-1].append(line)
+        prev_line = line
+    return documents if doc_id is not None else []
+
+
+def decode_documents(lines, workers, *decode_args):
+    """
+    Like decode_lines, but decodes the documents in a pool of workers processes. The result is the
+    same as the one of decode_lines, to which it falls back when the lines cannot be split by document.
+    """
+    documents = split_documents(lines)
+    if documents is None:
+        print("WARNING: the sentences of a document are not contiguous, decoding them sequentially.")
+        return decode_lines(lines, *decode_args)
+
+    a2_documents = {}
+    with multiprocessing.Pool(workers) as pool:
+        chunksize = max(1, len(documents) // (4 * workers))
+        for a2_document in pool.starmap(decode_lines, [(document,) + decode_args for document in documents],
+                                        chunksize):
+            a2_documents.update(a2_document)
+    return a2_documents
+
+
+def decode_lines(lines, args_encoding="single", args_bind_strategy="strategy",
+    args_use_dummy_args="no", args_preg_pp="yes", bind_only_tri="no", max_combinations=None):
+    """
+    Decodes the events of the given (merged) BeeSL lines, each sentence followed by an empty line.
+    Returns the lines of the .a2 file of each document, by document id.
+    Each event is unmerged into at most max_combinations events (no limit if None), e.g., for the
+    combinations of its Themes and Causes; the sentences where the limit is reached are reported.
+    """
     documents = {}
     token_attrs = []
     token_id = 0
@@ -335,238 +416,253 @@ def decode(args_filepath, args_encoding="single", args_bind_strategy="strategy",
     triggers_idx = 0
     overlapping_types = {}
 
-    with open(args_filepath, "r") as f:
-        for line in f:
-            if not is_empty_line(line):
-                # If the line is a doc_id, store it
-                if line.startswith(DOC_ID_KEY):
-                    doc_id = get_doc_id(line)
-                    if doc_id not in documents:
-                        documents[doc_id] = {}
-                        documents[doc_id]["triggers"] = []
-                        documents[doc_id]["events"] = []
-                        trigger_id = 1001
-                        event_id = 1
-                        event_id_unmerged = 1001
-                        event_id_unmerged_two = 2001
-                        pp_e_id = 9001
-                        triggers_idx = 0
-                    continue
-
-                # O.w., get the info and add the token to the list
-                word, span, ent_id, label = get_token_info(line, args_encoding)
-                token_attrs.append([token_id, word, span, ent_id, label])
-                token_id += 1
+    for line in lines:
+        if not is_empty_line(line):
+            # If the line is a doc_id, store it
+            if line.startswith(DOC_ID_KEY):
+                doc_id = get_doc_id(line)
+                if doc_id not in documents:
+                    documents[doc_id] = {}
+                    documents[doc_id]["triggers"] = []
+                    documents[doc_id]["events"] = []
+                    trigger_id = 1001
+                    event_id = 1
+                    event_id_unmerged = 1001
+                    event_id_unmerged_two = 2001
+                    pp_e_id = 9001
+                    triggers_idx = 0
+                continue
+
+            # O.w., get the info and add the token to the list
+            word, span, ent_id, label = get_token_info(line, args_encoding)
+            token_attrs.append([token_id, word, span, ent_id, label])
+            token_id += 1
 
-            else:
-                entities, triggers, events_idx, trigger_id, event_id = get_annotations(
-                    token_attrs, trigger_id, event_id, doc_id)
-
-                # for entity in entities:
-                #     print(entity.id_, entity.type_, entity.start, entity.end, entity.text)
-
-                for trigger_ in triggers:
-                    trigger_ = trigger_.id_ + "\t" + trigger_.type_ + " " + trigger_.start + " " + trigger_.end + "\t" + trigger_.text
-                    documents[doc_id]["triggers"].append(trigger_)
-                    # print("{}\t{} {} {}\t{}".format(trigger.id_, trigger.type_, trigger.start, trigger.end, trigger.text))
-
-                # print(events_idx)
-
-                # Build the left/right lists of token IDs for event triggers
-                left_idx = []
-                right_idx = [e_idx[0] for e_idx in events_idx]
-                #print("index 0", left_idx, right_idx)
-
-                # Iterate over tokens to assign arguments to events
-                for i in range(len(token_attrs)):
-                    # Update the lists of event trigger idx to the sides
-                    update_left_right_lists(i, left_idx, right_idx)
-                    #print("index", i, left_idx, right_idx)
-
-                    # Get the information about the current (target) token
-                    #label = token_attrs[i][4]
-                    left_part = token_attrs[i][:4] # e.g., [9, 'I kappa B alpha', '424-439', 'T3']
-                    raw_label = token_attrs[i][4]
-                    labels = []
-                    if constants.SEP_MULTIPLE_INNER in raw_label:
-                        # e.g., B-Protein|Theme|Gene_expression|+1$B-Protein|Theme|Transcription|+1
-                        mheads = raw_label.split(constants.SEP_MULTIPLE_INNER)
-
-                        # for single-task only
-                        # keep all mention types even if they are different
-                        # check if there are redundant cases and remove them
-                        # todo: generalize to 2+ cases
-                        to_remove = None
-                        merge = False
-                        for i in range(1, len(mheads)):
-                            # if both are the same mention types
-                            if (len(mheads[i-1].split("|")) == 2) and (len(mheads[i].split("|")) == 4):
-                                if mheads[i-1].split("|")[0] == mheads[i].split("|")[0]:
-                                    # keep the second
-                                    to_remove = 0
-                            elif (len(mheads[i-1].split("|")) == 4) and (len(mheads[i].split("|")) == 2):
-                                if mheads[i-1].split("|")[0] == mheads[i].split("|")[0]:
-                                    # keep the first
-                                    to_remove = 1
-                            # if they are different merge them
-                            elif (len(mheads[i-1].split("|")) == 2) and (len(mheads[i].split("|")) == 2):
-                                merge = True
-                            else:
-                                pass
-                        if to_remove is not None:
-                            del mheads[to_remove]
-                        if merge:
-                            mheads[0] = mheads[0].split("|")[0] + "////" + mheads[1]
-                            del mheads[1]
-
-                        # Remove multiheads with same head
-                        to_keep = "Cause" # "Cause"
-                        found_labels = {}
-                        indices_to_ignore = []
-                        for i in range(0, len(mheads)):
-                            mheads_splitted = mheads[i].split("|")
-
-                            # for single task
-                            if len(mheads_splitted) == 2:
-                                continue
-
-                            key = mheads_splitted[0][2:] + "|" + mheads_splitted[2] + "|" + mheads_splitted[3]
-                            if key not in found_labels:
-                                found_labels[key] = mheads_splitted[1] + "_" + str(i)
-                            else:
-                                if to_keep == "Theme":
-                                    if found_labels[key].split("_")[0] == "Theme":
-                                        indices_to_ignore.append(i)
-                                    elif found_labels[key].split("_")[0] == "Cause":
-                                        indices_to_ignore.append(int(found_labels[key].split("_")[1]))
-                                        found_labels[key] = mheads[i][1] + "_" + str(i)
-                                    else:
-                                        pass
-                                elif to_keep == "Cause":
-                                    if found_labels[key].split("_")[0] == "Cause":
-                                        indices_to_ignore.append(i)
-                                    elif found_labels[key].split("_")[0] == "Theme":
-                                        indices_to_ignore.append(int(found_labels[key].split("_")[1]))
-                                        found_labels[key] = mheads[i][1] + "_" + str(i)
-                                    else:
-                                        pass
+        else:
+            is_capped = False
+            entities, triggers, events_idx, trigger_id, event_id = get_annotations(
+                token_attrs, trigger_id, event_id, doc_id)
+
+            # for entity in entities:
+            #     print(entity.id_, entity.type_, entity.start, entity.end, entity.text)
+
+            for trigger_ in triggers:
+                trigger_ = trigger_.id_ + "\t" + trigger_.type_ + " " + trigger_.start + " " + trigger_.end + "\t" + trigger_.text
+                documents[doc_id]["triggers"].append(trigger_)
+                # print("{}\t{} {} {}\t{}".format(trigger.id_, trigger.type_, trigger.start, trigger.end, trigger.text))
+
+            # print(events_idx)
+
+            # Build the left/right lists of token IDs for event triggers
+            left_idx = []
+            right_idx = [e_idx[0] for e_idx in events_idx]
+            #print("index 0", left_idx, right_idx)
+
+            # Iterate over tokens to assign arguments to events
+            for i in range(len(token_attrs)):
+                # Update the lists of event trigger idx to the sides
+                update_left_right_lists(i, left_idx, right_idx)
+                #print("index", i, left_idx, right_idx)
+
+                # Get the information about the current (target) token
+                #label = token_attrs[i][4]
+                left_part = token_attrs[i][:4] # e.g., [9, 'I kappa B alpha', '424-439', 'T3']
+                raw_label = token_attrs[i][4]
+                labels = []
+                if constants.SEP_MULTIPLE_INNER in raw_label:
+                    # e.g., B-Protein|Theme|Gene_expression|+1$B-Protein|Theme|Transcription|+1
+                    mheads = raw_label.split(constants.SEP_MULTIPLE_INNER)
+
+                    # for single-task only
+                    # keep all mention types even if they are different
+                    # check if there are redundant cases and remove them
+                    # todo: generalize to 2+ cases
+                    to_remove = None
+                    merge = False
+                    for i in range(1, len(mheads)):
+                        # if both are the same mention types
+                        if (len(mheads[i-1].split("|")) == 2) and (len(mheads[i].split("|")) == 4):
+                            if mheads[i-1].split("|")[0] == mheads[i].split("|")[0]:
+                                # keep the second
+                                to_remove = 0
+                        elif (len(mheads[i-1].split("|")) == 4) and (len(mheads[i].split("|")) == 2):
+                            if mheads[i-1].split("|")[0] == mheads[i].split("|")[0]:
+                                # keep the first
+                                to_remove = 1
+                        # if they are different merge them
+                        elif (len(mheads[i-1].split("|")) == 2) and (len(mheads[i].split("|")) == 2):
+                            merge = True
+                        else:
+                            pass
+                    if to_remove is not None:
+                        del mheads[to_remove]
+                    if merge:
+                        mheads[0] = mheads[0].split("|")[0] + "////" + mheads[1]
+                        del mheads[1]
+
+                    # Remove multiheads with same head
+                    to_keep = "Cause" # "Cause"
+                    found_labels = {}
+                    indices_to_ignore = []
+                    for i in range(0, len(mheads)):
+                        mheads_splitted = mheads[i].split("|")
+
+                        # for single task
+                        if len(mheads_splitted) == 2:
+                            continue
+
+                        key = mheads_splitted[0][2:] + "|" + mheads_splitted[2] + "|" + mheads_splitted[3]
+                        if key not in found_labels:
+                            found_labels[key] = mheads_splitted[1] + "_" + str(i)
+                        else:
+                            if to_keep == "Theme":
+                                if found_labels[key].split("_")[0] == "Theme":
+                                    indices_to_ignore.append(i)
+                                elif found_labels[key].split("_")[0] == "Cause":
+                                    indices_to_ignore.append(int(found_labels[key].split("_")[1]))
+                                    found_labels[key] = mheads[i][1] + "_" + str(i)
                                 else:
-                                    print("WARNING: unrecognized edge type.")
-
-                        for i in range(0, len(mheads)):
-                            if i not in indices_to_ignore:
-                                labels.append(mheads[i])
-                    else:
-                        labels = [raw_label]
-
-                    for label in labels:
-                        token_labels_list = parse_token_label(label)
-                        trg_type, arg, src_type, pos = token_labels_list
-                        token_info = left_part + token_labels_list
-
-                    # token_labels_list = parse_token_label(label)
-                    # trg_type, arg, src_type, pos = token_labels_list
-                    # token_info = token_attrs[i][:4] + token_labels_list
-
-                        # If the token is an argument of a source, analyze it
-                        if is_argument(arg):
-                            trg_position = pos[0]
-                            hops = int(pos[1])
-
-                            # Choose which list of event trigger idx to check
-                            if trg_position == "-":
-                                idx_list = left_idx
-                            elif trg_position == "+":
-                                idx_list = right_idx
+                                    pass
+                            elif to_keep == "Cause":
+                                if found_labels[key].split("_")[0] == "Cause":
+                                    indices_to_ignore.append(i)
+                                elif found_labels[key].split("_")[0] == "Theme":
+                                    indices_to_ignore.append(int(found_labels[key].split("_")[1]))
+                                    found_labels[key] = mheads[i][1] + "_" + str(i)
+                                else:
+                                    pass
                             else:
-                                print("WARNING. trg_position is not '+' or '-'.")
-
-                            #print("__before", idx_list)
-                            attach_argument(idx_list, hops, events_idx, token_info, args_encoding, bind_only_tri)
-                            #print("__after", idx_list)
+                                print("WARNING: unrecognized edge type.")
 
-                        # O.w., no argument is found. Go to the next token
+                    for i in range(0, len(mheads)):
+                        if i not in indices_to_ignore:
+                            labels.append(mheads[i])
+                else:
+                    labels = [raw_label]
+
+                for label in labels:
+                    token_labels_list = parse_token_label(label)
+                    trg_type, arg, src_type, pos = token_labels_list
+                    token_info = left_part + token_labels_list
+
+                # token_labels_list = parse_token_label(label)
+                # trg_type, arg, src_type, pos = token_labels_list
+                # token_info = token_attrs[i][:4] + token_labels_list
+
+                    # If the token is an argument of a source, analyze it
+                    if is_argument(arg):
+                        trg_position = pos[0]
+                        hops = int(pos[1])
+
+                        # Choose which list of event trigger idx to check
+                        if trg_position == "-":
+                            idx_list = left_idx
+                        elif trg_position == "+":
+                            idx_list = right_idx
                         else:
-                            pass
+                            print("WARNING. trg_position is not '+' or '-'.")
 
-                # print("__before", events_idx)
-                empty_events = []
-                for event in events_idx:
-                    if event[1].edge_types == None:
-                        empty_events.append(event)
-                
-                #for empty_event in empty_events:
-                #    events_idx.remove(empty_event)
-                # print("__after", events_idx)
-
-                raw_events = []
-                for event in events_idx:
-                    event_string = ""
-                    e_id = event[1].id_
-                    e_type = event[1].type_
-                    t_id = event[1].start_id
-                    curr_event = e_id + "\t" + e_type + ":" + t_id
-                    # print("{}\t{}:{}".format(e_id, e_type, t_id), end="")
-                    event_string += "{}\t{}:{}".format(e_id, e_type, t_id)
-
-                    if event[1].edge_types is not None:
-                        for argument in event[1].edge_types:
-                            curr_event += " " + argument[3] + ":" + argument[1]
-                            # print(" {}:{}".format(argument[3], argument[1]), end="")
-                            event_string += " {}:{}".format(argument[3], argument[1])
-                        raw_events.append(event_string)
-                        # print()
+                        #print("__before", idx_list)
+                        attach_argument(idx_list, hops, events_idx, token_info, args_encoding, bind_only_tri)
+                        #print("__after", idx_list)
 
-                    # Case trigger with no arguments (e.g., because on cross-sentence edges)
+                    # O.w., no argument is found. Go to the next token
                     else:
-                        # Add a dummy argument, if specified
-                        if args_use_dummy_args == "yes":
-                            event_string += " {}".format("Theme:T1")
-                            raw_events.append(event_string)
-
-                # Here goes the unmerging strategy
-                raw_events_norm = {}
-                events_unmerged = []
-                for i in range(len(raw_events)):
-                    # print("Analyzing", raw_events[i])
-
-                    causes = []
-                    themes = []
-                    _e_id, content = raw_events[i].split("\t")
-
-                    if " " in content: # i.e., if we have arguments
-                        raw_trigger, raw_arguments = content.split(" ", 1)
-                        _e_type, _t_id = raw_trigger.split(":")
-                        arguments = raw_arguments.split(" ")
-
-                        for argument in arguments:
-                            if argument.split(":")[0] == "Cause":
-                                causes.append(argument)
-                            elif argument.split(":")[0] == "Theme":
-                                themes.append(argument)
-
-                    multiple_causes = True if (len(causes) > 1) else False
-                    multiple_themes = True if (len(themes) > 1) else False
-                    #is_binding = True if (_e_type == "Binding") else False
-                    is_binding = True if (_e_type.startswith("Binding")) else False
-
-                    # If we have no redundant arguments, add the event as is
-                    if (not multiple_causes) and (not multiple_themes): # or nothing
-                        # @TODO: Invert arguments if Cause < Theme
-                        # documents[doc_id]["events"].append(raw_events[i])
-                        events_unmerged.append(raw_events[i])
-
-                    # O.w. checks for both causes and themes are needed
-                    else:
-                        assert _e_id not in raw_events_norm
-                        raw_events_norm[_e_id] = []
+                        pass
 
-                        if multiple_causes and (not multiple_themes):
-                            for cause_arg in causes:
+            # print("__before", events_idx)
+            empty_events = []
+            for event in events_idx:
+                if event[1].edge_types == None:
+                    empty_events.append(event)
+            
+            #for empty_event in empty_events:
+            #    events_idx.remove(empty_event)
+            # print("__after", events_idx)
+
+            raw_events = []
+            for event in events_idx:
+                event_string = ""
+                e_id = event[1].id_
+                e_type = event[1].type_
+                t_id = event[1].start_id
+                curr_event = e_id + "\t" + e_type + ":" + t_id
+                # print("{}\t{}:{}".format(e_id, e_type, t_id), end="")
+                event_string += "{}\t{}:{}".format(e_id, e_type, t_id)
+
+                if event[1].edge_types is not None:
+                    for argument in event[1].edge_types:
+                        curr_event += " " + argument[3] + ":" + argument[1]
+                        # print(" {}:{}".format(argument[3], argument[1]), end="")
+                        event_string += " {}:{}".format(argument[3], argument[1])
+                    raw_events.append(event_string)
+                    # print()
+
+                # Case trigger with no arguments (e.g., because on cross-sentence edges)
+                else:
+                    # Add a dummy argument, if specified
+                    if args_use_dummy_args == "yes":
+                        event_string += " {}".format("Theme:T1")
+                        raw_events.append(event_string)
+
+            # Here goes the unmerging strategy
+            raw_events_norm = {}
+            events_unmerged = []
+            for i in range(len(raw_events)):
+                # print("Analyzing", raw_events[i])
+
+                causes = []
+                themes = []
+                _e_id, content = raw_events[i].split("\t")
+
+                if " " in content: # i.e., if we have arguments
+                    raw_trigger, raw_arguments = content.split(" ", 1)
+                    _e_type, _t_id = raw_trigger.split(":")
+                    arguments = raw_arguments.split(" ")
+
+                    for argument in arguments:
+                        if argument.split(":")[0] == "Cause":
+                            causes.append(argument)
+                        elif argument.split(":")[0] == "Theme":
+                            themes.append(argument)
+
+                multiple_causes = True if (len(causes) > 1) else False
+                multiple_themes = True if (len(themes) > 1) else False
+                #is_binding = True if (_e_type == "Binding") else False
+                is_binding = True if (_e_type.startswith("Binding")) else False
+
+                # If we have no redundant arguments, add the event as is
+                if (not multiple_causes) and (not multiple_themes): # or nothing
+                    # @TODO: Invert arguments if Cause < Theme
+                    # documents[doc_id]["events"].append(raw_events[i])
+                    events_unmerged.append(raw_events[i])
+
+                # O.w. checks for both causes and themes are needed
+                else:
+                    assert _e_id not in raw_events_norm
+                    raw_events_norm[_e_id] = []
+
+                    if multiple_causes and (not multiple_themes):
+                        for cause_arg in causes:
+                            e_curr = "E{}\t{}".format(event_id_unmerged, raw_trigger)
+                            if len(themes) > 0:
+                                e_curr += " {}".format(themes[0])
+                            e_curr += " {}".format(cause_arg)
+
+                            raw_events_norm[_e_id].append("E{}".format(event_id_unmerged))
+                            # documents[doc_id]["events"].append(e_curr)
+                            events_unmerged.append(e_curr)
+                            event_id_unmerged += 1
+
+                            # print(e_curr)
+
+                    elif multiple_themes and (not multiple_causes):
+                        if not is_binding:
+                            for theme_arg in themes:
                                 e_curr = "E{}\t{}".format(event_id_unmerged, raw_trigger)
-                                if len(themes) > 0:
-                                    e_curr += " {}".format(themes[0])
-                                e_curr += " {}".format(cause_arg)
+                                e_curr += " {}".format(theme_arg)
+                                if len(causes) > 0:
+                                    e_curr += " {}".format(causes[0])
 
                                 raw_events_norm[_e_id].append("E{}".format(event_id_unmerged))
                                 # documents[doc_id]["events"].append(e_curr)
@@ -574,378 +670,345 @@ def decode(args_filepath, args_encoding="single", args_bind_strategy="strategy",
                                 event_id_unmerged += 1
 
                                 # print(e_curr)
+                        else:
+                            event_id_unmerged, events_unmerged, raw_events_norm, capped = unmerge_binding_event(args_bind_strategy, themes, event_id_unmerged, raw_trigger, raw_events_norm, _e_id, events_unmerged, token_attrs, max_combinations)#, nlp)
+                            is_capped = is_capped or capped
 
-                        elif multiple_themes and (not multiple_causes):
-                            if not is_binding:
-                                for theme_arg in themes:
-                                    e_curr = "E{}\t{}".format(event_id_unmerged, raw_trigger)
-                                    e_curr += " {}".format(theme_arg)
-                                    if len(causes) > 0:
-                                        e_curr += " {}".format(causes[0])
-
-                                    raw_events_norm[_e_id].append("E{}".format(event_id_unmerged))
-                                    # documents[doc_id]["events"].append(e_curr)
-                                    events_unmerged.append(e_curr)
-                                    event_id_unmerged += 1
+                    else:
+                        if not is_binding:
+                            combinations, capped = take_combinations(itertools.product(themes, causes),
+                                                                     max_combinations)
+                            is_capped = is_capped or capped
+                            for combination in combinations:
+                                e_curr = "E{}\t{}".format(event_id_unmerged, raw_trigger)
+                                e_curr += " {} {}".format(combination[0], combination[1])
 
-                                    # print(e_curr)
-                            else:
-                                event_id_unmerged, events_unmerged, raw_events_norm = unmerge_binding_event(args_bind_strategy, themes, event_id_unmerged, raw_trigger, raw_events_norm, _e_id, events_unmerged, token_attrs)#, nlp)
+                                raw_events_norm[_e_id].append("E{}".format(event_id_unmerged))
+                                # documents[doc_id]["events"].append(e_curr)
+                                events_unmerged.append(e_curr)
+                                event_id_unmerged += 1
 
+                                # print(e_curr)
                         else:
-                            if not is_binding:
-                                combinations = list(itertools.product(themes, causes))
-                                for combination in combinations:
-                                    e_curr = "E{}\t{}".format(event_id_unmerged, raw_trigger)
-                                    e_curr += " {} {}".format(combination[0], combination[1])
-
-                                    raw_events_norm[_e_id].append("E{}".format(event_id_unmerged))
-                                    # documents[doc_id]["events"].append(e_curr)
-                                    events_unmerged.append(e_curr)
-                                    event_id_unmerged += 1
-
-                                    # print(e_curr)
-                            else:
-                                print("Note that Binding events have no Causes! Skipping.")
-
-                # (Iterative) normalization of unreferenced events
-
-                # print()
-                # print("="*80)
-                # print("="*80)
-                # for raw_event in raw_events:
-                #     print("*", raw_event)
-
-                are_unref_args = True   # flag to know when to stop updating
-                ids_to_remove = []
-                #dict_of_ok_events = {}
-
-                # If there are unreferenced arguments, update them
-                events_unmerged = events_unmerged.copy()
-                count = 0
-                while are_unref_args:
-                    # Keep track of the keys to check/substitute in this iteration
-                    # to remove at the end, i.e., to prepare for the next iteration
-                    # raw_events_norm: {'E1': ['E1001'], 'E4': ['E1002', 'E1003']}, i.e., the list of substituted IDs (also from prev stage)
-                    prev_args_id = list(raw_events_norm.keys())
-
-                    changed_events = {}
-                    tmp_final = []
-
-                    # print("="*80)
-                    # print("Iteration. Check if {} are referenced.".format(prev_args_id))
-                    # print("--> if so, substitute them as follows: {}.\n".format(raw_events_norm))
-
-                    # print("EVENTS TO CHECK:")
-                    # for event_unmerged in events_unmerged:
-                    #     print("\t[[ {} ]]".format(event_unmerged))
-                    # print()
+                            print("Note that Binding events have no Causes! Skipping.")
+
+            # Normalization of the events that reference the unmerged ones
+            final_events, event_id_unmerged_two, unresolved, capped = resolve_nested_events(
+                events_unmerged, raw_events_norm, event_id_unmerged_two, max_combinations)
+            is_capped = is_capped or capped
+            for tmp in final_events:
+                # To avoid infinite loop in evaluation where Themes are not present
+                # This doesn't affect the scores since these events are already wrong
+                # (i.e., they have only Cause), so they would impact precision in any case
+                if "Theme" not in tmp:
+                    pass
+                    #print(tmp)
+                    #documents[doc_id]["events"].append(tmp + " Theme:T1")
+                else:
+                    documents[doc_id]["events"].append(tmp)
+
+            if len(unresolved) > 0:
+                print("WARNING: skipping the events {} of {} ({}), which are in or depend on a cycle of references.".format(
+                    ", ".join(unresolved), doc_id, get_sentence_span(token_attrs)))
+            if is_capped:
+                print("WARNING: expanded only {} combinations of arguments per event in {} ({}).".format(
+                    max_combinations, doc_id, get_sentence_span(token_attrs)))
+
+            # Add only the events (accumulated after the iterations) that are in their final form
+            #for k, v in dict_of_ok_events.items():
+            #    if k not in ids_to_remove:
+            #        documents[doc_id]["events"].append(v)
+
+            # print("\n\nAT THE END...\n=====\n")
+            # for x in documents[doc_id]["events"]:
+            #     print(x)
+
+            # REMOVE ORPHAN EVENTS
+            # solves both:
+            # unknown reference: [PMID-9804806] E2006 => E5
+            # Only a protein or a event can be a Theme or a Cause for a regulation event: [PMID-9804806] E2006 => Theme:E5
+            removed_orphan_ids = []
+            is_first_iter = True
+            while (is_first_iter or (len(removed_orphan_ids) > 0)):
+                removed_orphan_ids = []
+                is_first_iter = False
+
+                e_ids_list = []
+                args_list = []
+                for event_string in documents[doc_id]["events"]:
+                    e_id, e_content = event_string.split("\t")
+                    raw_args = e_content.split(" ")[1:]
+                    arg_ids = raw_args #[arg.split(":")[1] for arg in raw_args]
+                    e_ids_list.append(e_id)
+                    args_list.append(arg_ids)
+
+                offset = 0 # track the number of deleted events to recompute the index
+                # For each list of event arguments (index=event_no, event_args=[E3, E1])
+                for index, event_args in enumerate(args_list):
+                    for event_arg in event_args:
+                        event_arg_type, event_arg_id = event_arg.split(":")
+                        # If the arg is an event, and it is not included in the final list of events, delete that event (e.g., E3)
+                        if ((event_arg_id not in e_ids_list) and (not event_arg_id.startswith("T"))):
+                            # Remove the ith event (with updated index w.r.t. previous removals)
+                            # print("Removing orphan event {}...".format(documents[doc_id]["events"][index-offset]))
+                            removed_orphan_ids.append(documents[doc_id]["events"][index-offset].split("\t")[0])
+                            documents[doc_id]["events"].pop(index-offset)
+                            offset += 1
+                            break # avoid removing the following event if multiple arguments are not included in the final events we are checking
+
+
+            #print("new sentence")
+
+
+            # POSTPROCESSING
+            #print("===NEW SENTENCE")
+            #for i in range(len(documents[doc_id]["events"])):
+            #    print("Event #{}: {}".format(i, documents[doc_id]["events"][i]))
+
+            if args_preg_pp == "yes":
+                # Make a copy of triggers with a sentence-level index to avoid reiterating the same triggers
+                triggers = documents[doc_id]["triggers"][triggers_idx:]
+
+                prev_t_content = None
+                prev_t_type = None
+                prev_t_id = None
+                for trigger in triggers:
+                    #print("Checking {}".format(trigger))
+                    t_id, t_raw_content = trigger.split("\t", 1)
+                    t_type, t_content = t_raw_content.split(" ", 1)
+
+                    valid_pairs = [
+                        ("Gene_expression", "Positive_regulation"),
+                        ("Phosphorylation", "Positive_regulation"),
+                        ("Phosphorylation", "Negative_regulation")
+                    ]
+
+                    is_overlapping = True if (t_content == prev_t_content) else False
+
+                    for pair in valid_pairs:
+                        is_trg_src = True if ((t_type == pair[0]) and (prev_t_type == pair[1])) else False
+                        is_src_trg = True if ((t_type == pair[1]) and (prev_t_type == pair[0])) else False
+
+                        if is_trg_src or is_src_trg:
+                            src_type = pair[1]
+                            trg_type = pair[0]
+                            break
+
+                    if is_overlapping and (is_trg_src or is_src_trg):
+
+                        # Decide which trigger to consider as source or target
+                        if is_src_trg:
+                            source_id = t_id
+                            target_id = prev_t_id
+                        else:
+                            source_id = prev_t_id
+                            target_id = t_id
 
-                    # For each event, check if it needs to be updated
-                    for event_unmerged in events_unmerged:
-                        #print("Checking [[ {} ]].".format(event_unmerged))
-                        
-                        args_ok = []
-                        args_to_reference = []
+                        # Retrieve the target event ID
+                        trg_event_ids = search_event_by_trigger(target_id, documents[doc_id]["events"]) # trg
 
-                        _e_id, content = event_unmerged.split("\t")
+                        # If the target trigger has not an associated event yet
+                        if len(trg_event_ids) == 0:
+                            # Create an event for it
+                            # However, data suggests that target triggers without events are the cross-sentence ones, so it could increase FPs
+                            pass
 
-                        if " " in content: # i.e., if we have arguments
-                            raw_trigger, raw_arguments = content.split(" ", 1)
-                            _e_type, _t_id = raw_trigger.split(":")
-                            arguments = raw_arguments.split(" ")
+                        # If the target trigger has already associated an event
+                        if len(trg_event_ids) > 0:
 
-                            for argument in arguments:
-                                arg_type, arg_id = argument.split(":")
+                            # Retrieve the source event ID
+                            src_event_ids = search_event_by_trigger(source_id, documents[doc_id]["events"])
+                                
+                            # In the case we already have an event for the source, use it
+                            if len(src_event_ids) > 0:
 
-                                if arg_id in raw_events_norm.keys():
-                                    num_of_splits = len(raw_events_norm[arg_id])
-                                    #print(arg_id, "to be splitted", num_of_splits, "times, into: ", arg_type, raw_events_norm[arg_id])
+                                # For each ID, attach the new argument(s)
+                                for e_id in src_event_ids:
+                                    # NOTE: the only one already existing is not connected so could increase FPs
+                                    # But for instance, for +Reg->Phospho the two examples fall here
 
-                                    curr_targets = []
-                                    for new_e_ids in raw_events_norm[arg_id]:
-                                        curr_targets.append("{}:{}".format(arg_type, new_e_ids))
-                                    args_to_reference.append(curr_targets)
+                                    #print(doc_id)
+                                    # Create N events (based on len of trg_event_id?)
 
-                                    ids_to_remove.append(_e_id)
-                                else:
-                                    args_ok.append(argument)
-
-
-                        if len(args_to_reference) > 0:
-                            raw_events_norm[_e_id] = []
-                            changed_events[event_unmerged] = []
-
-                            for combinations in itertools.product(*args_to_reference):
-                                event_str = "E{}\t{}".format(event_id_unmerged_two, raw_trigger)
-                                raw_events_norm[_e_id].append("E{}".format(event_id_unmerged_two))
-
-                                themes = []
-                                causes = []
-                                for arg_ok in args_ok:
-                                    if arg_ok.split(":")[0] == "Theme":
-                                        themes.append(arg_ok)
-                                    elif arg_ok.split(":")[0] == "Cause":
-                                        causes.append(arg_ok)
-                                    else:
-                                        pass
-
-                                for combination in combinations:
-                                    if combination.split(":")[0] == "Theme":
-                                        themes.append(combination)
-                                    elif combination.split(":")[0] == "Cause":
-                                        causes.append(combination)
-                                    else:
-                                        pass
-
-                                for theme in themes:
-                                    event_str += " {}".format(theme)
-                                for cause in causes:
-                                    event_str += " {}".format(cause)
-
-                                tmp_final.append(event_str)
-                                #documents[doc_id]["events"].append(event_str)
-                                changed_events[event_unmerged].append(event_str)
-                                event_id_unmerged_two += 1
+                                    #e_strings, indexes = search_event_string(e_id, documents[doc_id]["events"])
+                                    #print("found", e_strings, indexes)
+                                    # e_string = modify_event_string(e_string)
+                                        
+                                    # substitute_event_string(e_string, index)
+                                    pass
 
-                        else:
-                            tmp_final.append(event_unmerged)
-                            #dict_of_ok_events[_e_id] = event_unmerged
+                            # Otherwise, we need to create an event for the source
+                            else:
+                                #print("  -> Need to create a new event for this +REG trigger towards {}.".format(trg_event_ids))
+                                for trg_event_id in trg_event_ids:
+                                    e = "E{}\t{}:{} Theme:{}".format(pp_e_id, src_type, source_id, trg_event_id)
+                                    #print("    -> Created: {}.".format(e))
+                                    documents[doc_id]["events"].append(e)
 
+                                    pp_e_id += 1
 
-                    # Remove for next iterations
-                    for arg_id in prev_args_id:
-                        del raw_events_norm[arg_id]
+                    else:
+                        pass
 
-                    # Add to events_unmerged
-                    for old, new_list in changed_events.items():
-                        # print("delete", old)
-                        events_unmerged.remove(old)
-                        for new in new_list:
-                            events_unmerged.append(new)
 
-                    # print("\nFINAL OF ITERATION") # the events created
-                    # for tmp in tmp_final:
-                    #     print(tmp)
-                    # print()
-                    
-                    if len(raw_events_norm) > 0:
-                        are_unref_args = True
-                    else:
-                        are_unref_args = False
-
-                    # Add final events
-                    nothing_to_change = True
-                    for tmp in tmp_final: # the candidates
-                        to_be_changed = False
-                        # get args
-                        raw_args = tmp.split("\t")[1].split(" ")[1:]
-                        for raw_arg in raw_args:
-                            arg_type, arg_id = raw_arg.split(":")
-
-                            for next_id in raw_events_norm: # the IDs to be changed in the next iteration
-                                if arg_id == next_id:
-                                    to_be_changed = True
-                                    nothing_to_change = False
-
-                        if not to_be_changed:
-                            # To avoid infinite loop in evaluation where Themes are not present
-                            # This doesn't affect the scores since these events are already wrong
-                            # (i.e., they have only Cause), so they would impact precision in any case
-                            if "Theme" not in tmp:
-                                pass
-                                #print(tmp)
-                                #documents[doc_id]["events"].append(tmp + " Theme:T1")
-                            else:
-                                documents[doc_id]["events"].append(tmp)
-                            events_unmerged.remove(tmp)
-
-                    if nothing_to_change:
-                        are_unref_args = False
-
-                    count += 1
-                    if count > 5:
-                        print("Probable infinite loop. Skipping.")
-                        are_unref_args = False
-                # Add only the events (accumulated after the iterations) that are in their final form
-                #for k, v in dict_of_ok_events.items():
-                #    if k not in ids_to_remove:
-                #        documents[doc_id]["events"].append(v)
-
-                # print("\n\nAT THE END...\n=====\n")
-                # for x in documents[doc_id]["events"]:
-                #     print(x)
-
-                # REMOVE ORPHAN EVENTS
-                # solves both:
-                # unknown reference: [PMID-9804806] E2006 => E5
-                # Only a protein or a event can be a Theme or a Cause for a regulation event: [PMID-9804806] E2006 => Theme:E5
-                removed_orphan_ids = []
-                is_first_iter = True
-                while (is_first_iter or (len(removed_orphan_ids) > 0)):
-                    removed_orphan_ids = []
-                    is_first_iter = False
-
-                    e_ids_list = []
-                    args_list = []
-                    for event_string in documents[doc_id]["events"]:
-                        e_id, e_content = event_string.split("\t")
-                        raw_args = e_content.split(" ")[1:]
-                        arg_ids = raw_args #[arg.split(":")[1] for arg in raw_args]
-                        e_ids_list.append(e_id)
-                        args_list.append(arg_ids)
-
-                    offset = 0 # track the number of deleted events to recompute the index
-                    # For each list of event arguments (index=event_no, event_args=[E3, E1])
-                    for index, event_args in enumerate(args_list):
-                        for event_arg in event_args:
-                            event_arg_type, event_arg_id = event_arg.split(":")
-                            # If the arg is an event, and it is not included in the final list of events, delete that event (e.g., E3)
-                            if ((event_arg_id not in e_ids_list) and (not event_arg_id.startswith("T"))):
-                                # Remove the ith event (with updated index w.r.t. previous removals)
-                                # print("Removing orphan event {}...".format(documents[doc_id]["events"][index-offset]))
-                                removed_orphan_ids.append(documents[doc_id]["events"][index-offset].split("\t")[0])
-                                documents[doc_id]["events"].pop(index-offset)
-                                offset += 1
-                                break # avoid removing the following event if multiple arguments are not included in the final events we are checking
-
-
-                #print("new sentence")
-
-
-                # POSTPROCESSING
-                #print("===NEW SENTENCE")
-                #for i in range(len(documents[doc_id]["events"])):
-                #    print("Event #{}: {}".format(i, documents[doc_id]["events"][i]))
-
-                if args_preg_pp == "yes":
-                    # Make a copy of triggers with a sentence-level index to avoid reiterating the same triggers
-                    triggers = documents[doc_id]["triggers"][triggers_idx:]
-
-                    prev_t_content = None
-                    prev_t_type = None
-                    prev_t_id = None
-                    for trigger in triggers:
-                        #print("Checking {}".format(trigger))
-                        t_id, t_raw_content = trigger.split("\t", 1)
-                        t_type, t_content = t_raw_content.split(" ", 1)
-
-                        valid_pairs = [
-                            ("Gene_expression", "Positive_regulation"),
-                            ("Phosphorylation", "Positive_regulation"),
-                            ("Phosphorylation", "Negative_regulation")
-                        ]
-
-                        is_overlapping = True if (t_content == prev_t_content) else False
-
-                        for pair in valid_pairs:
-                            is_trg_src = True if ((t_type == pair[0]) and (prev_t_type == pair[1])) else False
-                            is_src_trg = True if ((t_type == pair[1]) and (prev_t_type == pair[0])) else False
-
-                            if is_trg_src or is_src_trg:
-                                src_type = pair[1]
-                                trg_type = pair[0]
-                                break
+                    prev_t_content = t_content
+                    prev_t_type = t_type
+                    prev_t_id = t_id
 
-                        if is_overlapping and (is_trg_src or is_src_trg):
+                # Update the sentence-level index to subset the triggers to check
+                triggers_idx = len(documents[doc_id]["triggers"])
+                #print()
 
-                            # Decide which trigger to consider as source or target
-                            if is_src_trg:
-                                source_id = t_id
-                                target_id = prev_t_id
-                            else:
-                                source_id = prev_t_id
-                                target_id = t_id
-
-                            # Retrieve the target event ID
-                            trg_event_ids = search_event_by_trigger(target_id, documents[doc_id]["events"]) # trg
-
-                            # If the target trigger has not an associated event yet
-                            if len(trg_event_ids) == 0:
-                                # Create an event for it
-                                # However, data suggests that target triggers without events are the cross-sentence ones, so it could increase FPs
-                                pass
-
-                            # If the target trigger has already associated an event
-                            if len(trg_event_ids) > 0:
-
-                                # Retrieve the source event ID
-                                src_event_ids = search_event_by_trigger(source_id, documents[doc_id]["events"])
-                                    
-                                # In the case we already have an event for the source, use it
-                                if len(src_event_ids) > 0:
-
-                                    # For each ID, attach the new argument(s)
-                                    for e_id in src_event_ids:
-                                        # NOTE: the only one already existing is not connected so could increase FPs
-                                        # But for instance, for +Reg->Phospho the two examples fall here
-
-                                        #print(doc_id)
-                                        # Create N events (based on len of trg_event_id?)
-
-                                        #e_strings, indexes = search_event_string(e_id, documents[doc_id]["events"])
-                                        #print("found", e_strings, indexes)
-                                        # e_string = modify_event_string(e_string)
-                                            
-                                        # substitute_event_string(e_string, index)
-                                        pass
-
-                                # Otherwise, we need to create an event for the source
-                                else:
-                                    #print("  -> Need to create a new event for this +REG trigger towards {}.".format(trg_event_ids))
-                                    for trg_event_id in trg_event_ids:
-                                        e = "E{}\t{}:{} Theme:{}".format(pp_e_id, src_type, source_id, trg_event_id)
-                                        #print("    -> Created: {}.".format(e))
-                                        documents[doc_id]["events"].append(e)
 
-                                        pp_e_id += 1
+            token_id = 0
+            token_attrs = []
 
-                        else:
-                            pass
 
+    return documents_to_a2(documents)
 
-                        prev_t_content = t_content
-                        prev_t_type = t_type
-                        prev_t_id = t_id
 
-                    # Update the sentence-level index to subset the triggers to check
-                    triggers_idx = len(documents[doc_id]["triggers"])
-                    #print()
+def documents_to_a2(documents):
+    """
+    Formats the decoded triggers and events of each document as the lines of its .a2 file.
+    """
+    a2_documents = {}
+    for id_, content in documents.items():
+        lines = []
+        for trigger_ in content["triggers"]:
+            parts = trigger_.split("\t", 2)
+            tri_type, other = parts[1].split(" ", 1)
+            if tri_type in ["Binding1", "BindingK", "BindingN", "BindingS"]:
+                tri_type = "Binding"
+            lines.append(parts[0] + "\t" + tri_type + " " + other + "\t" + parts[2])
+        for event_ in content["events"]:
+            ev_id, ev_content = event_.split("\t")
+            raw_ev_type, other = ev_content.split(" ", 1)
+            event_type, trigger_id = raw_ev_type.split(":")
+            if event_type in ["Binding1", "BindingK", "BindingN", "BindingS"]:
+                event_type = "Binding"
+            lines.append(ev_id + "\t" + event_type + ":" + trigger_id + " " + other)
+        a2_documents[id_] = lines
+    return a2_documents
+
+
+def take_combinations(combinations, max_combinations):
+    """
+    Returns the first max_combinations of the given combinations (all of them if max_combinations is
+    None), and whether some of them were left out.
+    """
+    if max_combinations is None:
+        return list(combinations), False
+    combinations = list(itertools.islice(combinations, max_combinations + 1))
+    return combinations[:max_combinations], len(combinations) > max_combinations
+
+
+def get_sentence_span(token_attrs):
+    """
+    Returns the character span of the sentence with the given tokens, e.g., "424-612".
+    """
+    if len(token_attrs) == 0:
+        return "empty sentence"
+    return token_attrs[0][2].split("-")[0] + "-" + token_attrs[-1][2].split("-")[-1]
+
+
+def resolve_nested_events(events_unmerged, raw_events_norm, event_id_unmerged_two, max_combinations=None):
+    """
+    Replaces the arguments of the events that reference an unmerged event (i.e., one of the keys of
+    raw_events_norm, mapping it to the IDs of the events it has been unmerged into) with each of these
+    events, unmerging the referencing events as well, with new IDs from event_id_unmerged_two on.
+
+    The events are resolved in topological order of the event -> argument graph: an event is unmerged
+    only once all the events it references are in their final form, so each event is unmerged once.
+    Among the events that can be resolved, the order of events_unmerged is kept.
+
+    Returns the events in their final form, the next ID, the IDs of the events that could not be
+    resolved because they are in (or depend on) a cycle of references, and whether an event has been unmerged into only
+    max_combinations events.
+    """
+    def get_arguments(event):
+        content = event.split("\t")[1]
+        if " " not in content:
+            return content, []
+        raw_trigger, raw_arguments = content.split(" ", 1)
+        return raw_trigger, raw_arguments.split(" ")
+
+    events = [(event, event.split("\t")[0]) + get_arguments(event) for event in events_unmerged]
+
+    # The events that (possibly transitively) reference an unmerged event, and so need to be unmerged
+    to_unmerge = set()
+    changed = True
+    while changed:
+        changed = False
+        for _, e_id, _, arguments in events:
+            if e_id not in to_unmerge and any(
+                    argument.split(":")[1] in raw_events_norm or argument.split(":")[1] in to_unmerge
+                    for argument in arguments):
+                to_unmerge.add(e_id)
+                changed = True
+
+    # The IDs of the final events that each resolved (unmerged) event ID stands for
+    resolved = {}
+
+    def resolve(arg_id):
+        if arg_id in resolved:
+            return resolved[arg_id]
+        if arg_id in to_unmerge:
+            return None
+        if arg_id in raw_events_norm:
+            parts = [resolve(part_id) for part_id in raw_events_norm[arg_id]]
+            if any(part is None for part in parts):
+                return None
+            resolved[arg_id] = [final_id for part in parts for final_id in part]
+            return resolved[arg_id]
+        return [arg_id]
+
+    final_events = []
+    is_capped = False
+    pending = events
+    while len(pending) > 0:
+        still_pending = []
+        for event in pending:
+            event_unmerged, e_id, raw_trigger, arguments = event
+            if e_id not in to_unmerge:
+                final_events.append(event_unmerged)
+                continue
+
+            # Wait for the referenced events to be in their final form
+            targets = [resolve(argument.split(":")[1]) for argument in arguments]
+            if any(target_ids is None for target_ids in targets):
+                still_pending.append(event)
+                continue
+
+            args_ok = []
+            args_to_reference = []
+            for argument, target_ids in zip(arguments, targets):
+                arg_type, arg_id = argument.split(":")
+                if target_ids == [arg_id]:
+                    args_ok.append(argument)
+                else:
+                    args_to_reference.append(["{}:{}".format(arg_type, target_id) for target_id in target_ids])
 
+            combinations, capped = take_combinations(itertools.product(*args_to_reference), max_combinations)
+            is_capped = is_capped or capped
+            resolved[e_id] = []
+            for combination in combinations:
+                arguments = args_ok + list(combination)
+                themes = [argument for argument in arguments if argument.split(":")[0] == "Theme"]
+                causes = [argument for argument in arguments if argument.split(":")[0] == "Cause"]
+                final_events.append("E{}\t{}".format(event_id_unmerged_two, " ".join([raw_trigger] + themes + causes)))
+                resolved[e_id].append("E{}".format(event_id_unmerged_two))
+                event_id_unmerged_two += 1
 
-                token_id = 0
-                token_attrs = []
+        # Nothing left can be resolved, i.e., the pending events reference each other
+        if len(still_pending) == len(pending):
+            break
+        pending = still_pending
 
+    unresolved = [e_id for _, e_id, _, _ in pending]
+    return final_events, event_id_unmerged_two, unresolved, is_capped
 
-    output_dir = os.path.dirname(args_filepath)
-    output_decoded = os.path.join(output_dir, "output")
-    if os.path.exists(output_decoded):
-        shutil.rmtree(output_decoded)
-    os.makedirs(output_decoded)
 
-    for id_, content in documents.items():
-        with open(os.path.join(output_decoded, id_ + ".a2"), "w") as f:
-        # with open("output/" + id_ + ".a2", "w") as f:
-            for trigger_ in content["triggers"]:
-                parts = trigger_.split("\t", 2)
-                tri_type, other = parts[1].split(" ", 1)
-                if tri_type in ["Binding1", "BindingK", "BindingN", "BindingS"]:
-                    tri_type = "Binding"
-                f.write(parts[0] + "\t" + tri_type + " " + other + "\t" + parts[2] + "\n")
-                # f.write(trigger_ + "\n")
-            for event_ in content["events"]:
-                # print("RAW", event_)
-                ev_id, ev_content = event_.split("\t")
-                raw_ev_type, other = ev_content.split(" ", 1)
-                event_type, trigger_id = raw_ev_type.split(":")
-                if event_type in ["Binding1", "BindingK", "BindingN", "BindingS"]:
-                    event_type = "Binding"
-                f.write(ev_id + "\t" + event_type + ":" + trigger_id + " " + other + "\n")
-                # print("NEW", ev_id + "\t" + event_type + ":" + trigger_id + " " + other + "\n")
-                # f.write(event_ + "\n")
-
-
-def unmerge_binding_event(bind_strategy, themes, event_id_unmerged, raw_trigger, raw_events_norm, _e_id, events_unmerged, token_attrs):#, nlp):
+def unmerge_binding_event(bind_strategy, themes, event_id_unmerged, raw_trigger, raw_events_norm, _e_id, events_unmerged, token_attrs, max_combinations=None):#, nlp):
 
     def build_event(raw_trigger, event_id_unmerged, themes, raw_events_norm, _e_id, events_unmerged, operation):
         if operation == "1:N":
@@ -1001,8 +1064,9 @@ def unmerge_binding_event(bind_strategy, themes, event_id_unmerged, raw_trigger,
         return event_id_unmerged
 
 
+    is_capped = False
     if bind_strategy == "two":
-        combinations = list(itertools.combinations(themes, 2))
+        combinations, is_capped = take_combinations(itertools.combinations(themes, 2), max_combinations)
         for combination in combinations:
             e_curr = "E{}\t{}".format(event_id_unmerged, raw_trigger)
             e_curr += " {} {}".format(combination[0], "Theme2:" + combination[1].split(":")[1])
@@ -1159,7 +1223,7 @@ def unmerge_binding_event(bind_strategy, themes, event_id_unmerged, raw_trigger,
     else:
         print("Strategy not found for Binding events")
 
-    return event_id_unmerged, events_unmerged, raw_events_norm
+    return event_id_unmerged, events_unmerged, raw_events_norm, is_capped
 
 
 def get_sdp_path(doc, subj, obj, lca_matrix):
@@ -1236,9 +1300,16 @@ if __name__ == "__main__":
               events connected to it.")
     parser.add_argument("--preg_pp", default="yes", 
         help="Whether to use postprocessing of self-argument events.")
+    parser.add_argument("--workers", default=1, type=int,
+        help="The number of processes decoding the documents in parallel.")
+    parser.add_argument("--max_combinations", default=None, type=int,
+        help="The maximum number of events into which an event is unmerged (e.g., for the \
+              combinations of its arguments); the sentences reaching it are reported. \
+              By default, there is no limit.")
     args = parser.parse_args()
 
-    decode(args.filepath, args.encoding, args.bind_strategy, args.use_dummy_args, args.preg_pp, args.bind_only_tri)
+    decode(args.filepath, args.encoding, args.bind_strategy, args.use_dummy_args, args.preg_pp, args.bind_only_tri,
+           workers=args.workers, max_combinations=args.max_combinations)
 
 else:
     from bioscripts.utils import constants
@@ -1,12 +1,23 @@
 import os
 import argparse
-from utils import create_files, constants
+from utils import create_files, constants, language, doc_cache
 from utils.document import Document, EntityMention, TriggerMention, Event
 
 
 def main(args):
     corpus_path = os.path.join("data", "corpora", args.corpus)
 
+    # Set the NLP environment once for all the splits (each worker sets its own)
+    nlp = None
+    if args.workers <= 1:
+        print("Setting the NLP environment...")
+        nlp = language.set_nlp_environment(args.keep_entity_tokens)
+
+    # Reuse the paragraphs parsed by previous runs, if asked to
+    cache = None
+    if args.cache_dir:
+        cache = doc_cache.DocCache(args.cache_dir)
+
     for data_split in constants.DATA_SPLITS:
         documents = []
 
@@ -25,7 +36,8 @@ def main(args):
         create_files.create_annotations(
             documents, data_split, args.corpus, args.use_sec_entities, 
             args.keep_entity_tokens, args.keep_orphan_entities, args.encoding,
-            args.multihead, args.masking)
+            args.multihead, args.masking, nlp=nlp, workers=args.workers,
+            batch_size=args.batch_size, cache=cache)
         
 
 def parse_document_files(folder, doc_id, use_sec_entities, data_split,
@@ -245,13 +257,15 @@ if __name__ == "__main__":
     parser.add_argument("--multihead", default=True,
         action="store_true", help="Whether or not to encode multiple heads at\
                 a token level.")
-    parser.add_argument("--masking", default="no", 
-        choices=["no", "entity", "type"], help="Whether or not to mask entities.")
+    parser.add_argument("--masking", default=["no"], nargs="+",
+        choices=["no", "entity", "type"], help="Whether or not to mask entities.\
+                Several maskings are produced in the same pass.")
     parser.add_argument("--bind_renaming", default="no",
         choices=["no", "all", "s-to-1", "s-to-n", "all_only_tri", "s-to-1_only_tri", 
         "s-to-n_only_tri"], help="Which strategy to use to rename Binding events.")
-    parser.add_argument("--encoding", default="mt.1",
-        choices=["st", "mt.1", "mt.2", "mt.3", "mt.4"], help="The encoding to use.")
+    parser.add_argument("--encoding", default=["mt.1"], nargs="+",
+        choices=["st", "mt.1", "mt.2", "mt.3", "mt.4"], help="The encoding to use.\
+                Several encodings are produced in the same pass.")
     parser.add_argument("--use_sec_entities", default=False, 
         action="store_true", help="Whether or not to use annotated secondary\
                 entities. Note that since we are interested in the core task,\
@@ -262,6 +276,24 @@ if __name__ == "__main__":
     parser.add_argument("--keep_orphan_entities", default=False, 
         action="store_true", help="Whether or not to model entities without\
                 incoming edges as a label.")
+    parser.add_argument("--workers", default=1, type=int,
+        help="The number of processes annotating the documents in parallel.")
+    parser.add_argument("--batch_size", default=create_files.BATCH_SIZE,
+        type=int, help="The number of paragraphs that the NLP pipeline\
+                processes at once.")
+    parser.add_argument("--cache_dir", default=None,
+        help="The directory where to cache the paragraphs parsed by the NLP\
+                pipeline, to reuse them across runs (e.g., with different\
+                encodings or masking). By default, nothing is cached.")
     args = parser.parse_args()
 
+    # Each output file is written once, and some maskings share theirs
+    args.encoding = list(dict.fromkeys(args.encoding))
+    args.masking = list(dict.fromkeys(args.masking))
+    try:
+        create_files.get_output_filepaths(constants.DATA_SPLITS[0],
+            args.corpus, args.encoding, args.masking)
+    except ValueError as e:
+        parser.error(str(e))
+
     main(args)
\ No newline at end of file
@@ -1,313 +1,473 @@
 import os
+import copy
+import contextlib
+import bisect
+import multiprocessing
 from utils import constants, language
 from utils.document import Edge
 
 
+BATCH_SIZE = 32
+
 incomings = []
+worker_nlp = None
 
 def create_annotations(documents, data_split, corpus, use_sec_entities,
-    keep_ent_tokens, keep_orphan_entities, encoding, multihead, masking):
+    keep_ent_tokens, keep_orphan_entities, encodings, multihead, maskings,
+    nlp=None, workers=1, batch_size=BATCH_SIZE, cache=None):
+    """Writes the encoded sentences of the documents in the files of the split,
+    one for each of the encodings and maskings, which are all produced in the
+    same pass (each paragraph is parsed once).
+    The nlp environment is set up (and reused across calls, if passed) unless
+    workers > 1, in which case each worker process sets up its own and the
+    documents are annotated in parallel, written in their original order.
+    The paragraphs found in the cache (a DocCache), if any, are not parsed
+    again."""
 
-    EVENT_TYPES = constants.GE11_EVENT_TYPES
     output_labels = {}
+
+    encodings = list(dict.fromkeys(encodings))
+    maskings = list(dict.fromkeys(maskings))
+    filepaths = get_output_filepaths(data_split, corpus, encodings, maskings)
+
+    annotation_args = (use_sec_entities, keep_ent_tokens, keep_orphan_entities,
+        encodings, multihead, maskings, batch_size, cache)
+
+    # Open the files of all the encoding/masking combinations at once
+    with contextlib.ExitStack() as stack:
+        files = {output: stack.enter_context(open(filepath, "a"))
+            for output, filepath in filepaths.items()}
+
+        if workers > 1:
+            with multiprocessing.Pool(workers, initializer=set_worker_nlp,
+                    initargs=(keep_ent_tokens,)) as pool:
+                for lines in pool.imap(annotate_document_in_worker,
+                        [(document,) + annotation_args
+                        for document in documents]):
+                    for output, f in files.items():
+                        f.writelines(lines[output])
+        else:
+            if nlp is None:
+                print("Setting the NLP environment...")
+                nlp = language.set_nlp_environment(keep_ent_tokens)
+
+            for document in documents:
+                lines = annotate_document(document, nlp, output_labels,
+                    *annotation_args)
+                for output, f in files.items():
+                    f.writelines(lines[output])
+
+    #print(output_labels)
+    #stats_file = open(data_split + "-stats.csv", "w")
+    #for k, v in output_labels.items():
+    #    if len(v["docs"]) > 50000:
+    #        stats_file.write(k + "," + str(v["count"]) + "," + str(v["docs"])[:4990] + "..." + "\n")
+    #    else:
+    #        stats_file.write(k + "," + str(v["count"]) + "," + str(v["docs"]) + "\n")
+    #stats_file.close()
+
+
+def get_output_filepaths(data_split, corpus, encodings, maskings):
+    """Returns the path of the file of the split for each (encoding, masking)
+    pair. Raises a ValueError if two pairs would write to the same file (e.g.,
+    the "entity" and "type" maskings, which share the masked folder)."""
+    filepaths = {}
+    outputs = {}
+    for encoding in encodings:
+        for masking in maskings:
+            filepath = get_output_filepath(
+                data_split, corpus, encoding, masking)
+            if filepath in outputs:
+                raise ValueError("The {} and {} maskings would both be "
+                    "written to {}, produce them in separate runs".format(
+                    outputs[filepath][1], masking, filepath))
+            outputs[filepath] = (encoding, masking)
+            filepaths[(encoding, masking)] = filepath
+    return filepaths
+
+
+def get_output_filepath(data_split, corpus, encoding, masking):
+    """Returns the path of the file of the split with the given encoding and
+    masking, creating its folder if needed."""
     extra_info = "" #if multihead == False else ".mh"
 
-    print("Setting the NLP environment...")
-    nlp = language.set_nlp_environment(keep_ent_tokens)
-
-    for document in documents:
-        par_start_char = 0
-        par_end_char = 0
-        sent_id = 0
-
-        # Retrieve document-level edges from the event object
-        edges = parse_edges(document)
-
-        print("Processing", document.doc_id)
-
-        # Iterate over the paragraphs within the document object
-        for paragraph in document.paragraphs:
-            # Track relative paragraph "end position" within the document
-            par_end_char = par_start_char + len(paragraph) + 1
-
-            # Variable to track inter-paragraph offset of token indices to
-            # correctly get the span information subtracting it when printing
-            prev_token_num = 0
-
-            # Retrieve entities/triggers/edges falling within the paragraph
-            par_entities = filter_mentions(
-                par_start_char, par_end_char, document.entities)
-            par_triggers = filter_mentions(
-                par_start_char, par_end_char, document.triggers, overlap=True)
-            par_edges = filter_edges(
-                par_entities, par_triggers, edges, use_sec_entities)
-
-            # Create an NLP object and store the basic attributes
-            paragraph = nlp.make_doc(paragraph)
-            paragraph._.id = document.doc_id
-            paragraph._.start_char = par_start_char
-            paragraph._.entities = par_entities
-            paragraph._.triggers = par_triggers
-            paragraph._.edges = par_edges
-
-            # Apply a pipeline of NLP components to the paragraph
-            for name, proc in nlp.pipeline:
-                doc = proc(paragraph)
-
-            # For each sentence in the paragraph, build example objects
-            for sentence in doc.sents:
-                # Retrieve entities/triggers/edges falling within the sentence
-                sent_entities, sent_triggers = get_sent_mentions(
-                    sentence, paragraph._.entities, paragraph._.triggers)
-                sent_edges = filter_edges(
-                    sent_entities, sent_triggers, paragraph._.edges, 
-                    use_sec_entities)
-
-                # print("ORIGINAL")
-                # for e in sent_edges:
-                #     print(e.ev_id, e.ev_type, e.src_id, e.trg_id, e.ev_trg_id, e.arg_type)
-                # print()
-                
-                # Create an inverted dictionary for the edges (key: target)
-                trg_dict = {}
-                for edge in sent_edges:
-                    if edge.trg_id not in trg_dict.keys():
-                        trg_dict[edge.trg_id] = edge
-                    else:
-                        # print("The token [[{}]] has multiple incomings. Merging them.".format(edge.trg_id))
-                        # print("\tRetaining:   {}".format(trg_dict[edge.trg_id]))
-                        # print("\tSkipping:    {} {} {} {} {} {}".format(edge.ev_id, edge.ev_type, edge.src_id, edge.trg_id, edge.ev_trg_id, edge.arg_type))
-
-                        # Merge the information of other incoming edges
-                        if edge.src_id not in trg_dict[edge.trg_id].src_id.split(constants.SEP_MULTIPLE):
-                            trg_dict[edge.trg_id].ev_id = trg_dict[edge.trg_id].ev_id + constants.SEP_MULTIPLE + edge.ev_id
-                            trg_dict[edge.trg_id].ev_type = trg_dict[edge.trg_id].ev_type + constants.SEP_MULTIPLE + edge.ev_type
-                            trg_dict[edge.trg_id].src_id = trg_dict[edge.trg_id].src_id + constants.SEP_MULTIPLE + edge.src_id
-                            
-                            # Avoid concatenation of None with strings
-                            if trg_dict[edge.trg_id].ev_trg_id == edge.ev_trg_id == None:
-                                trg_dict[edge.trg_id].ev_trg_id = None
-                            else:
-                                trg_dict[edge.trg_id].ev_trg_id = trg_dict[edge.trg_id].ev_trg_id + constants.SEP_MULTIPLE + edge.ev_trg_id
-                            
-                            trg_dict[edge.trg_id].arg_type = trg_dict[edge.trg_id].arg_type + constants.SEP_MULTIPLE + edge.arg_type
-
-                # print("INVERTED")
-                # for k,e in trg_dict.items():
-                #     print(k, e.ev_id, e.ev_type, e.src_id, e.trg_id, e.ev_trg_id, e.arg_type)
-                # print()
-
-                # Create a linearised sequence view of entity and triggers
-                seq_ids = []
-                seq_types = []
-                for t in sentence:
-                    if t._.entity_id != None and t._.trigger_id != None:
-                        print("Warning. An entity cannot be a trigger too!")
+    filename = os.path.join(data_split + "." + encoding + extra_info)
 
-                    if t._.entity_id:
-                        seq_ids.append(t._.entity_id)
-                        seq_types.append(t._.entity_type)
-                    if t._.trigger_id:
-                        seq_ids.append(t._.trigger_id)
-                        seq_types.append(t._.trigger_type)
-
-                # Split multiple elements in the lists (it is supposed to 
-                # maintains the capability of considering order of triggers)
-                # e.g., [T1, T2////T3, T4] and [Ph, Ph////+Reg, Bi]
-                #       in [T1, T2, T3, T4] and [Ph, Ph, +Reg, Bi]
-                seq_ids = [id_ for e in seq_ids for id_ in e.split(constants.SEP_MULTIPLE)]
-                seq_types = [typ_ for e in seq_types for typ_ in e.split(constants.SEP_MULTIPLE)]
-
-                for t in sentence:
-                    if t._.entity_id in trg_dict.keys():
-                        t._.arg_of_id = trg_dict[t._.entity_id].src_id
-                        t._.arg_type = trg_dict[t._.entity_id].arg_type
-                        t._.arg_of_ev_type = trg_dict[t._.entity_id].ev_type
-
-                        if t._.arg_of_id not in seq_ids:
-                            # Manage the lookup of the arg_of_id when there
-                            # are multiple incoming edges from different
-                            # sources. Heuristics: keep the source with min ID
-                            if constants.SEP_MULTIPLE in t._.arg_of_id:
-                                min_id = 9999
-                                arg_of_ids = t._.arg_of_id.split(constants.SEP_MULTIPLE)
-                                x = []
-                                for i in range(len(arg_of_ids)):
-                                    x.append(paragraph._.triggers[arg_of_ids[i]].type_)
-                                    #if (int(arg_of_ids[i][1:]) < min_id):
-                                    #    id_idx = i
-                                    #    min_id = int(arg_of_ids[i][1:])
-
-                                if t._.entity_type:
-                                    source = [t._.entity_type]
-                                    id__ = [t._.entity_id]
-                                else:
-                                    source = [t._.trigger_type]
-                                    id__ =[t._.entity_id]
-                                simple_ = []
-                                complex_ = []
-                                for xx in x:
-                                    if xx in ["Positive_regulation", "Negative_regulation", "Regulation"]:
-                                        complex_.append(xx)
-                                    else:
-                                        simple_.append(xx)
-                                incomings.append([document.doc_id, id__, t.text, source, simple_, complex_])
-                                # print("Multiple incoming edges for {} in {}. We keep the one with the ID with a less high number.".format(t.text, document.doc_id))
+    if masking == "no":
+        not_masked_dir = os.path.join("data", corpus, "not-masked")
+        if not os.path.exists(not_masked_dir):
+            os.makedirs(not_masked_dir)
+        filepath = os.path.join(not_masked_dir, filename)
+    else:
+        masked_dir = os.path.join("data", corpus, "masked")
+        if not os.path.exists(masked_dir):
+            os.makedirs(masked_dir)
+        filepath = os.path.join(masked_dir, filename)
+
+    return filepath
+
+
+def annotate_document(document, nlp, output_labels, use_sec_entities,
+    keep_ent_tokens, keep_orphan_entities, encodings, multihead, maskings,
+    batch_size=BATCH_SIZE, cache=None):
+    """Returns the lines of the encoded sentences of the document for each
+    (encoding, masking) pair. Its paragraphs go through the nlp pipeline in
+    batches of batch_size (unless found in the cache)."""
+
+    EVENT_TYPES = constants.GE11_EVENT_TYPES
+    lines = {(encoding, masking): []
+        for encoding in encodings for masking in maskings}
+
+    # Retrieve document-level edges from the event object
+    edges = parse_edges(document)
+
+    print("Processing", document.doc_id)
+
+    paragraphs = make_paragraph_docs(document, edges, nlp, use_sec_entities)
+    if cache is not None:
+        paragraphs = pipe_cached_docs(nlp, paragraphs, cache, batch_size)
+    else:
+        paragraphs = pipe_docs(nlp, paragraphs, batch_size)
+
+    for paragraph in paragraphs:
+        # Variable to track inter-paragraph offset of token indices to
+        # correctly get the span information subtracting it when printing
+        prev_token_num = 0
+
+        # For each sentence in the paragraph, build example objects
+        for sentence in paragraph.sents:
+            # Retrieve entities/triggers/edges falling within the sentence
+            sent_entities, sent_triggers = get_sent_mentions(
+                sentence, paragraph._.entities, paragraph._.triggers)
+            sent_edges = filter_edges(
+                sent_entities, sent_triggers, paragraph._.edges, 
+                use_sec_entities, index=paragraph._.edges_index)
+
+            # print("ORIGINAL")
+            # for e in sent_edges:
+            #     print(e.ev_id, e.ev_type, e.src_id, e.trg_id, e.ev_trg_id, e.arg_type)
+            # print()
+        
+            # Create an inverted dictionary for the edges (key: target)
+            trg_dict = {}
+            for edge in sent_edges:
+                if edge.trg_id not in trg_dict.keys():
+                    trg_dict[edge.trg_id] = edge
+                else:
+                    # print("The token [[{}]] has multiple incomings. Merging them.".format(edge.trg_id))
+                    # print("\tRetaining:   {}".format(trg_dict[edge.trg_id]))
+                    # print("\tSkipping:    {} {} {} {} {} {}".format(edge.ev_id, edge.ev_type, edge.src_id, edge.trg_id, edge.ev_trg_id, edge.arg_type))
+
+                    # Merge the information of other incoming edges
+                    if edge.src_id not in trg_dict[edge.trg_id].src_id.split(constants.SEP_MULTIPLE):
+                        trg_dict[edge.trg_id].ev_id = trg_dict[edge.trg_id].ev_id + constants.SEP_MULTIPLE + edge.ev_id
+                        trg_dict[edge.trg_id].ev_type = trg_dict[edge.trg_id].ev_type + constants.SEP_MULTIPLE + edge.ev_type
+                        trg_dict[edge.trg_id].src_id = trg_dict[edge.trg_id].src_id + constants.SEP_MULTIPLE + edge.src_id
+                    
+                        # Avoid concatenation of None with strings
+                        if trg_dict[edge.trg_id].ev_trg_id == edge.ev_trg_id == None:
+                            trg_dict[edge.trg_id].ev_trg_id = None
+                        else:
+                            trg_dict[edge.trg_id].ev_trg_id = trg_dict[edge.trg_id].ev_trg_id + constants.SEP_MULTIPLE + edge.ev_trg_id
+                    
+                        trg_dict[edge.trg_id].arg_type = trg_dict[edge.trg_id].arg_type + constants.SEP_MULTIPLE + edge.arg_type
+
+            # print("INVERTED")
+            # for k,e in trg_dict.items():
+            #     print(k, e.ev_id, e.ev_type, e.src_id, e.trg_id, e.ev_trg_id, e.arg_type)
+            # print()
+
+            # Create a linearised sequence view of entity and triggers
+            seq_ids = []
+            seq_types = []
+            for t in sentence:
+                if t._.entity_id != None and t._.trigger_id != None:
+                    print("Warning. An entity cannot be a trigger too!")
+
+                if t._.entity_id:
+                    seq_ids.append(t._.entity_id)
+                    seq_types.append(t._.entity_type)
+                if t._.trigger_id:
+                    seq_ids.append(t._.trigger_id)
+                    seq_types.append(t._.trigger_type)
+
+            # Split multiple elements in the lists (it is supposed to 
+            # maintains the capability of considering order of triggers)
+            # e.g., [T1, T2////T3, T4] and [Ph, Ph////+Reg, Bi]
+            #       in [T1, T2, T3, T4] and [Ph, Ph, +Reg, Bi]
+            seq_ids = [id_ for e in seq_ids for id_ in e.split(constants.SEP_MULTIPLE)]
+            seq_types = [typ_ for e in seq_types for typ_ in e.split(constants.SEP_MULTIPLE)]
+
+            for t in sentence:
+                if t._.entity_id in trg_dict.keys():
+                    t._.arg_of_id = trg_dict[t._.entity_id].src_id
+                    t._.arg_type = trg_dict[t._.entity_id].arg_type
+                    t._.arg_of_ev_type = trg_dict[t._.entity_id].ev_type
+
+                    if t._.arg_of_id not in seq_ids:
+                        # Manage the lookup of the arg_of_id when there
+                        # are multiple incoming edges from different
+                        # sources. Heuristics: keep the source with min ID
+                        if constants.SEP_MULTIPLE in t._.arg_of_id:
+                            min_id = 9999
+                            arg_of_ids = t._.arg_of_id.split(constants.SEP_MULTIPLE)
+                            x = []
+                            for i in range(len(arg_of_ids)):
+                                x.append(paragraph._.triggers[arg_of_ids[i]].type_)
+                                #if (int(arg_of_ids[i][1:]) < min_id):
+                                #    id_idx = i
+                                #    min_id = int(arg_of_ids[i][1:])
+
+                            if t._.entity_type:
+                                source = [t._.entity_type]
+                                id__ = [t._.entity_id]
                             else:
-                                pass
+                                source = [t._.trigger_type]
+                                id__ =[t._.entity_id]
+                            simple_ = []
+                            complex_ = []
+                            for xx in x:
+                                if xx in ["Positive_regulation", "Negative_regulation", "Regulation"]:
+                                    complex_.append(xx)
+                                else:
+                                    simple_.append(xx)
+                            incomings.append([document.doc_id, id__, t.text, source, simple_, complex_])
+                            # print("Multiple incoming edges for {} in {}. We keep the one with the ID with a less high number.".format(t.text, document.doc_id))
                         else:
-                            id_idx = 0
+                            pass
+                    else:
+                        id_idx = 0
+
+                if t._.trigger_id is not None:
+                    # Manage the lookup of the trigger ID in the presence
+                    # of multiple IDs which cannot be retrieved after the
+                    # filtering of duplicate edges
+                    if constants.SEP_MULTIPLE in t._.trigger_id:
+                        trigger_ids = t._.trigger_id.split(constants.SEP_MULTIPLE)
+                    else:
+                        trigger_ids = [t._.trigger_id]
+
+                    for trigger_id in trigger_ids:
+                        if trigger_id in trg_dict.keys():
+                            t._.arg_type = trg_dict[trigger_id].arg_type
+                            t._.arg_of_id = trg_dict[trigger_id].src_id
+                            t._.arg_of_ev_type = trg_dict[trigger_id].ev_type
+
+                            if t._.arg_of_id not in seq_ids:
+                                # Manage the lookup of the arg_of_id when there
+                                # are multiple incoming edges from different
+                                # sources. Heuristics: keep the source with min ID
+                                if constants.SEP_MULTIPLE in t._.arg_of_id:
+                                    min_id = 9999
+                                    arg_of_ids = t._.arg_of_id.split(constants.SEP_MULTIPLE)
+                                    y = []
+                                    for i in range(len(arg_of_ids)):
+                                        y.append(paragraph._.triggers[arg_of_ids[i]].type_)
+                                        #if (int(arg_of_ids[i][1:]) < min_id):
+                                        #    id_idx = i
+                                        #    min_id = int(arg_of_ids[i][1:])
+                                    # print("Multiple incoming edges for {} in {}. We keep the one with the ID with a less high number.".format(t.text, document.doc_id))
+                                else:
+                                    pass
+                            else:
+                                id_idx = 0
+
+            for t in sentence:
+                if t._.arg_of_id:
+                    src_type = t._.arg_of_ev_type
+                    if t._.arg_of_id not in seq_ids:
+                        pass
+
+                    # Remove duplicates from the lists
+                    seq_ids, seq_types = filter_seq_duplicates(seq_ids, seq_types)
+
+                    # Get first and last token indexes for the src mention
+                    src_id_idx_firsts = []
+                    src_id_idx_lasts = []
+                    for arg in t._.arg_of_id.split(constants.SEP_MULTIPLE):
+                        src_id_idx_firsts.append(seq_ids.index(arg))
+                        src_id_idx_lasts.append((len(seq_ids)-1) - seq_ids[::-1].index(arg))
+                    #src_id_idx_first = seq_ids.index(t._.arg_of_id)
+                    #src_id_idx_last = (len(seq_ids)-1) - seq_ids[::-1].index(t._.arg_of_id)
 
-                    if t._.trigger_id is not None:
+                    if t._.entity_id:
+                        # Get first and last token indexes for the curr mention
+                        curr_id_idx_first = seq_ids.index(t._.entity_id)
+                        curr_id_idx_last = (len(seq_ids)-1) - seq_ids[::-1].index(t._.entity_id)
+                    elif t._.trigger_id:
                         # Manage the lookup of the trigger ID in the presence
                         # of multiple IDs which cannot be retrieved after the
                         # filtering of duplicate edges
                         if constants.SEP_MULTIPLE in t._.trigger_id:
                             trigger_ids = t._.trigger_id.split(constants.SEP_MULTIPLE)
+                            for id_ in trigger_ids:
+                                if id_ in seq_ids:
+                                    trigger_id = id_
+                        else:
+                            trigger_id = t._.trigger_id
+
+                        # Get first and last token indexes for the curr mention
+                        curr_id_idx_first = seq_ids.index(trigger_id)
+                        curr_id_idx_last = (len(seq_ids)-1) - seq_ids[::-1].index(trigger_id)
+
+                    t._.arg_of_position = ""
+                    for i in range(len(src_id_idx_firsts)):
+                        # Using "filter_seq_ids_duplicates()", first and last are the same
+                        # CASE: Curr start is before the source trigger start
+                        if curr_id_idx_first < src_id_idx_firsts[i]: # or last...last, it is the same
+                            ids_in_btw = seq_ids[curr_id_idx_last+1:src_id_idx_firsts[i]]
+                            types_in_btw = seq_types[curr_id_idx_last+1:src_id_idx_firsts[i]]
+                            rel_position = "+" + str(types_in_btw.count(src_type.split(constants.SEP_MULTIPLE)[i])+1)
+                            #print(seq_ids[curr_id_idx_first], ids_in_btw, types_in_btw, src_type, rel_position)
+                        # CASE: Curr start is after the source trigger start
+                        elif curr_id_idx_first > src_id_idx_firsts[i]:
+                            ids_in_btw = seq_ids[src_id_idx_lasts[i]+1:curr_id_idx_first]
+                            types_in_btw = seq_types[src_id_idx_lasts[i]+1:curr_id_idx_first]
+                            rel_position = "-" + str(types_in_btw.count(src_type.split(constants.SEP_MULTIPLE)[i])+1)
+                            #print(seq_ids[curr_id_idx_first], ids_in_btw, types_in_btw, src_type, rel_position)
                         else:
-                            trigger_ids = [t._.trigger_id]
-
-                        for trigger_id in trigger_ids:
-                            if trigger_id in trg_dict.keys():
-                                t._.arg_type = trg_dict[trigger_id].arg_type
-                                t._.arg_of_id = trg_dict[trigger_id].src_id
-                                t._.arg_of_ev_type = trg_dict[trigger_id].ev_type
-
-                                if t._.arg_of_id not in seq_ids:
-                                    # Manage the lookup of the arg_of_id when there
-                                    # are multiple incoming edges from different
-                                    # sources. Heuristics: keep the source with min ID
-                                    if constants.SEP_MULTIPLE in t._.arg_of_id:
-                                        min_id = 9999
-                                        arg_of_ids = t._.arg_of_id.split(constants.SEP_MULTIPLE)
-                                        y = []
-                                        for i in range(len(arg_of_ids)):
-                                            y.append(paragraph._.triggers[arg_of_ids[i]].type_)
-                                            #if (int(arg_of_ids[i][1:]) < min_id):
-                                            #    id_idx = i
-                                            #    min_id = int(arg_of_ids[i][1:])
-                                        # print("Multiple incoming edges for {} in {}. We keep the one with the ID with a less high number.".format(t.text, document.doc_id))
-                                    else:
-                                        pass
-                                else:
-                                    id_idx = 0
-
-                for t in sentence:
-                    if t._.arg_of_id:
-                        src_type = t._.arg_of_ev_type
-                        if t._.arg_of_id not in seq_ids:
                             pass
 
-                        # Remove duplicates from the lists
-                        seq_ids, seq_types = filter_seq_duplicates(seq_ids, seq_types)
-
-                        # Get first and last token indexes for the src mention
-                        src_id_idx_firsts = []
-                        src_id_idx_lasts = []
-                        for arg in t._.arg_of_id.split(constants.SEP_MULTIPLE):
-                            src_id_idx_firsts.append(seq_ids.index(arg))
-                            src_id_idx_lasts.append((len(seq_ids)-1) - seq_ids[::-1].index(arg))
-                        #src_id_idx_first = seq_ids.index(t._.arg_of_id)
-                        #src_id_idx_last = (len(seq_ids)-1) - seq_ids[::-1].index(t._.arg_of_id)
-
-                        if t._.entity_id:
-                            # Get first and last token indexes for the curr mention
-                            curr_id_idx_first = seq_ids.index(t._.entity_id)
-                            curr_id_idx_last = (len(seq_ids)-1) - seq_ids[::-1].index(t._.entity_id)
-                        elif t._.trigger_id:
-                            # Manage the lookup of the trigger ID in the presence
-                            # of multiple IDs which cannot be retrieved after the
-                            # filtering of duplicate edges
-                            if constants.SEP_MULTIPLE in t._.trigger_id:
-                                trigger_ids = t._.trigger_id.split(constants.SEP_MULTIPLE)
-                                for id_ in trigger_ids:
-                                    if id_ in seq_ids:
-                                        trigger_id = id_
-                            else:
-                                trigger_id = t._.trigger_id
-
-                            # Get first and last token indexes for the curr mention
-                            curr_id_idx_first = seq_ids.index(trigger_id)
-                            curr_id_idx_last = (len(seq_ids)-1) - seq_ids[::-1].index(trigger_id)
-
-                        t._.arg_of_position = ""
-                        for i in range(len(src_id_idx_firsts)):
-                            # Using "filter_seq_ids_duplicates()", first and last are the same
-                            # CASE: Curr start is before the source trigger start
-                            if curr_id_idx_first < src_id_idx_firsts[i]: # or last...last, it is the same
-                                ids_in_btw = seq_ids[curr_id_idx_last+1:src_id_idx_firsts[i]]
-                                types_in_btw = seq_types[curr_id_idx_last+1:src_id_idx_firsts[i]]
-                                rel_position = "+" + str(types_in_btw.count(src_type.split(constants.SEP_MULTIPLE)[i])+1)
-                                #print(seq_ids[curr_id_idx_first], ids_in_btw, types_in_btw, src_type, rel_position)
-                            # CASE: Curr start is after the source trigger start
-                            elif curr_id_idx_first > src_id_idx_firsts[i]:
-                                ids_in_btw = seq_ids[src_id_idx_lasts[i]+1:curr_id_idx_first]
-                                types_in_btw = seq_types[src_id_idx_lasts[i]+1:curr_id_idx_first]
-                                rel_position = "-" + str(types_in_btw.count(src_type.split(constants.SEP_MULTIPLE)[i])+1)
-                                #print(seq_ids[curr_id_idx_first], ids_in_btw, types_in_btw, src_type, rel_position)
-                            else:
-                                pass
-
-                            if t._.arg_of_position != "":
-                                t._.arg_of_position += constants.SEP_MULTIPLE + rel_position
-                            else:
-                                t._.arg_of_position += rel_position
-
-                #for t in sentence:
-                #    print(t.i, t.text, t._.entity_id, t._.entity_type, t._.trigger_id, t._.trigger_type, t._.arg_of_id, t._.arg_of_ev_type, t._.arg_of_position, t._.trigger_cardinal)
-                #print()
-                filename = os.path.join(data_split + "." + encoding + extra_info)
-
-                if masking == "no":
-                    not_masked_dir = os.path.join("data", corpus, "not-masked")
-                    if not os.path.exists(not_masked_dir):
-                        os.makedirs(not_masked_dir)
-                    filepath = os.path.join(not_masked_dir, filename)
-                else:
-                    masked_dir = os.path.join("data", corpus, "masked")
-                    if not os.path.exists(masked_dir):
-                        os.makedirs(masked_dir)
-                    filepath = os.path.join(masked_dir, filename)
-
-                with open(filepath, "a") as f:
-                    f.write("# doc_id = " + document.doc_id + "\n")
-                    for token in sentence:
-                        token_info = get_token_info(token, sentence, prev_token_num, par_start_char, keep_ent_tokens)
-                        token_features = get_token_features(token)
-
-                        # @WARN: Take care if we change the way we encode features
-                        feats = token_features.split(constants.SEP_COLUMN)
-                        for feat in feats:
-                            if feat.startswith("[ENT]"):
-                                ent_type = feat.split("]")[1]
-                                break
-                            ent_type = "-"
-
-                        encoded_token, output_labels = encode_token(token, output_labels, document.doc_id, keep_orphan_entities, encoding, multihead)
-                        if masking == "entity":
-                            word = token.text if ent_type == "-" else "$ENTITY$"
-                            f.write(word + constants.SEP_COLUMN + token_info + constants.SEP_COLUMN + token_features + constants.SEP_COLUMN + encoded_token + "\n")
-                        elif masking == "type":
-                            word = token.text if ent_type == "-" else "$" + ent_type.upper() + "$"
-                            f.write(word + constants.SEP_COLUMN + token_info + constants.SEP_COLUMN + token_features + constants.SEP_COLUMN + encoded_token + "\n")
+                        if t._.arg_of_position != "":
+                            t._.arg_of_position += constants.SEP_MULTIPLE + rel_position
                         else:
-                            f.write(token.text + constants.SEP_COLUMN + token_info + constants.SEP_COLUMN + token_features + constants.SEP_COLUMN + encoded_token + "\n")
-                    f.write("\n")
+                            t._.arg_of_position += rel_position
+
+            #for t in sentence:
+            #    print(t.i, t.text, t._.entity_id, t._.entity_type, t._.trigger_id, t._.trigger_type, t._.arg_of_id, t._.arg_of_ev_type, t._.arg_of_position, t._.trigger_cardinal)
+            #print()
+            for output_lines in lines.values():
+                output_lines.append("# doc_id = " + document.doc_id + "\n")
+            for token in sentence:
+                token_info = get_token_info(token, sentence, prev_token_num, paragraph._.start_char, keep_ent_tokens)
+                token_features = get_token_features(token)
+
+                # @WARN: Take care if we change the way we encode features
+                feats = token_features.split(constants.SEP_COLUMN)
+                for feat in feats:
+                    if feat.startswith("[ENT]"):
+                        ent_type = feat.split("]")[1]
+                        break
+                    ent_type = "-"
+
+                encoded_tokens = {}
+                for encoding in encodings:
+                    encoded_tokens[encoding], output_labels = encode_token(token, output_labels, document.doc_id, keep_orphan_entities, encoding, multihead)
+
+                words = {}
+                for masking in maskings:
+                    if masking == "entity":
+                        words[masking] = token.text if ent_type == "-" else "$ENTITY$"
+                    elif masking == "type":
+                        words[masking] = token.text if ent_type == "-" else "$" + ent_type.upper() + "$"
+                    else:
+                        words[masking] = token.text
+
+                for (encoding, masking), output_lines in lines.items():
+                    output_lines.append(words[masking] + constants.SEP_COLUMN + token_info + constants.SEP_COLUMN + token_features + constants.SEP_COLUMN + encoded_tokens[encoding] + "\n")
+            for output_lines in lines.values():
+                output_lines.append("\n")
+
+            # Track the number of past tokens
+            prev_token_num += len(sentence)
+
+    return lines
+
+
+def make_paragraph_docs(document, edges, nlp, use_sec_entities):
+    """Returns a doc for each paragraph of the document (not processed by the
+    pipeline yet), holding the entities/triggers/edges of the paragraph."""
+    docs = []
+    par_start_char = 0
+    par_end_char = 0
+
+    # Index the mentions by start char and the edges by source mention,
+    # to look up the ones of each paragraph
+    entities_index = index_mentions(document.entities)
+    edges_index = index_edges(edges)
+    are_triggers_resolved = False
+
+    # Iterate over the paragraphs within the document object
+    for paragraph in document.paragraphs:
+        # Track relative paragraph "end position" within the document
+        par_end_char = par_start_char + len(paragraph) + 1
+
+        # Resolve the overlapping triggers (again, as it can shrink the
+        # triggers overlapping the resolved ones) until nothing changes
+        if not are_triggers_resolved:
+            are_triggers_resolved = not resolve_overlapping_mentions(
+                document.triggers)
+            triggers_index = index_mentions(document.triggers)
+
+        # Retrieve entities/triggers/edges falling within the paragraph
+        par_entities = filter_mentions(
+            par_start_char, par_end_char, document.entities,
+            index=entities_index)
+        par_triggers = filter_mentions(
+            par_start_char, par_end_char, document.triggers,
+            index=triggers_index)
+        par_edges = filter_edges(
+            par_entities, par_triggers, edges, use_sec_entities,
+            index=edges_index)
+
+        # The paragraph goes through the pipeline after the triggers of the
+        # next ones are resolved, so keep a copy of the ones it sees now
+        if not are_triggers_resolved:
+            par_triggers = {id_: copy.copy(trigger)
+                for id_, trigger in par_triggers.items()}
+
+        # Create an NLP object and store the basic attributes
+        doc = nlp.make_doc(paragraph)
+        doc._.id = document.doc_id
+        doc._.start_char = par_start_char
+        doc._.entities = par_entities
+        doc._.triggers = par_triggers
+        doc._.edges = par_edges
+        doc._.edges_index = index_edges(par_edges)
+        docs.append(doc)
+
+        # Track relative paragraph "start" position within the document
+        par_start_char = par_end_char
+
+    return docs
+
+
+def pipe_docs(nlp, docs, batch_size=BATCH_SIZE):
+    """Applies the pipeline of nlp to the docs, as nlp.pipe does to texts:
+    the components that can process docs in batches (e.g., the tagger and the
+    parser) do so, the others process them one by one."""
+    for name, proc in nlp.pipeline:
+        if hasattr(proc, "pipe"):
+            docs = proc.pipe(docs, batch_size=batch_size)
+        else:
+            docs = map(proc, docs)
+    return docs
 
-                # Track the number of past tokens
-                prev_token_num += len(sentence)
 
-            # Track relative paragraph "start" position within the document
-            par_start_char = par_end_char
+def pipe_cached_docs(nlp, docs, cache, batch_size=BATCH_SIZE):
+    """Like pipe_docs, but the docs found in the cache are loaded from it,
+    and only the others go through the pipeline (and are added to it)."""
+    keys = [cache.get_key(nlp, doc) for doc in docs]
+    cached_docs = [cache.load(nlp, doc, key) for doc, key in zip(docs, keys)]
+    processed_docs = iter(pipe_docs(nlp, [doc for doc, cached_doc in zip(
+        docs, cached_docs) if cached_doc is None], batch_size))
 
-    #print(output_labels)
-    #stats_file = open(data_split + "-stats.csv", "w")
-    #for k, v in output_labels.items():
-    #    if len(v["docs"]) > 50000:
-    #        stats_file.write(k + "," + str(v["count"]) + "," + str(v["docs"])[:4990] + "..." + "\n")
-    #    else:
-    #        stats_file.write(k + "," + str(v["count"]) + "," + str(v["docs"]) + "\n")
-    #stats_file.close()
+    for key, cached_doc in zip(keys, cached_docs):
+        if cached_doc is None:
+            cached_doc = next(processed_docs)
+            cache.save(cached_doc, key)
+        yield cached_doc
+
+
+def set_worker_nlp(keep_ent_tokens):
+    """Sets up the nlp environment of a worker process."""
+    global worker_nlp
+    worker_nlp = language.set_nlp_environment(keep_ent_tokens)
+
+
+def annotate_document_in_worker(args):
+    document = args[0]
+    return annotate_document(document, worker_nlp, {}, *args[1:])
 
 
 def filter_seq_duplicates(seq_ids, seq_types):
@@ -650,108 +810,152 @@ def parse_edges(document):
     return edges
 
 
-def filter_mentions(start_char, end_char, mentions, overlap=False):
+def index_mentions(mentions):
+    """Sorts the mentions by start char, so that filter_mentions can bisect
+    them. The index must be rebuilt if the mentions change."""
+    ordered = sorted((mention.start, position, id_)
+        for position, (id_, mention) in enumerate(mentions.items()))
+    return ([start for start, _, _ in ordered],
+            [position for _, position, _ in ordered],
+            [id_ for _, _, id_ in ordered])
+
+
+def filter_mentions(start_char, end_char, mentions, overlap=False, index=None):
+    """Returns the mentions starting within [start_char, end_char), in their
+    original order. With an index (see index_mentions), they are bisected
+    instead of scanned."""
     if overlap:
-        prev_start = -1
-        prev_end = -1
-        prev_type = None
-        prev_mention = None
-        spurious_mentions = []
-
-        for mention in mentions.items():
-            curr_start = mention[1].start
-            curr_end = mention[1].end
-            curr_type = mention[1].type_
-
-            # If multiple triggers on the same token, go to the next
-            if (curr_start == prev_start) and (curr_end == prev_end):
-                continue
-
-            # Overlapping when there is the same start char index
-            elif (curr_start == prev_start):
-                # CASE: [x/y, ..., y]
-                if (curr_end > prev_end):
-                    # If we have the same type, keep the largest
-                    if curr_type == prev_type:
-                        spurious_mentions.append(prev_mention)
-                        # print("Overlapping found and one deleted")
-                    # O.w., split into two parts, recalculating y start
-                    else:
-                        curr_start = prev_end + 1
-                        mention[1].start = curr_start
-                        # print("Overlapping found and managed")
-
-                # CASE: [x/y, ..., x]
-                elif (curr_end < prev_end):
-                    # If we have the same type, keep the largest
-                    if curr_type == prev_type:
-                        spurious_mentions.append(mention)
-                        # print("Overlapping found and one deleted")
-                    # O.w., split into two parts, recalculating x start
-                    else:
-                        prev_start = curr_end + 1
-                        prev_mention[1].start = prev_start
-                        # print("Overlapping found and managed")
-
-            # Overlapping when there is the same end char index
-            elif (curr_end == prev_end):
-                # CASE: [x, ..., x/y]
-                if (curr_start > prev_start):
-                    # If we have the same type, keep the largest
-                    if curr_type == prev_type:
-                        spurious_mentions.append(mention)
-                        # print("Overlapping found and one deleted")
-                    # O.w., split into two parts, recalculating x end
-                    else:
-                        prev_end = curr_start - 1
-                        prev_mention[1].end = prev_end
-                        # print("Overlapping found and managed")
-
-                # CASE: [y, ..., x/y]
-                elif (curr_start < prev_start):
-                    # If we have the same type, keep the largest
-                    if curr_type == prev_type:
-                        spurious_mentions.append(prev_mention)
-                        # print("Overlapping found and one deleted")
-                    # O.w., split into two parts, recalculating y end
-                    else:
-                        curr_end = prev_start - 1
-                        mention[1].end = curr_end
-                        # print("Overlapping found and managed")
-
-            # Current token in the middle of the previous one
-            elif (curr_start > prev_start) and (curr_end < prev_end):
-                curr_start = prev_start
-                curr_end = prev_end
-                spurious_mentions.append(mention)
-                # print("Overlapping found and one deleted")
-
-            # Current token enclosing the previous one
-            elif (curr_start < prev_start) and (curr_end > prev_end):
-                spurious_mentions.append(prev_mention)
-                # print("Overlapping found and one deleted")
-
-            # O.w., we have different spans
-            else:
-                pass
+        resolve_overlapping_mentions(mentions)
+
+    if index is None:
+        filtered_mentions = {id_: mention for id_, mention in mentions.items() 
+                    if (start_char <= mention.start < end_char)}
+        return filtered_mentions
+
+    starts, positions, ids = index
+    first = bisect.bisect_left(starts, start_char)
+    last = bisect.bisect_left(starts, end_char)
+    in_scope = sorted(zip(positions[first:last], ids[first:last]))
+    return {id_: mentions[id_] for _, id_ in in_scope}
+
+
+def resolve_overlapping_mentions(mentions):
+    """Removes or shrinks (in place) the mentions overlapping the previous
+    one. Returns whether any mention has changed."""
+    spans = [(id_, mention.start, mention.end) for id_, mention in mentions.items()]
+    prev_start = -1
+    prev_end = -1
+    prev_type = None
+    prev_mention = None
+    spurious_mentions = []
+
+    for mention in mentions.items():
+        curr_start = mention[1].start
+        curr_end = mention[1].end
+        curr_type = mention[1].type_
+
+        # If multiple triggers on the same token, go to the next
+        if (curr_start == prev_start) and (curr_end == prev_end):
+            continue
+
+        # Overlapping when there is the same start char index
+        elif (curr_start == prev_start):
+            # CASE: [x/y, ..., y]
+            if (curr_end > prev_end):
+                # If we have the same type, keep the largest
+                if curr_type == prev_type:
+                    spurious_mentions.append(prev_mention)
+                    # print("Overlapping found and one deleted")
+                # O.w., split into two parts, recalculating y start
+                else:
+                    curr_start = prev_end + 1
+                    mention[1].start = curr_start
+                    # print("Overlapping found and managed")
+
+            # CASE: [x/y, ..., x]
+            elif (curr_end < prev_end):
+                # If we have the same type, keep the largest
+                if curr_type == prev_type:
+                    spurious_mentions.append(mention)
+                    # print("Overlapping found and one deleted")
+                # O.w., split into two parts, recalculating x start
+                else:
+                    prev_start = curr_end + 1
+                    prev_mention[1].start = prev_start
+                    # print("Overlapping found and managed")
+
+        # Overlapping when there is the same end char index
+        elif (curr_end == prev_end):
+            # CASE: [x, ..., x/y]
+            if (curr_start > prev_start):
+                # If we have the same type, keep the largest
+                if curr_type == prev_type:
+                    spurious_mentions.append(mention)
+                    # print("Overlapping found and one deleted")
+                # O.w., split into two parts, recalculating x end
+                else:
+                    prev_end = curr_start - 1
+                    prev_mention[1].end = prev_end
+                    # print("Overlapping found and managed")
+
+            # CASE: [y, ..., x/y]
+            elif (curr_start < prev_start):
+                # If we have the same type, keep the largest
+                if curr_type == prev_type:
+                    spurious_mentions.append(prev_mention)
+                    # print("Overlapping found and one deleted")
+                # O.w., split into two parts, recalculating y end
+                else:
+                    curr_end = prev_start - 1
+                    mention[1].end = curr_end
+                    # print("Overlapping found and managed")
+
+        # Current token in the middle of the previous one
+        elif (curr_start > prev_start) and (curr_end < prev_end):
+            curr_start = prev_start
+            curr_end = prev_end
+            spurious_mentions.append(mention)
+            # print("Overlapping found and one deleted")
+
+        # Current token enclosing the previous one
+        elif (curr_start < prev_start) and (curr_end > prev_end):
+            spurious_mentions.append(prev_mention)
+            # print("Overlapping found and one deleted")
+
+        # O.w., we have different spans
+        else:
+            pass
 
-            prev_start = curr_start
-            prev_end = curr_end
-            prev_type = curr_type
-            prev_mention = mention
+        prev_start = curr_start
+        prev_end = curr_end
+        prev_type = curr_type
+        prev_mention = mention
 
-        # Remove spurious mentions
-        for sp_mention in spurious_mentions:
-            del mentions[sp_mention[0]]
+    # Remove spurious mentions
+    for sp_mention in spurious_mentions:
+        del mentions[sp_mention[0]]
 
-    filtered_mentions = {id_: mention for id_, mention in mentions.items() 
-                if (start_char <= mention.start < end_char)}
-    return filtered_mentions
+    return spans != [(id_, mention.start, mention.end) for id_, mention in mentions.items()]
 
 
-def filter_edges(entities, triggers, edges, use_sec_entities):
+def index_edges(edges):
+    """Maps each source mention ID to the positions of its edges, so that
+    filter_edges only visits the edges of the triggers in scope."""
+    edges_by_src = {}
+    for position, edge in enumerate(edges):
+        edges_by_src.setdefault(edge.src_id, []).append(position)
+    return edges_by_src
+
+
+def filter_edges(entities, triggers, edges, use_sec_entities, index=None):
     filtered = []
 
+    # With an index (see index_edges), only visit the edges whose source is a
+    # trigger in scope, in their original order
+    if index is not None:
+        edges = [edges[position] for position in sorted(
+            position for src_id in triggers for position in index.get(src_id, []))]
+
     # If both source and target mention IDs are in the par/sent scope of the
     # pre-filtered entity and trigger lists, retain them
     for edge in edges:
@@ -786,19 +990,15 @@ def filter_edges(entities, triggers, edges, use_sec_entities):
                 # print("The edge has the same source and target. Skipping.")
 
     # Remove duplicates on the equality of start/end trigger and end event ID
-    edges_tmp = []
-    dupl_edges_idx = []
-    for i in range(len(filtered)):
-        identity_edge = (filtered[i].src_id, filtered[i].trg_id, filtered[i].ev_trg_id)
+    edges_tmp = set()
+    unique = []
+    for edge in filtered:
+        identity_edge = (edge.src_id, edge.trg_id, edge.ev_trg_id)
         if identity_edge not in edges_tmp:
-            edges_tmp.append(identity_edge)
-        else:
-            dupl_edges_idx.append(i)
-
-    for index in sorted(dupl_edges_idx, reverse=True):
-        del filtered[index]
+            edges_tmp.add(identity_edge)
+            unique.append(edge)
 
-    return filtered
+    return unique
 
 
 def get_sent_mentions(sentence, par_entities, par_triggers):
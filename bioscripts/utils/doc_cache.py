@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import spacy
+from spacy.tokens import Doc
+from utils import constants
+
+# Bump it whenever the custom pipeline components change the analysis, to
+# stop reusing the docs cached by the former ones
+CACHE_VERSION = 1
+
+# Document-level attributes describing the context of a paragraph, rather
+# than its analysis (they hold objects that cannot be serialized either)
+CONTEXT_ATTRS = ["id", "start_char", "entities", "triggers", "edges",
+    "edges_index"]
+
+
+class DocCache:
+    """An on-disk cache of the paragraph docs processed by the nlp pipeline.
+    A doc is addressed by the hash of its text, of the ids and spans of its
+    gold mentions (which CorpusER retokenizes it on), and of the model and
+    pipeline configuration. The mention types do not change the analysis, so
+    they are not part of the key and are set again when loading a doc: the
+    cached docs are reused across encodings, maskings and Binding renamings."""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_key(self, nlp, doc):
+        """Returns the key of a doc not processed by the pipeline yet."""
+        mentions = []
+        for ann_type in ["entities", "triggers"]:
+            for id_, mention in (doc._.get(ann_type) or {}).items():
+                mentions.append([ann_type, id_,
+                    mention.start - doc._.start_char,
+                    mention.end - doc._.start_char])
+
+        content = {
+            "cache_version": CACHE_VERSION,
+            "spacy_version": spacy.__version__,
+            "model": [nlp.meta.get("name"), nlp.meta.get("version")],
+            "pipeline": nlp.pipe_names,
+            "keep_ent_tokens": nlp.get_pipe("corpus_er").keep_ent_tokens,
+            "text": doc.text,
+            "mentions": mentions}
+        data = json.dumps(content, sort_keys=True).encode("utf-8")
+
+        return hashlib.sha256(data).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".bin")
+
+    def load(self, nlp, doc, key):
+        """Returns the processed version of the doc if cached, else None."""
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "rb") as f:
+            cached_doc = Doc(nlp.vocab).from_bytes(f.read())
+
+        for attr in CONTEXT_ATTRS:
+            cached_doc._.set(attr, doc._.get(attr))
+        set_mention_types(cached_doc)
+
+        return cached_doc
+
+    def save(self, doc, key):
+        """Stores a doc processed by the pipeline (and not annotated yet)."""
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Leave the document-level attributes out of the serialized doc
+        user_data = doc.user_data
+        doc.user_data = {k: v for k, v in user_data.items()
+            if not (k[0] == "._." and k[2] is None)}
+        try:
+            data = doc.to_bytes()
+        finally:
+            doc.user_data = user_data
+
+        # Write to a temporary file first, as other processes may be reading
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def set_mention_types(doc):
+    """Sets the types of the gold mentions (with their ids in the same order)
+    in the tokens of a cached doc, the way CorpusER does when annotating them,
+    i.e., adding the mentions of a token in order by type."""
+    for ann_type, mentions in [("entity", doc._.entities),
+        ("trigger", doc._.triggers)]:
+        if not mentions:
+            continue
+        order = {id_: i for i, id_ in enumerate(mentions)}
+
+        for token in doc:
+            token_ids = token._.get(ann_type + "_id")
+            if token_ids is None:
+                continue
+
+            types = ids = None
+            for id_ in sorted(token_ids.split(constants.SEP_MULTIPLE),
+                key=order.get):
+                type_ = mentions[id_].type_
+                if types is None:
+                    types, ids = type_, id_
+                elif type_ < types:
+                    types = type_ + constants.SEP_MULTIPLE + types
+                    ids = id_ + constants.SEP_MULTIPLE + ids
+                else:
+                    types = types + constants.SEP_MULTIPLE + type_
+                    ids = ids + constants.SEP_MULTIPLE + id_
+
+            token._.set(ann_type + "_type", types)
+            token._.set(ann_type + "_id", ids)
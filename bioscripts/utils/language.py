@@ -54,6 +54,7 @@ def set_nlp_environment(keep_ent_tokens):
         Doc.set_extension("entities", default=None, force=True)
         Doc.set_extension("triggers", default=None, force=True)
         Doc.set_extension("edges", default=None, force=True)
+        Doc.set_extension("edges_index", default=None, force=True)
 
         return nlp
 
@@ -0,0 +1,107 @@
+"""
+Run the (frozen) BERT embedder once over the splits of the datasets and cache its per-token output in float16,
+to train the decoders from it (with ``train.py --embedding_cache``) without running BERT at every epoch
+"""
+
+import logging
+import argparse
+
+import torch
+
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.util import import_submodules
+from allennlp.data import DatasetReader, Instance, Token, Vocabulary
+from allennlp.data.dataset import Batch
+from allennlp.data.fields import TextField
+from allennlp.modules.token_embedders import TokenEmbedder
+from allennlp.nn import util as nn_util
+
+from udify import util
+from udify.dataset_readers.universal_dependencies import read_columns
+from udify.modules.embedding_cache import get_key, save_embedding_cache
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_config", default="", type=str, help="Configuration file for datasets")
+parser.add_argument("--parameters_config", default="", type=str, help="Configuration file for parameters of the model")
+parser.add_argument("--output_dir", required=True, type=str, help="The directory where to save the embeddings")
+parser.add_argument("--embedder", default="bert", type=str, help="The token embedder whose output is cached")
+parser.add_argument("--device", default=None, type=int, help="CUDA device; set to -1 for CPU")
+parser.add_argument("--batch_size", default=64, type=int, help="The number of sentences embedded at once")
+
+SPLITS = ["train", "dev", "test"]
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    import_submodules("udify")
+
+    overrides = {"trainer": {"cuda_device": args.device}} if args.device is not None else {}
+    params = util.merge_configs(args.parameters_config, args.dataset_config, overrides)
+    cuda_device = params["trainer"]["cuda_device"]
+
+    reader_params = params.pop("dataset_reader")
+    reader_params.pop("indexed_dir", None)
+    reader = DatasetReader.from_params(reader_params)
+
+    # The words of the sentences of all the splits, once each
+    sentences = {}
+    for dataset in reader.datasets:
+        for split in SPLITS:
+            logger.info(f"Reading the {split} split of {dataset}")
+            for sent, _ in read_columns(reader.datasets[dataset][split]):
+                words = reader.sentence_to_tasks(dataset, sent)[0]["words"]
+                sentences.setdefault(get_key(words), words)
+
+    embedder_params = params["model"]["text_field_embedder"]
+    indexer_keys = embedder_params.get("embedder_to_indexer_map", {}).get(args.embedder, [args.embedder])
+    embedder_params = embedder_params["token_embedders"][args.embedder]
+    combine_layers = embedder_params.get("combine_layers", "mix")
+    if combine_layers == "mix":
+        raise ConfigurationError("The mix of the layers is trained, only the output of the embedder with "
+                                 "combine_layers \"all\" or \"last\" can be cached")
+    embedder_params["requires_grad"] = False
+    embedder = TokenEmbedder.from_params(vocab=Vocabulary(), params=embedder_params)
+    embedder.eval()
+    if cuda_device >= 0:
+        embedder.cuda(cuda_device)
+
+    # The rows of the sentences, by length so that the batches are padded little
+    keys = sorted(sentences, key=lambda key: len(sentences[key]))
+    rows = {}
+    num_tokens = 0
+    for key in keys:
+        rows[key] = (num_tokens, len(sentences[key]))
+        num_tokens += len(sentences[key])
+
+    embeddings = save_embedding_cache(args.output_dir, args.embedder, combine_layers, embedder.max_layers,
+                                      rows, num_tokens, embedder.get_output_dim())
+
+    logger.info(f"Caching the embeddings of {len(keys)} sentences ({num_tokens} tokens) in {args.output_dir}")
+    # Only the wordpiece ids are embedded, so the instances need no labels and no vocabulary
+    vocab = Vocabulary()
+    with torch.no_grad():
+        for batch_start in range(0, len(keys), args.batch_size):
+            batch_keys = keys[batch_start:batch_start + args.batch_size]
+            batch = Batch([Instance({"tokens": TextField([Token(word) for word in sentences[key]],
+                                                         reader._token_indexers)})  # pylint: disable=protected-access
+                           for key in batch_keys])
+            batch.index_instances(vocab)
+            tokens = nn_util.move_to_device(batch.as_tensor_dict()["tokens"], cuda_device)
+
+            output = embedder(*[tokens[indexer_key] for indexer_key in indexer_keys])
+            if combine_layers != "all":
+                output = output.unsqueeze(0)
+            output = output.transpose(0, 1).half().cpu().numpy()
+
+            start = rows[batch_keys[0]][0]
+            for i, key in enumerate(batch_keys):
+                length = rows[key][1]
+                embeddings[start:start + length] = output[i, :, :length].transpose(1, 0, 2)
+                start += length
+
+    embeddings.flush()
+    logger.info(f"Train with: python train.py ... --embedding_cache {args.output_dir}")
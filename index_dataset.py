@@ -0,0 +1,30 @@
+"""
+Index the splits of the datasets once and save them in binary form, to be loaded by the dataset reader
+(with ``train.py --indexed_dir``) without tokenizing and indexing them again
+"""
+
+import logging
+import argparse
+
+from allennlp.common.util import import_submodules
+
+from udify import util
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_config", default="", type=str, help="Configuration file for datasets")
+parser.add_argument("--parameters_config", default="", type=str, help="Configuration file for parameters of the model")
+parser.add_argument("--output_dir", required=True, type=str, help="The directory where to save the indexed splits")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    import_submodules("udify")
+
+    params = util.merge_configs(args.parameters_config, args.dataset_config, {})
+    util.index_datasets(params, args.output_dir)
+
+    logger.info(f"Train with: python train.py ... --indexed_dir {args.output_dir}")
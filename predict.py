@@ -3,6 +3,7 @@ Predict conllu files given a trained model
 """
 
 import os
+import json
 import shutil
 import logging
 import argparse
@@ -27,35 +28,58 @@ parser.add_argument("--eval_file", default=None, type=str,
                     help="If set, evaluate the prediction and store it in the given file")
 parser.add_argument("--device", default=0, type=int, help="CUDA device number; set to -1 for CPU")
 parser.add_argument("--batch_size", default=1, type=int, help="The size of each prediction batch")
-parser.add_argument("--lazy", action="store_true", help="Lazy load dataset")
+parser.add_argument("--lazy", action="store_true", help="Stream the input file instead of loading it all in memory")
+parser.add_argument("--sort_by_length", action="store_true",
+                    help="Batch sentences of similar length together (the output keeps the input order)")
+parser.add_argument("--max_tokens_per_batch", default=None, type=int,
+                    help="With --sort_by_length, the maximum number of (padded) tokens in a batch")
+parser.add_argument("--workers", default=1, type=int,
+                    help="Split the input among this many processes, each using its share of the CPU cores")
+parser.add_argument("--quantize", action="store_true",
+                    help="Predict with a dynamically quantized int8 model (CPU only, faster but slightly less accurate)")
+parser.add_argument("--pack_sequences", action="store_true",
+                    help="Pack the short sentences of a batch into a single BERT sequence (faster, same output)")
 parser.add_argument("--raw_text", action="store_true", help="Input raw sentences, one per line in the input file.")
 
-args = parser.parse_args()
 
-import_submodules("udify")
+def main():
+    args = parser.parse_args()
 
-archive_dir = Path(args.archive).resolve().parent
+    import_submodules("udify")
 
-if not os.path.isfile(archive_dir / "weights.th"):
-    with tarfile.open(args.archive) as tar:
-        tar.extractall(archive_dir)
+    archive_dir = Path(args.archive).resolve().parent
 
-config_file = archive_dir / "config.json"
+    if not os.path.isfile(archive_dir / "weights.th"):
+        with tarfile.open(args.archive) as tar:
+            tar.extractall(archive_dir)
 
-overrides = {}
-if args.device is not None:
-    overrides["trainer"] = {"cuda_device": args.device}
-if args.lazy:
-    overrides["dataset_reader"] = {"lazy": args.lazy}
-configs = [Params(overrides), Params.from_file(config_file)]
-#TODO, cannot override anymore!
-params = Params.from_file(config_file)
-params['trainer']['cuda_device'] = args.device
-predictor = "udify_predictor" if not args.raw_text else "udify_text_predictor"
+    config_file = archive_dir / "config.json"
 
-if not args.eval_file:
-    util.predict_model_with_archive(predictor, params, archive_dir, args.input_file, args.pred_file,
-                                    batch_size=args.batch_size)
-else:
-    util.predict_and_evaluate_model_with_archive(predictor, params, archive_dir, args.input_file,
-                                                 args.pred_file, args.eval_file, batch_size=args.batch_size)
+    overrides = {}
+    if args.device is not None:
+        overrides["trainer"] = {"cuda_device": args.device}
+    if args.lazy:
+        overrides["dataset_reader"] = {"lazy": args.lazy}
+    params = Params.from_file(config_file, json.dumps(overrides))
+    predictor = "udify_predictor" if not args.raw_text else "udify_text_predictor"
+
+    if not args.eval_file:
+        util.predict_model_with_archive(predictor, params, archive_dir, args.input_file, args.pred_file,
+                                        batch_size=args.batch_size, sort_by_length=args.sort_by_length,
+                                        maximum_tokens_per_batch=args.max_tokens_per_batch, workers=args.workers,
+                                        quantize=args.quantize, pack_sequences=args.pack_sequences)
+    else:
+        # Evaluate as train.py does, with the evaluation configured for the dataset (the first, if several)
+        datasets = params["dataset_reader"]["datasets"]
+        eval_type = datasets[next(iter(datasets))]["evaluation"]
+        util.predict_and_evaluate_model_with_archive(predictor, params, archive_dir, args.input_file,
+                                                     args.pred_file, args.eval_file, eval_type,
+                                                     batch_size=args.batch_size,
+                                                     sort_by_length=args.sort_by_length,
+                                                     maximum_tokens_per_batch=args.max_tokens_per_batch,
+                                                     workers=args.workers, quantize=args.quantize,
+                                                     pack_sequences=args.pack_sequences)
+
+
+if __name__ == "__main__":
+    main()
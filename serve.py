@@ -0,0 +1,144 @@
+"""
+Serve predictions from a trained model, loading it only once
+"""
+
+import os
+import logging
+import argparse
+import tarfile
+import socketserver
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from allennlp.common import Params
+from allennlp.common.util import import_submodules, lazy_groups_of
+
+from udify import util
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("archive", type=str, help="The archive file")
+parser.add_argument("--device", default=0, type=int, help="CUDA device number; set to -1 for CPU")
+parser.add_argument("--batch_size", default=1, type=int, help="The size of each prediction batch")
+parser.add_argument("--host", default="127.0.0.1", type=str, help="The address to listen on")
+parser.add_argument("--port", default=8000, type=int, help="The port to listen on")
+parser.add_argument("--socket", default=None, type=str,
+                    help="If set, listen on this Unix socket path instead of host and port")
+
+
+def raw_to_lines(text: str, reader) -> list:
+    """
+    Converts raw sentences, one per line, into BeeSL lines. Tokens are split on whitespace, and all the
+    columns other than the word are filled with the "O" placeholder.
+    """
+    num_cols = 1 + max(max([dataset['word_idx']] + [task['column_idx'] for task in dataset['tasks'].values()])
+                       for dataset in reader.datasets.values())
+    word_idx = next(iter(reader.datasets.values()))['word_idx']
+    lines = []
+    for sent_id, sentence in enumerate(text.splitlines()):
+        if not sentence.strip():
+            continue
+        lines.append("# doc_id = " + str(sent_id))
+        for word in sentence.split():
+            cols = ["O"] * num_cols
+            cols[word_idx] = word
+            lines.append("\t".join(cols))
+        lines.append("")
+    return lines
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with BeeSL lines (or with raw sentences, one per line, and ``?format=raw``) returns the
+    predictions in BeeSL format. GET /health can be used to check that the model is loaded.
+    """
+    predictor = None
+    batch_size = 1
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self.send_error(404)
+            return
+        self._reply(200, "ok\n")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        reader = self.predictor._dataset_reader
+        if parse_qs(url.query).get("format", ["beesl"])[0] == "raw":
+            lines = raw_to_lines(body, reader)
+        else:
+            # a sentence is only complete once followed by an empty line
+            lines = body.splitlines() + [""]
+
+        try:
+            output = []
+            for batch in lazy_groups_of(reader.read_lines(lines), self.batch_size):
+                for result in self.predictor.predict_batch_instance(batch):
+                    output.append(self.predictor.dump_line(result))
+        except Exception as e:
+            logger.exception("Failed to predict the request")
+            self._reply(400, str(e) + "\n")
+            return
+        self._reply(200, "".join(output))
+
+    def _reply(self, code: int, text: str):
+        data = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    import_submodules("udify")
+
+    archive_dir = Path(args.archive).resolve().parent
+
+    if not os.path.isfile(archive_dir / "weights.th"):
+        with tarfile.open(args.archive) as tar:
+            tar.extractall(archive_dir)
+
+    params = Params.from_file(archive_dir / "config.json")
+    params['trainer']['cuda_device'] = args.device
+
+    # Requests are served one at a time, so the model is never used by two threads at once
+    PredictionHandler.predictor = util.load_predictor_with_archive("udify_predictor", params, args.archive)
+    PredictionHandler.batch_size = args.batch_size
+
+    if args.socket:
+        server = UnixHTTPServer(args.socket, PredictionHandler)
+        logger.info(f"Serving predictions on unix socket {args.socket}")
+    else:
+        server = HTTPServer((args.host, args.port), PredictionHandler)
+        logger.info(f"Serving predictions on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
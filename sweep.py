@@ -0,0 +1,151 @@
+"""
+Train a model for each combination of values in a grid of configuration fields (e.g., the threshold of a decoder,
+the layer of a task and the learning rate), in parallel processes, and collect the validation metric of each in a
+table. The splits and the vocabulary are indexed only once for all the trials.
+
+The grid is a JSON file mapping the dotted path of each field to its values. Paths starting with a dataset name
+are set in the dataset config, the others in the parameters config, and "*" matches any key, e.g.,
+    {"UD.tasks.multi-labels.threshold": [0.5, 0.7], "UD.tasks.*.layer": [10, 12],
+     "trainer.optimizer.lr": [0.01, 0.005]}
+"""
+
+from typing import Any, Dict, List
+import os
+import json
+import datetime
+import itertools
+import logging
+import argparse
+import multiprocessing
+import traceback
+
+import torch
+
+from allennlp.common import Params
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.util import import_submodules
+from allennlp.commands.train import train_model
+
+from udify import util
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--name", default="", type=str, help="Log dir name")
+parser.add_argument("--dataset_config", default="", type=str, help="Configuration file for datasets")
+parser.add_argument("--parameters_config", default="", type=str, help="Configuration file for parameters of the model")
+parser.add_argument("--grid", required=True, type=str, help="JSON file with the values of each field to sweep")
+parser.add_argument("--device", default=None, type=int, help="CUDA device; set to -1 for CPU")
+parser.add_argument("--workers", default=1, type=int, help="The number of trials trained at the same time")
+parser.add_argument("--indexed_dir", default=None, type=str,
+                    help="Reuse the splits (and the vocabulary) indexed in this directory by index_dataset.py")
+parser.add_argument("--embedding_cache", default=None, type=str,
+                    help="Train the decoders on the (frozen) BERT embeddings cached here by cache_embeddings.py")
+parser.add_argument("--keep_archives", action="store_true", help="Keep the model archive of each trial")
+
+VALIDATION_METRIC = "best_validation_.run/.sum"
+
+# The fields that change the instances, which are indexed once for all the trials
+DATA_FIELDS = {"dataset_reader", "vocabulary", "train_data_path", "validation_data_path", "test_data_path",
+               "word_idx", "column_idx"}
+
+
+def set_field(config: Dict[str, Any], path: List[str], value: Any):
+    """
+    Sets the field at the given path of the config, in all the keys matching "*".
+    """
+    keys = list(config) if path[0] == "*" else [path[0]]
+    for key in keys:
+        if len(path) == 1:
+            config[key] = value
+        else:
+            set_field(config.setdefault(key, {}), path[1:], value)
+
+
+def _run_trial(params: Dict[str, Any], serialization_dir: str, num_threads: int,
+               keep_archive: bool) -> Dict[str, Any]:
+    import_submodules("udify")
+    torch.set_num_threads(num_threads)
+    try:
+        train_model(Params(params), serialization_dir)
+    except Exception:  # pylint: disable=broad-except
+        logger.error(f"The trial in {serialization_dir} failed")
+        traceback.print_exc()
+        return {}
+
+    util.cleanup_training(serialization_dir, keep_archive=keep_archive)
+    with open(os.path.join(serialization_dir, "metrics.json")) as metrics_file:
+        return json.load(metrics_file)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    import_submodules("udify")
+
+    with open(args.grid) as grid_file:
+        grid = json.load(grid_file)
+    dataset_config = Params.from_file(args.dataset_config).as_dict(quiet=True)
+    parameters_config = Params.from_file(args.parameters_config).as_dict(quiet=True)
+    for field in grid:
+        if DATA_FIELDS.intersection(field.split(".")):
+            raise ConfigurationError(f"The grid cannot change {field}, the data is shared by all the trials")
+
+    log_dir_name = args.name or os.path.basename(args.dataset_config).split(".")[0]
+    sweep_dir = os.path.join("logs", log_dir_name, "sweep_" + datetime.datetime.now().strftime("%Y.%m.%d_%H.%M.%S"))
+    os.makedirs(sweep_dir)
+
+    overrides = {"trainer": {"cuda_device": args.device}} if args.device is not None else {}
+    indexed_dir = args.indexed_dir
+    if not indexed_dir:
+        indexed_dir = os.path.join(sweep_dir, "indexed")
+        util.index_datasets(util.merge_configs(args.parameters_config, args.dataset_config, overrides), indexed_dir)
+
+    trials = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    jobs = []
+    threads_per_worker = max(1, (os.cpu_count() or 1) // args.workers)
+    for trial_idx, trial in enumerate(trials):
+        trial_dir = os.path.join(sweep_dir, f"trial{trial_idx}")
+        os.makedirs(trial_dir)
+
+        trial_dataset_config = json.loads(json.dumps(dataset_config))
+        trial_parameters_config = json.loads(json.dumps(parameters_config))
+        for field, value in trial.items():
+            path = field.split(".")
+            config = trial_dataset_config if path[0] in dataset_config else trial_parameters_config
+            set_field(config, path, value)
+
+        config_files = []
+        for name, config in [("parameters", trial_parameters_config), ("dataset", trial_dataset_config)]:
+            config_files.append(os.path.join(trial_dir, f"{name}.json"))
+            with open(config_files[-1], "w") as config_file:
+                json.dump(config, config_file, indent=4)
+
+        trial_params = util.merge_configs(*config_files, overrides)
+        util.use_indexed_datasets(trial_params, indexed_dir)
+        if args.embedding_cache:
+            util.use_embedding_cache(trial_params, args.embedding_cache)
+        jobs.append((trial_params.as_dict(quiet=True), os.path.join(trial_dir, "model"), threads_per_worker,
+                     args.keep_archives))
+
+    logger.info(f"Running {len(jobs)} trials with {args.workers} workers in {sweep_dir}")
+    # spawn, so that no torch or allennlp state is inherited by the workers
+    with multiprocessing.get_context("spawn").Pool(max(1, args.workers)) as pool:
+        results = pool.starmap(_run_trial, jobs)
+
+    header = ["trial"] + list(grid) + ["best_epoch", VALIDATION_METRIC]
+    rows = [[f"trial{trial_idx}"] + [json.dumps(value) for value in trial.values()]
+            + [str(metrics.get("best_epoch", "")), str(metrics.get(VALIDATION_METRIC, ""))]
+            for trial_idx, (trial, metrics) in enumerate(zip(trials, results))]
+    with open(os.path.join(sweep_dir, "results.tsv"), "w") as results_file:
+        for row in [header] + rows:
+            results_file.write("\t".join(row) + "\n")
+
+    # Best trials first, failed ones last
+    rows.sort(key=lambda row: -float(row[-1]) if row[-1] else float("inf"))
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        logger.info(" | ".join(value.ljust(width) for value, width in zip(row, widths)))
+    logger.info(f"Results saved in {os.path.join(sweep_dir, 'results.tsv')}")
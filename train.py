@@ -29,6 +29,10 @@ parser.add_argument("--cleanup_archive", action="store_true", help="Delete the m
 parser.add_argument("--replace_vocab", action="store_true", help="Create a new vocab and replace the cached one")
 parser.add_argument("--archive_bert", action="store_true", help="Archives the finetuned BERT model after training")
 parser.add_argument("--predictor", default="udify_predictor", type=str, help="The type of predictor to use")
+parser.add_argument("--indexed_dir", default=None, type=str,
+                    help="Load the splits (and the vocabulary) indexed in this directory by index_dataset.py")
+parser.add_argument("--embedding_cache", default=None, type=str,
+                    help="Train the decoders on the (frozen) BERT embeddings cached here by cache_embeddings.py")
 
 args = parser.parse_args()
 
@@ -46,6 +50,11 @@ if not args.resume:
     if args.lazy is not None:
         overrides["dataset_reader"] = {"lazy": args.lazy}
     train_params = util.merge_configs(args.parameters_config, args.dataset_config, overrides)
+
+    if args.indexed_dir:
+        util.use_indexed_datasets(train_params, args.indexed_dir)
+    if args.embedding_cache:
+        util.use_embedding_cache(train_params, args.embedding_cache)
 #else:
 #    serialization_dir = args.resume
 #    train_params = Params.from_file(os.path.join(serialization_dir, "config.json"))
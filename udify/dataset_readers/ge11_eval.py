@@ -1,7 +1,10 @@
 import os
+import re
 import logging
 
-from bioscripts.postprocess import decode
+from bioscripts.postprocess import decode, decode_lines
+from bioscripts.a2_evaluate import evaluate_a2, format_report
+from udify.predictors.predictor import get_output_rows
 
 logger = logging.getLogger(__name__)
 
@@ -37,175 +40,216 @@ def is_multitask_encoded(pred_file):
     # return is_multitask
 
 
+def getSents(path):
+    curSent = []
+    sents = []
+    for line in open(path):
+        if len(line) < 2:
+            sents.append(curSent)
+            curSent = []
+        else:
+            # Handle multi-head for task 1
+            #if len(line.split('\t')) > 1:
+            #    if "$B-" in line.strip().split("\t")[-2]:
+            #        before = line.strip().split("\t")[-2]
+            #        normalized = line.strip().split("\t")[-2].replace("$B-", "////")
+            #        line = line.replace(before, normalized)
+            curSent.append(line)
+    return sents
+
+
 # Remove hardcoded is_multihead
 def merge_columns(gold_file, pred_file, multitask_cols, is_multihead=True):
     """"""
-
-    def getSents(path):
-        curSent = []
-        sents = []
-        for line in open(path):
-            if len(line) < 2:
-                sents.append(curSent)
-                curSent = []
-            else:
-                # Handle multi-head for task 1
-                #if len(line.split('\t')) > 1:
-                #    if "$B-" in line.strip().split("\t")[-2]:
-                #        before = line.strip().split("\t")[-2]
-                #        normalized = line.strip().split("\t")[-2].replace("$B-", "////")
-                #        line = line.replace(before, normalized)
-                curSent.append(line)
-        return sents
-
     sentsOut = getSents(pred_file)
     sentsGold = getSents(gold_file)
-    convType = multitask_cols
-    #convType = 1 if not is_multitask else 2
 
+    # Written anew, as the same predictions may be evaluated more than once
     merged_filename = pred_file + ".fixed"
-    merged_file = open(merged_filename, "a")
+    merged_file = open(merged_filename, "w")
 
     for sentGold, sentOut in zip(sentsGold, sentsOut):
-        merged_file.write(sentGold[0].strip() + "\n")
-        for i in range(1,len(sentGold)):
-            newTok = sentGold[i].strip().split('\t')
-
-            # a|b|c|d
-            if convType == 1:
-                if len(sentOut[i].split('\t')) > 1:
-                    newTok[-1] = sentOut[i].split('\t')[-1]
-
-            # a, b|c|d
-            # a|b, c|d
-            elif convType == 2:
-                # a == O,   b|c|d == 0
-                # a|b == O, c|d == 0
-                if (sentOut[i].split('\t')[-2].startswith("O") and sentOut[i].split('\t')[-1].startswith("O")):
-                    newTok[-2] = "O"
-                elif ((not sentOut[i].split('\t')[-2].startswith("O")) and sentOut[i].split('\t')[-1].startswith("O")):
-                    # if a|O ==> a|O
-                    if "|" in sentOut[i].split('\t')[-2]:
-                        newTok[-2] = sentOut[i].split('\t')[-2].split("|")[0] + "|" + "O"
-                    # if a   ==> a|O
-                    else:
-                        newTok[-2] = sentOut[i].split('\t')[-2] + "|" + "O"
-                # a == O, other == B|* ==> O
-                elif (sentOut[i].split('\t')[-2].startswith("O") and (not sentOut[i].split('\t')[-1].startswith("O"))):
-                    newTok[-2] = "O"
-                # merge them
+        for line in merge_sentence(sentGold, sentOut, multitask_cols, is_multihead):
+            merged_file.write(line + "\n")
+        merged_file.write("\n")
+
+    merged_file.close()
+
+    return merged_filename
+
+
+def merge_sentence(sentGold, sentOut, multitask_cols, is_multihead=True):
+    """
+    Merges the labels predicted for a sentence into the gold columns, as decode expects them. Both
+    sentences are lists of lines (with the line break), the first of which is the doc_id comment.
+    Returns the merged lines (without the line break).
+    """
+    convType = multitask_cols
+    #convType = 1 if not is_multitask else 2
+
+    merged = [sentGold[0].strip()]
+    for i in range(1,len(sentGold)):
+        newTok = sentGold[i].strip().split('\t')
+
+        # a|b|c|d
+        if convType == 1:
+            if len(sentOut[i].split('\t')) > 1:
+                newTok[-1] = sentOut[i].split('\t')[-1]
+
+        # a, b|c|d
+        # a|b, c|d
+        elif convType == 2:
+            # a == O,   b|c|d == 0
+            # a|b == O, c|d == 0
+            if (sentOut[i].split('\t')[-2].startswith("O") and sentOut[i].split('\t')[-1].startswith("O")):
+                newTok[-2] = "O"
+            elif ((not sentOut[i].split('\t')[-2].startswith("O")) and sentOut[i].split('\t')[-1].startswith("O")):
+                # if a|O ==> a|O
+                if "|" in sentOut[i].split('\t')[-2]:
+                    newTok[-2] = sentOut[i].split('\t')[-2].split("|")[0] + "|" + "O"
+                # if a   ==> a|O
                 else:
-                    if "|" in sentOut[i].split('\t')[-2]:
-                        # case d|a
-                        if ("Theme" in sentOut[i].split('\t')[-2]) or ("Cause" in sentOut[i].split('\t')[-2]):
-                            parts1 = sentOut[i].split('\t')[-2].split("$")
-                            parts2 = sentOut[i].split('\t')[-1].split("$")
-                            label = ""
-                            ## Strictly ensure same dimensions ####################
-                            if len(parts1) != len(parts2):
-                                newTok[-2] = parts1[0].split("|")[0]
-                            else:
-                                for raw_part1, raw_part2 in zip(parts1, parts2):
-                                    d, a = raw_part1.split("|")
-                                    h, p = raw_part2.split("|")
-                                    label += d + "|" + a + "|" + h[2:] + "|" + p + "$"
-                                if label[-1] == "$":
-                                    label = label[:-1]
-                                newTok[-2] = label
-                        #if sentOut[i].split('\t')[-2].split("|")[1] in ["Theme", "Cause"]:
-                        #    newTok[-2] = sentOut[i].split('\t')[-2] + '|' + sentOut[i].split('\t')[-1][2:]
-                        elif (not "Theme" in sentOut[i].split('\t')[-2]) and (not "Cause" in sentOut[i].split('\t')[-2]):
-                            parts1 = sentOut[i].split('\t')[-2].split("$")
-                            parts2 = sentOut[i].split('\t')[-1].split("$")
-                            label = ""
-                            ## Strictly ensure same dimensions ####################
-                            if len(parts1) != len(parts2):
-                                newTok[-2] = parts1[0].split("|")[0]
-                            else:
-                                for raw_part1, raw_part2 in zip(parts1, parts2):
-                                    mention_and_src = raw_part1.split("|")
-                                    if len(mention_and_src) < 3:
-                                        label += d + "|O"
-                                    else:
-                                        d, h, p = mention_and_src
-                                        a = raw_part2.rstrip()
-                                        label += d + "|" + a[2:] + "|" + h + "|" + p + "$"
-                                if label[-1] == "$":
-                                    label = label[:-1]
-                                newTok[-2] = label
-                        elif sentOut[i].split('\t')[-2].split("|")[1].startswith("O"):
-                            newTok[-2] = sentOut[i].split('\t')[-2]
-                        # case d|h
+                    newTok[-2] = sentOut[i].split('\t')[-2] + "|" + "O"
+            # a == O, other == B|* ==> O
+            elif (sentOut[i].split('\t')[-2].startswith("O") and (not sentOut[i].split('\t')[-1].startswith("O"))):
+                newTok[-2] = "O"
+            # merge them
+            else:
+                if "|" in sentOut[i].split('\t')[-2]:
+                    # case d|a
+                    if ("Theme" in sentOut[i].split('\t')[-2]) or ("Cause" in sentOut[i].split('\t')[-2]):
+                        parts1 = sentOut[i].split('\t')[-2].split("$")
+                        parts2 = sentOut[i].split('\t')[-1].split("$")
+                        label = ""
+                        ## Strictly ensure same dimensions ####################
+                        if len(parts1) != len(parts2):
+                            newTok[-2] = parts1[0].split("|")[0]
                         else:
-                            parts = sentOut[i].split('\t')[-2].split("|", 1)
-                            newTok[-2] = parts[0] + '|' + sentOut[i].split('\t')[-1].rstrip()[2:] + "|" + parts[1]
-                    # case d
-                    else:
-                        if is_multihead:
-                            mention = sentOut[i].split('\t')[-2]
-                            multihead_labels = sentOut[i].rstrip().split('\t')[-1].split("$")
-                            merged_label = mention + "|" + multihead_labels[0][2:]
-                            for k in range(1, len(multihead_labels)):
-                                merged_label += "$" + mention + "|" + multihead_labels[k][2:]
-                            newTok[-2] = merged_label
+                            for raw_part1, raw_part2 in zip(parts1, parts2):
+                                d, a = raw_part1.split("|")
+                                h, p = raw_part2.split("|")
+                                label += d + "|" + a + "|" + h[2:] + "|" + p + "$"
+                            if label[-1] == "$":
+                                label = label[:-1]
+                            newTok[-2] = label
+                    #if sentOut[i].split('\t')[-2].split("|")[1] in ["Theme", "Cause"]:
+                    #    newTok[-2] = sentOut[i].split('\t')[-2] + '|' + sentOut[i].split('\t')[-1][2:]
+                    elif (not "Theme" in sentOut[i].split('\t')[-2]) and (not "Cause" in sentOut[i].split('\t')[-2]):
+                        parts1 = sentOut[i].split('\t')[-2].split("$")
+                        parts2 = sentOut[i].split('\t')[-1].split("$")
+                        label = ""
+                        ## Strictly ensure same dimensions ####################
+                        if len(parts1) != len(parts2):
+                            newTok[-2] = parts1[0].split("|")[0]
                         else:
-                            newTok[-2] = sentOut[i].split('\t')[-2] + '|' + sentOut[i].split('\t')[-1][2:]
-                newTok = newTok[:len(newTok)-1]
-
-            # a, b, c|d
-            elif convType == 3:
-                # a == O, b == 0, c|d == 0
-                if (sentOut[i].split('\t')[-3].startswith("O") and sentOut[i].split('\t')[-2].startswith("O") and sentOut[i].split('\t')[-1].startswith("O")):
-                    newTok[-3] = "O"
+                            for raw_part1, raw_part2 in zip(parts1, parts2):
+                                mention_and_src = raw_part1.split("|")
+                                if len(mention_and_src) < 3:
+                                    label += d + "|O"
+                                else:
+                                    d, h, p = mention_and_src
+                                    a = raw_part2.rstrip()
+                                    label += d + "|" + a[2:] + "|" + h + "|" + p + "$"
+                            if label[-1] == "$":
+                                label = label[:-1]
+                            newTok[-2] = label
+                    elif sentOut[i].split('\t')[-2].split("|")[1].startswith("O"):
+                        newTok[-2] = sentOut[i].split('\t')[-2]
+                    # case d|h
+                    else:
+                        parts = sentOut[i].split('\t')[-2].split("|", 1)
+                        newTok[-2] = parts[0] + '|' + sentOut[i].split('\t')[-1].rstrip()[2:] + "|" + parts[1]
+                # case d
                 else:
-                    if ((not sentOut[i].split('\t')[-3].startswith("O")) and (not sentOut[i].split('\t')[-2].startswith("O")) and (not sentOut[i].split('\t')[-1].startswith("O"))):
-                        if is_multihead:
-                            parts0 = sentOut[i].split('\t')[-3]
-                            parts1 = sentOut[i].split('\t')[-2].split("$")
-                            parts2 = sentOut[i].split('\t')[-1].split("$")
-                            label = ""
-                            ## Strictly ensure same dimensions ####################
-                            if len(parts1) != len(parts2):
-                                newTok[-2] = parts0
-                            else:
-                                for raw_part1, raw_part2 in zip(parts1, parts2):
-                                    a = raw_part1
-                                    h, p = raw_part2.split("|")
-                                    label += parts0 + "|" + a[2:] + "|" + h[2:] + "|" + p + "$"
-                                if label[-1] == "$":
-                                    label = label[:-1]
-                                newTok[-3] = label
-                        else:
-                            print("Not implemented yet.")
-                            sys.exit()
+                    if is_multihead:
+                        mention = sentOut[i].split('\t')[-2]
+                        multihead_labels = sentOut[i].rstrip().split('\t')[-1].split("$")
+                        merged_label = mention + "|" + multihead_labels[0][2:]
+                        for k in range(1, len(multihead_labels)):
+                            merged_label += "$" + mention + "|" + multihead_labels[k][2:]
+                        newTok[-2] = merged_label
                     else:
-                        if (not sentOut[i].split('\t')[-3].startswith("O")):
-                            newTok[-3] = sentOut[i].split('\t')[-3] + "|O"
+                        newTok[-2] = sentOut[i].split('\t')[-2] + '|' + sentOut[i].split('\t')[-1][2:]
+            newTok = newTok[:len(newTok)-1]
+
+        # a, b, c|d
+        elif convType == 3:
+            # a == O, b == 0, c|d == 0
+            if (sentOut[i].split('\t')[-3].startswith("O") and sentOut[i].split('\t')[-2].startswith("O") and sentOut[i].split('\t')[-1].startswith("O")):
+                newTok[-3] = "O"
+            else:
+                if ((not sentOut[i].split('\t')[-3].startswith("O")) and (not sentOut[i].split('\t')[-2].startswith("O")) and (not sentOut[i].split('\t')[-1].startswith("O"))):
+                    if is_multihead:
+                        parts0 = sentOut[i].split('\t')[-3]
+                        parts1 = sentOut[i].split('\t')[-2].split("$")
+                        parts2 = sentOut[i].split('\t')[-1].split("$")
+                        label = ""
+                        ## Strictly ensure same dimensions ####################
+                        if len(parts1) != len(parts2):
+                            newTok[-2] = parts0
                         else:
-                            newTok[-3] = "O"
-
-                    # b == B|*, c|d == B|* ==> a|b|c|d
-                    # if (sentOut[i].split('\t')[-2].startswith("B-") and sentOut[i].split('\t')[-1].startswith("B-")):
-                    #     newTok[-3] = sentOut[i].split('\t')[-3] + '|' + sentOut[i].split('\t')[-2][2:] + '|' + sentOut[i].split('\t')[-1][2:]
-                    # # b != B|*, c|d != B|*
-                    # else:
-                    #     # a == B|*
-                    #     if sentOut[i].split('\t')[-3].startswith("B-"):
-                    #         newTok[-3] = sentOut[i].split('\t')[-3] + '|O'
-                    #     # a != B|*
-                    #     else:
-                    #         newTok[-3] = 'O'
-                newTok = newTok[:len(newTok)-2]
-            merged_file.write('\t'.join(newTok).strip() + "\n")
-        merged_file.write("\n")
+                            for raw_part1, raw_part2 in zip(parts1, parts2):
+                                a = raw_part1
+                                h, p = raw_part2.split("|")
+                                label += parts0 + "|" + a[2:] + "|" + h[2:] + "|" + p + "$"
+                            if label[-1] == "$":
+                                label = label[:-1]
+                            newTok[-3] = label
+                    else:
+                        print("Not implemented yet.")
+                        sys.exit()
+                else:
+                    if (not sentOut[i].split('\t')[-3].startswith("O")):
+                        newTok[-3] = sentOut[i].split('\t')[-3] + "|O"
+                    else:
+                        newTok[-3] = "O"
 
-    merged_file.close()
+                # b == B|*, c|d == B|* ==> a|b|c|d
+                # if (sentOut[i].split('\t')[-2].startswith("B-") and sentOut[i].split('\t')[-1].startswith("B-")):
+                #     newTok[-3] = sentOut[i].split('\t')[-3] + '|' + sentOut[i].split('\t')[-2][2:] + '|' + sentOut[i].split('\t')[-1][2:]
+                # # b != B|*, c|d != B|*
+                # else:
+                #     # a == B|*
+                #     if sentOut[i].split('\t')[-3].startswith("B-"):
+                #         newTok[-3] = sentOut[i].split('\t')[-3] + '|O'
+                #     # a != B|*
+                #     else:
+                #         newTok[-3] = 'O'
+            newTok = newTok[:len(newTok)-2]
+        merged.append('\t'.join(newTok).strip())
 
-    return merged_filename
+    return merged
 
 
-def evaluate_asrm(gold_file, pred_file):
-    """"""
+def predictions_to_a2(outputs, gold_file=None, is_multihead=True, **decode_args):
+    """
+    Decodes the events of the given predictor outputs (one per sentence, as returned by
+    ``predict_batch_instance``) into the content of their .a2 files, without writing any intermediate
+    file. Returns a dict mapping each document id to its .a2 lines. The keyword arguments are passed to
+    bioscripts.postprocess.decode_lines.
+
+    The predictions are merged into the columns of the (not masked) gold_file when given, which must hold
+    the same sentences in the same order, as evaluate_asrm does; otherwise, into their own columns.
+    """
+    sentsOut = [["\t".join(row) + "\n" for row in get_output_rows(output)] for output in outputs]
+    sentsGold = getSents(gold_file) if gold_file else sentsOut
+    multitask_cols = len(sentsOut[0][1].split("\t")) - 6 if sentsOut else 1
+
+    lines = []
+    for sentGold, sentOut in zip(sentsGold, sentsOut):
+        lines.extend(merge_sentence(sentGold, sentOut, multitask_cols, is_multihead))
+        lines.append("")
+
+    return decode_lines(lines, **decode_args)
+
+
+def evaluate_asrm(gold_file, pred_file, use_perl=False):
+    """
+    Decodes the predicted events and evaluates them with the approximate span and recursive matching
+    (ASRM) against the GE11 gold annotations, writing the report in results.txt next to the predictions.
+    By default, the evaluation runs in memory (bioscripts.a2_evaluate); use_perl runs the original
+    a2-normalize.pl and a2-evaluate.pl scripts instead, on the decoded .a2 files.
+    """
     # print(gold_file) # data/GE11/masked/dev.st.singleX
     # print(pred_file) # logs/X/2020.01.22_16.28.45/dev.conllu
 
@@ -224,15 +268,38 @@ def evaluate_asrm(gold_file, pred_file):
     #merged_file = merge_columns(gold_file_unmasked, pred_file, is_multitask)
     logger.info("Merged predictions in {}".format(merged_file))
 
+    x = "data/corpora/GE11/dev" + split_number
+    out_results = os.path.dirname(merged_file) + "/results.txt"
+
+    if not use_perl:
+        a2_documents = decode(merged_file, write_output=False)
+        totals = evaluate_a2(a2_documents, x, task=1, soft_span=True, soft_args=True)
+        with open(out_results, "w") as f:
+            f.write(format_report(totals))
+        return out_results
+
     # Decode
     decode(merged_file)
     logger.info("Decoded predictions in {}".format(os.path.join(os.path.dirname(merged_file), "output")))
 
-    x = "data/corpora/GE11/dev" + split_number
     out_norm = os.path.dirname(merged_file) + "/" + "output_norm"
     out_a2 = os.path.dirname(merged_file) + "/" + "output" + "/*.a2"
-    out_results = os.path.dirname(merged_file) + "/results.txt"
 
     # Run eval scripts (hard-coded for now)
     os.system("perl bioscripts/eval/a2-normalize.pl -v -g " + x + " -o " + out_norm + " " + out_a2)
     os.system("perl bioscripts/eval/a2-evaluate.pl -g " + x + " -t1 -sp " + out_norm + "/*.a2 > " + out_results)
+
+    return out_results
+
+
+def read_asrm_scores(results_file):
+    """
+    Reads the recall, precision and F1 (in percentage) of each event class, and of the totals
+    (e.g., "==[ALL-TOTAL]=="), from a report written by a2-evaluate.pl.
+    """
+    scores = {}
+    for line in open(results_file):
+        match = re.match(r"^\s*(\S+)\s+\d+\s+\(\s*\d+\)\s+\d+\s+\(\s*\d+\)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s*$", line)
+        if match:
+            scores[match.group(1)] = tuple(float(score) for score in match.group(2, 3, 4))
+    return scores
@@ -0,0 +1,136 @@
+"""
+A binary, memory-mappable cache of indexed instances, so that training does not tokenize and index the BeeSL
+files again. Each split is a directory with a ``meta.json`` file and a few ``.npy`` arrays: the flattened
+indices of every field (wordpiece ids, offsets, label and multi-label indices) and the offsets of each
+instance (and, for multi-labels, of each token) in them.
+"""
+
+from typing import Dict, List, Tuple
+import os
+import json
+import hashlib
+import itertools
+
+import numpy
+
+from allennlp.data.fields import TextField, SequenceLabelField
+from allennlp.data.instance import Instance
+from allennlp.data.vocabulary import Vocabulary
+
+from udify.dataset_readers.sequence_multilabel_field import SequenceMultiLabelField
+
+META_FILE = "meta.json"
+VOCABULARY_DIR = "vocabulary"
+WORDPIECE_CACHE_FILE = "{}.wordpiece_cache.json"
+
+
+def get_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _save_ragged(directory: str, name: str, sequences: List[List[int]]) -> None:
+    """
+    Saves a list of integer sequences as the flat array of their values and the array of their offsets.
+    """
+    offsets = numpy.zeros(len(sequences) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(sequence) for sequence in sequences], out=offsets[1:])
+    values = numpy.fromiter(itertools.chain.from_iterable(sequences), dtype=numpy.int32, count=int(offsets[-1]))
+    numpy.save(os.path.join(directory, name + ".npy"), values)
+    numpy.save(os.path.join(directory, name + ".offsets.npy"), offsets)
+
+
+def _load_ragged(directory: str, name: str) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    return (numpy.load(os.path.join(directory, name + ".npy"), mmap_mode="r"),
+            numpy.load(os.path.join(directory, name + ".offsets.npy"), mmap_mode="r"))
+
+
+def save_indexed_instances(instances: List[Instance], vocab: Vocabulary, directory: str, source_path: str) -> None:
+    """
+    Indexes the instances read from ``source_path`` with the vocabulary and saves their indices in the directory.
+    Only the text, label and multi-label fields are saved, as the metadata is cheaply rebuilt from the source.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for instance in instances:
+        instance.index_fields(vocab)
+
+    fields = {}
+    for name, field in instances[0].fields.items():
+        if isinstance(field, TextField):
+            # pylint: disable=protected-access
+            fields[name] = {"type": "text", "indexers": field._indexer_name_to_indexed_token}
+            for key in field._indexed_tokens:
+                _save_ragged(directory, f"{name}.{key}",
+                             [instance.fields[name]._indexed_tokens[key] for instance in instances])
+        elif isinstance(field, SequenceMultiLabelField):
+            # pylint: disable=protected-access
+            fields[name] = {"type": "multilabel", "namespace": field._label_namespace,
+                            "num_labels": field._num_labels}
+            token_labels = [instance.fields[name]._indexed_labels for instance in instances]
+            _save_ragged(directory, f"{name}.tokens", [[len(labels) for labels in sequence]
+                                                       for sequence in token_labels])
+            _save_ragged(directory, name, [[label for labels in sequence for label in labels]
+                                           for sequence in token_labels])
+        elif isinstance(field, SequenceLabelField):
+            # pylint: disable=protected-access
+            fields[name] = {"type": "label", "namespace": field._label_namespace}
+            _save_ragged(directory, name, [instance.fields[name]._indexed_labels for instance in instances])
+
+    with open(source_path, "rb") as source_file:
+        source_hash = get_hash(source_file.read())
+    meta = {"num_instances": len(instances), "source_hash": source_hash, "fields": fields}
+    with open(os.path.join(directory, META_FILE), "w") as meta_file:
+        json.dump(meta, meta_file, indent=4)
+
+
+class IndexedDataset:
+    """
+    The indices of the instances of a split saved by ``save_indexed_instances``, memory-mapped.
+    """
+    def __init__(self, directory: str) -> None:
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self.num_instances = meta["num_instances"]
+        self.source_hash = meta["source_hash"]
+        self.fields = meta["fields"]
+
+        self._arrays = {}
+        for name, field in self.fields.items():
+            if field["type"] == "text":
+                for keys in field["indexers"].values():
+                    for key in keys:
+                        self._arrays[f"{name}.{key}"] = _load_ragged(directory, f"{name}.{key}")
+            elif field["type"] == "multilabel":
+                self._arrays[f"{name}.tokens"] = _load_ragged(directory, f"{name}.tokens")
+                self._arrays[name] = _load_ragged(directory, name)
+            else:
+                self._arrays[name] = _load_ragged(directory, name)
+
+    def _get(self, name: str, index: int) -> numpy.ndarray:
+        values, offsets = self._arrays[name]
+        return values[offsets[index]:offsets[index + 1]]
+
+    def get_fields(self, index: int, tokens: TextField) -> Dict:
+        """
+        Returns the indexed fields of an instance, given its (not indexed) text field, which is indexed too.
+        """
+        fields = {}
+        for name, field in self.fields.items():
+            if field["type"] == "text":
+                # pylint: disable=protected-access
+                tokens._indexer_name_to_indexed_token = field["indexers"]
+                tokens._token_index_to_indexer_name = {key: indexer for indexer, keys in field["indexers"].items()
+                                                       for key in keys}
+                tokens._indexed_tokens = {key: self._get(f"{name}.{key}", index).tolist()
+                                          for key in tokens._token_index_to_indexer_name}
+                fields[name] = tokens
+            elif field["type"] == "multilabel":
+                labels = self._get(name, index).tolist()
+                token_offsets = numpy.cumsum(self._get(f"{name}.tokens", index)).tolist()
+                label_sequence = [labels[start:end] for start, end in zip([0] + token_offsets, token_offsets)]
+                fields[name] = SequenceMultiLabelField(label_sequence, tokens, label_namespace=field["namespace"],
+                                                       skip_indexing=True, num_labels=field["num_labels"])
+            else:
+                fields[name] = SequenceLabelField(self._get(name, index).tolist(), tokens,
+                                                  label_namespace=field["namespace"])
+        return fields
+
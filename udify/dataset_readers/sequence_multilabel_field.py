@@ -35,6 +35,7 @@ class SequenceMultiLabelField(Field[torch.Tensor]):
         self._label_namespace = label_namespace
         self._indexed_labels = None
         self._label_ids = None
+        self._sparse_labels = None
         self._maybe_warn_for_namespace(label_namespace)
         self._num_labels = num_labels
 
@@ -58,7 +59,7 @@ class SequenceMultiLabelField(Field[torch.Tensor]):
                 )
 
         if skip_indexing and self.labels:
-            if not all(isinstance(label, int) for label in labels):
+            if not all(isinstance(label, int) for label_list in labels for label in label_list):
                 raise ConfigurationError(
                     "In order to skip indexing, your labels must be integers. "
                     "Found labels = {}".format(labels)
@@ -66,14 +67,14 @@ class SequenceMultiLabelField(Field[torch.Tensor]):
             if not num_labels:
                 raise ConfigurationError("In order to skip indexing, num_labels can't be None.")
 
-            if not all(cast(int, label) < num_labels for label in labels):
+            if not all(cast(int, label) < num_labels for label_list in labels for label in label_list):
                 raise ConfigurationError(
                     "All labels should be < num_labels. "
                     "Found num_labels = {} and labels = {} ".format(num_labels, labels)
                 )
 
             self._label_ids = labels
-        else:
+        elif not self._skip_indexing:
             for label_list in labels:
                 if not all(isinstance(label, str) for label in label_list):
                     raise ConfigurationError(
@@ -123,6 +124,7 @@ class SequenceMultiLabelField(Field[torch.Tensor]):
                 for label in label_list:
                     token_labels.append(vocab.get_token_index(label, self._label_namespace))
                 self._indexed_labels.append(token_labels)
+            self._sparse_labels = None
 
         if not self._num_labels:
             self._num_labels = vocab.get_vocab_size(self._label_namespace)
@@ -136,27 +138,21 @@ class SequenceMultiLabelField(Field[torch.Tensor]):
     @overrides
     def as_tensor(self, padding_lengths: Dict[str, int]) -> torch.Tensor:
         desired_num_tokens = padding_lengths["num_tokens"]
-        #token_tags_list = []
-        #token_tags_list = self._indexed_labels
-        #for i in range(desired_num_tokens - len(self._indexed_labels)):
-        #    token_tags_list.append([0])
-        token_tags_list = self.pad_sequence_to_length_with_list(self._indexed_labels, desired_num_tokens, [0])
-        # [[0], [0], [0], [0], [0], [0], [0], [0], [0], [0], [0], [0], [0], [2, 3], [0], [1], [0], [0], [1], [0], [0], [0]]
-
-        label_sequence = []
-        for token_index in range(len(token_tags_list)):
-            label_vector = [0] * self._num_labels
-
-            # If we are not in padding space, modify the label_vector
-            if token_index < len(self._indexed_labels):
-                label_indices = self._indexed_labels[token_index]
-                # Set the index to 1 if that label is present
-                for label_index in label_indices:
-                    label_vector[label_index] = 1
-
-            label_sequence.append(label_vector)
-
-        tensor = torch.LongTensor(label_sequence)
+        # The labels are kept as (token, label) index pairs and only scattered into the
+        # dense (num_tokens, num_labels) float tensor here, padding tokens have no label
+        if self._sparse_labels is None:
+            indexed_labels = self._indexed_labels or []
+            token_indices = [token_index for token_index, label_indices in enumerate(indexed_labels)
+                             for _ in label_indices]
+            label_indices = [label_index for label_indices in indexed_labels for label_index in label_indices]
+            self._sparse_labels = (torch.LongTensor(token_indices), torch.LongTensor(label_indices))
+        token_indices, label_indices = self._sparse_labels
+        if desired_num_tokens < len(self):
+            in_sequence = token_indices < desired_num_tokens
+            token_indices, label_indices = token_indices[in_sequence], label_indices[in_sequence]
+
+        tensor = torch.zeros(desired_num_tokens, self._num_labels)
+        tensor[token_indices, label_indices] = 1.
         #[[1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [0, 0, 1, 1], [1, 0, 0, 0], [0, 1, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [0, 1, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0]]
 
         return tensor
@@ -186,7 +182,7 @@ class SequenceMultiLabelField(Field[torch.Tensor]):
     @overrides
     def empty_field(self):
         return SequenceMultiLabelField(
-            [], self._label_namespace, skip_indexing=True, num_labels=self._num_labels
+            [], self.sequence_field.empty_field(), self._label_namespace, skip_indexing=True, num_labels=self._num_labels
         )
 
 
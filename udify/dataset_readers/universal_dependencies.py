@@ -2,7 +2,9 @@
 A Dataset Reader for Universal Dependencies, with support for multiword tokens and special handling for NULL "_" tokens
 """
 
-from typing import Dict, Tuple, List, Any, Callable
+from typing import Dict, Tuple, List, Any, Callable, Iterable, Iterator, Optional
+import io
+import os
 
 from overrides import overrides
 from udify.dataset_readers.parser import parse_line, DEFAULT_FIELDS
@@ -17,6 +19,7 @@ from allennlp.data.tokenizers import Token
 
 from udify.dataset_readers.lemma_edit import gen_lemma_rule
 from udify.dataset_readers.sequence_multilabel_field import SequenceMultiLabelField
+from udify.dataset_readers.indexed_dataset import IndexedDataset, META_FILE, get_hash
 import pprint
 import logging
 
@@ -53,8 +56,17 @@ def lazy_parse(text: str, fields: Tuple[str, ...]=DEFAULT_FIELDS):
                    if line and not line.strip().startswith("#")]
 
 def read_columns(conllu_file):
+    with open(conllu_file) as lines:
+        yield from parse_columns(lines)
+
+
+def parse_columns(lines: Iterable[str]):
+    """
+    Splits BeeSL lines into sentences, yielding for each of them the token rows and the full rows (comments
+    included). Like ``read_columns``, but on lines already in memory (e.g., the body of a request).
+    """
     sent = []
-    for line in open(conllu_file):
+    for line in lines:
         if len(line) < 2 and len(sent) > 0:
             #because in some datasets the wordIdx might be 0, and a line starting with # should be included
             #warning: breaks when the comment includes exactly the same amount of columns as the actual data
@@ -73,15 +85,23 @@ def read_columns(conllu_file):
 
 @DatasetReader.register("udify_universal_dependencies")
 class UniversalDependenciesDatasetReader(DatasetReader):
+    """
+    :param indexed_dir: an optional directory of splits indexed by ``index_dataset.py``
+        (``<indexed_dir>/<dataset>/<split>``). When a split is found there, its instances are loaded already
+        indexed instead of being tokenized and indexed again. The vocabulary used for training must then be the
+        one saved with them (``<indexed_dir>/vocabulary``).
+    """
     def __init__(self,
                  token_indexers: Dict[str, TokenIndexer] = None,
                  lazy: bool = False, 
-                 tasks: Dict = None, datasets: Dict = None
+                 tasks: Dict = None, datasets: Dict = None,
+                 indexed_dir: str = None
                 )-> None:
         super().__init__(lazy)
         self._token_indexers = token_indexers or {'tokens': SingleIdTokenIndexer()}
         self.datasets = datasets
         self.tasks = tasks
+        self._indexed_dir = indexed_dir
 
     @overrides
     def _read(self, file_path: str):
@@ -95,44 +115,109 @@ class UniversalDependenciesDatasetReader(DatasetReader):
         # entry 'dep_encoded' contains an empty list, is necessary for dependency decoder
         for dataset in self.datasets:
             pprint.pprint(self.datasets[dataset])
-            word_idx = self.datasets[dataset]['word_idx']
             #for sent read_columns(self.datasets[dataset][split]):
+            if self._indexed_dir and split in self.datasets[dataset]:
+                instances = self._read_indexed(dataset, split)
+                if instances is not None:
+                    yield from instances
+                    continue
             #TODO: this is a hacky fix, to make predict.py usable
             for sent, fullData in read_columns(split if split not in self.datasets[dataset] else self.datasets[dataset][split]):
-                sentTasks = {}
+                yield self.sentence_to_instance(dataset, sent, fullData)
 
-                sentTasks['words'] = []
-                sentTasks['dep_encoded'] = []
-                sentTasks['dataset'] = []
-                for wordData in sent:
-                    sentTasks['dataset'].append(dataset)
-                    sentTasks['words'].append(wordData[word_idx])
-                    sentTasks['dep_encoded'].append('')
-                colIdxs = {}
-                for task in self.datasets[dataset]['tasks']:
-                    sentTasks[task] = []
-                    transformer = self.datasets[dataset]['tasks'][task]['transformer']
-                    taskIdx = self.datasets[dataset]['tasks'][task]['column_idx']
-                    colIdxs[task] = taskIdx
-                    if transformer == '':
-                        for wordData in sent:
-                            sentTasks[task].append(wordData[taskIdx])
-                    elif transformer == 'lemma':
-                        for wordData in sent:
-                            taskLabel = gen_lemma_rule(wordData[word_idx], wordData[taskIdx])
-                            sentTasks[task].append(taskLabel)
-                    elif transformer == 'dependency':
-                        heads = []
-                        rels = []
-                        for wordData in sent:
-                            heads.append(wordData[taskIdx])
-                            rels.append(wordData[taskIdx + 1])
-                        sentTasks[task] = list(zip(rels, heads))
-                    else:
-                        print('Error: transfomer ' + transformer + ' for task ' + task + ' in dataset ' + dataset + ' is unknown')
-                        exit(1)
-                yield self.text_to_instance(sentTasks, fullData, colIdxs)
+    def _read_indexed(self, dataset: str, split: str) -> Optional[Iterator[Instance]]:
+        """
+        Returns the instances of the split loaded from the indexed directory, or None if they are not there or
+        if the split file has changed since they were indexed.
+        """
+        directory = os.path.join(self._indexed_dir, dataset, split)
+        if not os.path.exists(os.path.join(directory, META_FILE)):
+            logger.info(f"No indexed {split} split of {dataset} in {self._indexed_dir}, reading the file")
+            return None
 
+        indexed = IndexedDataset(directory)
+        with open(self.datasets[dataset][split], "rb") as split_file:
+            data = split_file.read()
+        # Read the lines as when iterating the file, with universal newlines
+        sentences = list(parse_columns(io.StringIO(data.decode("utf-8"), newline=None)))
+        if get_hash(data) != indexed.source_hash or len(sentences) != indexed.num_instances:
+            logger.warning(f"The indexed {split} split of {dataset} is outdated, reading the file")
+            return None
+
+        logger.info(f"Loading the indexed {split} split of {dataset} from {directory}")
+        return self._indexed_instances(dataset, sentences, indexed)
+
+    def _indexed_instances(self, dataset: str, sentences: List[Tuple[List[List[str]], List[List[str]]]],
+                           indexed: IndexedDataset) -> Iterator[Instance]:
+        for index, (sent, fullData) in enumerate(sentences):
+            sentTasks, colIdxs = self.sentence_to_tasks(dataset, sent)
+            tokens = TextField([Token(w) for w in sentTasks['words']], self._token_indexers)
+            fields = indexed.get_fields(index, tokens)
+            sentTasks["fullData"] = fullData
+            sentTasks["colIdxs"] = colIdxs
+            fields["metadata"] = MetadataField(sentTasks)
+            instance = Instance(fields)
+            instance.indexed = True
+            yield instance
+
+    def read_lines(self, lines: Iterable[str]) -> Iterator[Instance]:
+        """
+        Like ``_read``, but builds the instances from BeeSL lines already in memory instead of a file.
+        :param lines: the lines of one or more sentences, each sentence followed by an empty line
+        """
+        lines = list(lines)
+        for dataset in self.datasets:
+            for sent, fullData in parse_columns(lines):
+                yield self.sentence_to_instance(dataset, sent, fullData)
+
+    def sentence_to_instance(self, dataset: str, sent: List[List[str]], fullData: List[List[str]]) -> Instance:
+        """
+        Collects the labels of each task of the given dataset from the columns of a sentence.
+        :param dataset: the name of the dataset the sentence belongs to
+        :param sent: the token rows of the sentence
+        :param fullData: all the rows of the sentence, comments included
+        """
+        sentTasks, colIdxs = self.sentence_to_tasks(dataset, sent)
+        return self.text_to_instance(sentTasks, fullData, colIdxs)
+
+    def sentence_to_tasks(self, dataset: str, sent: List[List[str]]) -> Tuple[Dict[str, List], Dict[str, int]]:
+        """
+        Returns the words and the labels of each task of a sentence, and the column of each task.
+        """
+        word_idx = self.datasets[dataset]['word_idx']
+        sentTasks = {}
+
+        sentTasks['words'] = []
+        sentTasks['dep_encoded'] = []
+        sentTasks['dataset'] = []
+        for wordData in sent:
+            sentTasks['dataset'].append(dataset)
+            sentTasks['words'].append(wordData[word_idx])
+            sentTasks['dep_encoded'].append('')
+        colIdxs = {}
+        for task in self.datasets[dataset]['tasks']:
+            sentTasks[task] = []
+            transformer = self.datasets[dataset]['tasks'][task]['transformer']
+            taskIdx = self.datasets[dataset]['tasks'][task]['column_idx']
+            colIdxs[task] = taskIdx
+            if transformer == '':
+                for wordData in sent:
+                    sentTasks[task].append(wordData[taskIdx])
+            elif transformer == 'lemma':
+                for wordData in sent:
+                    taskLabel = gen_lemma_rule(wordData[word_idx], wordData[taskIdx])
+                    sentTasks[task].append(taskLabel)
+            elif transformer == 'dependency':
+                heads = []
+                rels = []
+                for wordData in sent:
+                    heads.append(wordData[taskIdx])
+                    rels.append(wordData[taskIdx + 1])
+                sentTasks[task] = list(zip(rels, heads))
+            else:
+                print('Error: transfomer ' + transformer + ' for task ' + task + ' in dataset ' + dataset + ' is unknown')
+                exit(1)
+        return sentTasks, colIdxs
 
     @overrides
     def text_to_instance(self,  # type: ignore
@@ -1,9 +1,7 @@
 from typing import Dict, List, Optional, Set, Callable
-from collections import defaultdict
 
 import numpy
 import torch
-from torch.autograd import Variable
 
 from allennlp.common.checks import ConfigurationError
 from allennlp.nn.util import get_lengths_from_binary_sequence_mask
@@ -22,6 +20,47 @@ from udify.util import to_multilabel_sequence
 TAGS_TO_SPANS_FUNCTION_TYPE = Callable[[List[str], Optional[List[str]]], List[TypedStringSpan]]  # pylint: disable=invalid-name
 
 
+def multi_hot_predictions(predictions: numpy.ndarray,
+                          threshold: float,
+                          max_heads: int,
+                          outside_index: int) -> numpy.ndarray:
+    """
+    Turns the (masked) probabilities of each token into the multi-hot vector of its predicted labels.
+    A token with at most one label over ``threshold`` gets its best label, or nothing if it is padding.
+    Otherwise it gets (at most ``max_heads`` of) the labels over ``threshold``, dropping those that the
+    partition puts before "O", or all the others if "O" comes last.
+    :param predictions: the probabilities, of shape (num_tokens, num_classes)
+    :return: a boolean array of shape (num_tokens, num_classes)
+    """
+    pred_over_thresh = (predictions >= numpy.float32(threshold)).astype(numpy.float32)
+    num_pred_over_thresh = numpy.count_nonzero(pred_over_thresh, axis=-1)
+    num_labels = numpy.minimum(num_pred_over_thresh, max_heads)
+    multi_hot = numpy.zeros(predictions.shape, dtype=bool)
+
+    multi_label_rows = num_pred_over_thresh >= 2
+    rows = numpy.nonzero(~multi_label_rows & (numpy.count_nonzero(predictions, axis=-1) > 0))[0]
+    multi_hot[rows, numpy.argmax(predictions[rows], axis=-1)] = True
+
+    # Tokens with the same number of labels are partitioned together, which gives the very same
+    # order as partitioning them one by one
+    for k in numpy.unique(num_labels[multi_label_rows]).tolist():
+        rows = numpy.nonzero(multi_label_rows & (num_labels == k))[0]
+        pred_idx = numpy.argpartition(pred_over_thresh[rows], -k, axis=-1)[:, -k:]
+        columns = numpy.arange(pred_idx.shape[1])
+
+        is_outside = pred_idx == outside_index
+        outside_position = is_outside.argmax(axis=-1)[:, numpy.newaxis]
+        keep = ~is_outside.any(axis=-1)[:, numpy.newaxis] \
+            | (columns > outside_position) \
+            | ((outside_position == pred_idx.shape[1] - 1) & (columns == outside_position))
+
+        selected = numpy.zeros((len(rows), predictions.shape[1]), dtype=bool)
+        numpy.put_along_axis(selected, pred_idx, keep, axis=-1)
+        multi_hot[rows] = selected
+
+    return multi_hot
+
+
 @Metric.register("multi_span_f1")
 class MultiSpanBasedF1Measure(Metric):
     """
@@ -91,10 +130,10 @@ class MultiSpanBasedF1Measure(Metric):
         self._label_vocabulary = vocabulary.get_index_to_token_vocabulary(tag_namespace)
         self._ignore_classes: List[str] = ignore_classes or []
 
-        # These will hold per label span counts.
-        self._true_positives: Dict[str, int] = defaultdict(int)
-        self._false_positives: Dict[str, int] = defaultdict(int)
-        self._false_negatives: Dict[str, int] = defaultdict(int)
+        # These will hold per label span counts, indexed by label id.
+        self._true_positives: torch.LongTensor = None
+        self._false_positives: torch.LongTensor = None
+        self._false_negatives: torch.LongTensor = None
 
         self.vocabulary = vocabulary
         self.tag_namespace = tag_namespace
@@ -183,170 +222,25 @@ class MultiSpanBasedF1Measure(Metric):
 
         outside_index = self.vocabulary.get_token_index("O", namespace=self.tag_namespace)
 
-        thresh = self.threshold
-        t = Variable(torch.Tensor([thresh]))
-        pred_over_thresh = (predictions >= t).float() * 1
-
-        # ==========
-
-        # Get the thresholded matrix and prepare the prediction sequence
-        maxxx_ = numpy.argmax(predictions, axis=-1).tolist()
-        maxxx = torch.nn.functional.one_hot(torch.tensor(maxxx_), num_classes)
-
-        # For each label set, check if to apply argmax or sigmoid thresh
-        for i in range(gold_labels.size(0)): # batch_size
-            j=0
-            for pred in pred_over_thresh[i]:
-                num_pred_over_thresh = numpy.count_nonzero(pred)
-
-                if (num_pred_over_thresh == 0) or (num_pred_over_thresh == 1):
-                    if numpy.count_nonzero(predictions[i][j]) == 0: # if it is a pad, put all zeros
-                        predictions[i][j] = torch.tensor([0.]*num_classes)
-                    else:
-                        pred_idx_list = maxxx[i][j]
-                        predictions[i][j] = pred_idx_list
-
-                elif num_pred_over_thresh <= self.max_heads:
-                    pred_idx_list = numpy.argpartition(pred, -num_pred_over_thresh)[-num_pred_over_thresh:]
-
-                    outside_position = -1
-                    try:
-                        outside_position = pred_idx_list.tolist().index(outside_index)
-                    except ValueError:
-                        outside_position = -1
-                    # for el_i in range(len(pred_idx_list)):
-                    #     if pred_idx_list[el_i] == outside_index:
-                    #         outside_position = el_i
-                    #         break
-                    if outside_position != -1:
-                        pred_len = len(pred_idx_list)-1
-                        # If the last (i.e., the best) is "O", ignore/remove the others
-                        if outside_position == pred_len:
-                            pred_idx_list = [pred_idx_list[-1]]
-                        # O.w. get only from the last before the "O"
-                        else:
-                            # del pred_idx_list[outside_position]
-                            pred_idx_list = pred_idx_list[outside_position+1:]
-
-                    #print("here NOT")
-                    #print(pred_idx_list.tolist())
-                    multi_one_hot = []
-                    for index in range(num_classes):
-                        if index in pred_idx_list:
-                            multi_one_hot.append(1.)
-                        else:
-                            multi_one_hot.append(0.)
-
-                    predictions[i][j] = torch.tensor(multi_one_hot)
-
-                else:
-                    pred_idx_list = numpy.argpartition(pred, -self.max_heads)[-self.max_heads:]
-                    # # print("sigmoid ->", pred_idx_list)
-
-                    outside_position = -1
-                    try:
-                        outside_position = pred_idx_list.tolist().index(outside_index)
-                    except ValueError:
-                        outside_position = -1
-                    # outside_position = None
-                    # for el_i in range(len(pred_idx_list)):
-                    #     if pred_idx_list[el_i] == outside_index:
-                    #         outside_position = el_i
-                    #         break
-                    if outside_position != -1:
-                        pred_len = len(pred_idx_list)-1
-                        # If the last (i.e., the best) is "O", ignore/remove the others
-                        if outside_position == pred_len:
-                            pred_idx_list = [pred_idx_list[-1]]
-                        # O.w. get only from the last before the "O"
-                        else:
-                            # del pred_idx_list[outside_position]
-                            pred_idx_list = pred_idx_list[outside_position+1:]
-
-                    #print("here NOT")
-                    #print(pred_idx_list.tolist())
-                    multi_one_hot = []
-                    for index in range(num_classes):
-                        if index in pred_idx_list:
-                            multi_one_hot.append(1.)
-                        else:
-                            multi_one_hot.append(0.)
-
-                    predictions[i][j] = torch.tensor(multi_one_hot)
-
-
-
-
-
-
-
-                # if num_pred_over_thresh < self.max_heads:
-                #     if numpy.count_nonzero(predictions[i][j]) == 0: # if it is a pad, put all zeros
-                #         predictions[i][j] = torch.tensor([0.]*num_classes)
-                #     else:
-                #         pred_idx_list = maxxx[i][j]
-                #         predictions[i][j] = pred_idx_list
-                #     # print("argmax  ->", pred_idx_list)
-                # else:
-                #     #pred_idx_list = [maxxx[j]]
-                #     pred_idx_list = numpy.argpartition(pred, -self.max_heads)[-self.max_heads:]
-                #     # # print("sigmoid ->", pred_idx_list)
-
-                #     # # If the first (i.e., second best) is "O", ignore/remove it
-                #     if pred_idx_list[0] == outside_index:
-                #         pred_idx_list = pred_idx_list[1:]
-                #     # If the second (i.e., the best) is "O", ignore/remove the first
-                #     elif pred_idx_list[1] == outside_index:
-                #         pred_idx_list = pred_idx_list[1:]
-                #     else:
-                #         pass
-
-                #     #print("here NOT")
-                #     #print(pred_idx_list.tolist())
-                #     multi_one_hot = []
-                #     for index in range(num_classes):
-                #         if index in pred_idx_list:
-                #             multi_one_hot.append(1.)
-                #         else:
-                #             multi_one_hot.append(0.)
-
-                #     predictions[i][j] = torch.tensor(multi_one_hot)
-
-                j += 1
-
-        # ==========
-
-
-        #predictions = pred_over_thresh
-        #print(pred_over_thresh, pred_over_thresh.shape, type(pred_over_thresh))
-        #print(predictions, predictions.shape, type(predictions))
-
-
-
-        # Iterate over timesteps in batch.
+        # Select the predicted labels of all the tokens at once, padding gets no label
         batch_size = gold_labels.size(0)
-        for i in range(batch_size):
-            #flattened_predictions = predictions[i].nonzero().cpu().numpy()
-            #flattened_gold_labels = gold_labels[i].nonzero().cpu().numpy()
-
-            for j in range(len(predictions[i])):
-                preds = predictions[i][j].nonzero().cpu().numpy()
-                golds = gold_labels[i][j].nonzero().cpu().numpy()
-                #print(preds, golds)
-
-                for prediction in preds:
-                    if prediction in golds:
-                        if prediction != outside_index:
-                            self._true_positives[str(prediction[0])] += 1
-                    else:
-                        self._false_positives[str(prediction[0])] += 1
-                for gold in golds:
-                    if gold not in preds:
-                        self._false_negatives[str(gold[0])] += 1
-
-
-
-
+        multi_hot = multi_hot_predictions(predictions.view(-1, num_classes).numpy(),
+                                          self.threshold, self.max_heads, outside_index)
+        predicted = torch.from_numpy(multi_hot).view(batch_size, padded_document_length, num_classes)
+        gold = gold_labels != 0
+
+        true_positives = (predicted & gold).sum((0, 1))
+        true_positives[outside_index] = 0
+        false_positives = (predicted & ~gold).sum((0, 1))
+        false_negatives = (gold & ~predicted).sum((0, 1))
+
+        if self._true_positives is None:
+            self._true_positives = torch.zeros(num_classes, dtype=torch.long)
+            self._false_positives = torch.zeros(num_classes, dtype=torch.long)
+            self._false_negatives = torch.zeros(num_classes, dtype=torch.long)
+        self._true_positives += true_positives
+        self._false_positives += false_positives
+        self._false_negatives += false_negatives
 
         #sequence_lengths = get_lengths_from_binary_sequence_mask(mask[:,:,0])#(mask)
         # argmax_predictions = predictions.max(-1)[1]
@@ -481,15 +375,21 @@ class MultiSpanBasedF1Measure(Metric):
         Additionally, an ``overall`` key is included, which provides the precision,
         recall and f1-measure for all spans.
         """
-        all_tags: Set[str] = set()
-        all_tags.update(self._true_positives.keys())
-        all_tags.update(self._false_positives.keys())
-        all_tags.update(self._false_negatives.keys())
+        true_positives: Dict[str, int] = {}
+        false_positives: Dict[str, int] = {}
+        false_negatives: Dict[str, int] = {}
+        if self._true_positives is not None:
+            # Only the labels that were counted at least once get a metric
+            counts = torch.stack([self._true_positives, self._false_positives, self._false_negatives])
+            for label_id in counts.sum(0).nonzero().view(-1).tolist():
+                tag = str(label_id)
+                true_positives[tag], false_positives[tag], false_negatives[tag] = counts[:, label_id].tolist()
+
         all_metrics = {}
-        for tag in all_tags:
-            precision, recall, f1_measure = self._compute_metrics(self._true_positives[tag],
-                                                                  self._false_positives[tag],
-                                                                  self._false_negatives[tag])
+        for tag in true_positives:
+            precision, recall, f1_measure = self._compute_metrics(true_positives[tag],
+                                                                  false_positives[tag],
+                                                                  false_negatives[tag])
             precision_key = "precision" + "-" + tag
             recall_key = "recall" + "-" + tag
             f1_key = "f1-measure" + "-" + tag
@@ -498,9 +398,9 @@ class MultiSpanBasedF1Measure(Metric):
             all_metrics[f1_key] = f1_measure
 
         # Compute the precision, recall and f1 for all spans jointly.
-        precision, recall, f1_measure = self._compute_metrics(sum(self._true_positives.values()),
-                                                              sum(self._false_positives.values()),
-                                                              sum(self._false_negatives.values()))
+        precision, recall, f1_measure = self._compute_metrics(sum(true_positives.values()),
+                                                              sum(false_positives.values()),
+                                                              sum(false_negatives.values()))
         all_metrics["precision-overall"] = precision
         all_metrics["recall-overall"] = recall
         all_metrics["f1-measure-overall"] = f1_measure
@@ -516,6 +416,7 @@ class MultiSpanBasedF1Measure(Metric):
         return precision, recall, f1_measure
 
     def reset(self):
-        self._true_positives = defaultdict(int)
-        self._false_positives = defaultdict(int)
-        self._false_negatives = defaultdict(int)
+        self._true_positives = None
+        self._false_positives = None
+        self._false_negatives = None
+
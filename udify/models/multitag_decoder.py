@@ -70,6 +70,51 @@ def sequence_cross_entropy(log_probs: torch.FloatTensor,
         return per_batch_loss
 
 
+def decode_multilabel_indices(predictions: numpy.ndarray,
+                              threshold: float,
+                              max_heads: int,
+                              outside_index: int) -> List[List[int]]:
+    """
+    Selects the labels of each token from its sigmoid probabilities, for all the tokens at once.
+    A token with at most one label over ``threshold`` gets its best label. Otherwise it gets the (at most
+    ``max_heads``) labels over ``threshold``, in ``argpartition`` order; if "O" is among them, it is kept
+    alone when it is the last one, and the labels up to it are dropped otherwise.
+    :param predictions: the probabilities, of shape (num_tokens, num_classes)
+    :param threshold: the probability a label needs to be selected
+    :param max_heads: the maximum number of labels of a token
+    :param outside_index: the index of the "O" label
+    :return: the list of selected label indices of each token
+    """
+    pred_over_thresh = (predictions >= threshold) * predictions
+    num_pred_over_thresh = numpy.count_nonzero(pred_over_thresh, axis=-1)
+    num_labels = numpy.minimum(num_pred_over_thresh, max_heads)
+
+    token_labels = [[label] for label in numpy.argmax(predictions, axis=-1).tolist()]
+
+    # Tokens with the same number of labels are partitioned together, which gives the very same
+    # order as partitioning them one by one
+    multi_label_rows = num_pred_over_thresh >= 2
+    for k in numpy.unique(num_labels[multi_label_rows]).tolist():
+        rows = numpy.nonzero(multi_label_rows & (num_labels == k))[0]
+        pred_idx = numpy.argpartition(pred_over_thresh[rows], -k, axis=-1)[:, -k:]
+        columns = numpy.arange(pred_idx.shape[1])
+
+        is_outside = pred_idx == outside_index
+        has_outside = is_outside.any(axis=-1)[:, numpy.newaxis]
+        outside_position = is_outside.argmax(axis=-1)[:, numpy.newaxis]
+        # If the last (i.e., the best) is "O", ignore/remove the others,
+        # o.w. get only from the last before the "O"
+        keep = ~has_outside \
+            | (columns > outside_position) \
+            | ((outside_position == pred_idx.shape[1] - 1) & (columns == outside_position))
+
+        has_outside = has_outside[:, 0].tolist()
+        for row, labels, row_keep, outside in zip(rows.tolist(), pred_idx.tolist(), keep.tolist(), has_outside):
+            token_labels[row] = [label for label, kept in zip(labels, row_keep) if kept] if outside else labels
+
+    return token_labels
+
+
 @Model.register("multitag_decoder")
 class MultiTagDecoder(Model):
     """
@@ -556,127 +601,20 @@ class MultiTagDecoder(Model):
 
     @overrides
     def decode(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
-        all_words = output_dict["words"]
-
         all_predictions = output_dict["class_probabilities"][self.task].cpu().data.numpy()
-        if all_predictions.ndim == 3:
-            predictions_list = [all_predictions[i] for i in range(all_predictions.shape[0])]
-        else:
-            predictions_list = [all_predictions]
-        all_tags = []
-        for predictions, words in zip(predictions_list, all_words):
-
-            # Hard-coded parameters for now
-            THRESH = self.threshold
-            k = self.max_heads
-            outside_index = self.vocab.get_token_index("O", namespace=self.task)
-
-            # Get the thresholded matrix and prepare the prediction sequence
-            pred_over_thresh = (predictions >= THRESH) * predictions
-            sequence_token_labels = []
-            maxxx = numpy.argmax(predictions, axis=-1).tolist()
-
-            # For each label set, check if to apply argmax or sigmoid thresh
-            j=0
-            for pred in pred_over_thresh:
-                num_pred_over_thresh = numpy.count_nonzero(pred)
-
-                if (num_pred_over_thresh == 0) or (num_pred_over_thresh == 1):
-                    pred_idx_list = [maxxx[j]]
-
-                elif num_pred_over_thresh <= k:
-                    pred_idx_list = list(numpy.argpartition(pred, -num_pred_over_thresh)[-num_pred_over_thresh:])
-
-                    outside_position = -1
-                    try:
-                        outside_position = pred_idx_list.index(outside_index)
-                    except ValueError:
-                        outside_position = -1
-                    # outside_position = None
-                    # for el_i in range(len(pred_idx_list)):
-                    #     if pred_idx_list[el_i] == outside_index:
-                    #         outside_position = el_i
-                    #         break
-                    if outside_position != -1:
-                        pred_len = len(pred_idx_list)-1
-                        # If the last (i.e., the best) is "O", ignore/remove the others
-                        if outside_position == pred_len:
-                            pred_idx_list = [pred_idx_list[-1]]
-                        # O.w. get only from the last before the "O"
-                        else:
-                            # del pred_idx_list[outside_position]
-                            pred_idx_list = pred_idx_list[outside_position+1:]
-
-                else:
-                    pred_idx_list = list(numpy.argpartition(pred, -k)[-k:])
-
-                    outside_position = -1
-                    try:
-                        outside_position = pred_idx_list.index(outside_index)
-                    except ValueError:
-                        outside_position = -1
-                    # outside_position = None
-                    # for el_i in range(len(pred_idx_list)):
-                    #     if pred_idx_list[el_i] == outside_index:
-                    #         outside_position = el_i
-                    #         break
-                    if outside_position != -1:
-                        pred_len = len(pred_idx_list)-1
-                        # If the last (i.e., the best) is "O", ignore/remove the others
-                        if outside_position == pred_len:
-                            pred_idx_list = [pred_idx_list[-1]]
-                        # O.w. get only from the last before the "O"
-                        else:
-                            # del pred_idx_list[outside_position]
-                            pred_idx_list = pred_idx_list[outside_position+1:]
-
-
-                # if num_pred_over_thresh < k:
-                #     pred_idx_list = [maxxx[j]]
-                #     # print("argmax  ->", pred_idx_list)
-                # else:
-                #     #pred_idx_list = [maxxx[j]]
-                #     pred_idx_list = list(numpy.argpartition(pred, -k)[-k:])
-                #     # # print("sigmoid ->", pred_idx_list)
-
-                #     # # If the first (i.e., second best) is "O", ignore/remove it
-                #     if pred_idx_list[0] == outside_index:
-                #         pred_idx_list = pred_idx_list[1:]
-                #     # If the second (i.e., the best) is "O", ignore/remove the first
-                #     elif pred_idx_list[1] == outside_index:
-                #         pred_idx_list = pred_idx_list[1:]
-                #     else:
-                #         pass
-
-                sequence_token_labels.append(pred_idx_list)
-                j += 1
-
-            # Create the list of tags to append for the output
-            tags = []
-            for token_labels in sequence_token_labels:
-                curr_labels = []
-                for token_label in token_labels:
-                    curr_labels.append(
-                        self.vocab.get_token_from_index(token_label, namespace=self.task))
-                tags.append(curr_labels)
-            # print(tags)
-
-            # argmax_indices = numpy.argmax(predictions, axis=-1)
-            # tags = [self.vocab.get_token_from_index(x, namespace=self.task)
-            #         for x in argmax_indices]
-
-            # # TODO: specific task
-            # if self.task == "lemmas":
-            #     def decode_lemma(word, rule):
-            #         if rule == "_":
-            #             return "_"
-            #         if rule == "@@UNKNOWN@@":
-            #             return word
-            #         return apply_lemma_rule(word, rule)
-            #     tags = [decode_lemma(word, rule) for word, rule in zip(words, tags)]
-
-            all_tags.append(tags)
-        output_dict[self.task] = all_tags
+        if all_predictions.ndim != 3:
+            all_predictions = all_predictions[numpy.newaxis]
+        batch_size, sequence_length, num_classes = all_predictions.shape
+        batch_size = min(batch_size, len(output_dict["words"]))
+
+        outside_index = self.vocab.get_token_index("O", namespace=self.task)
+        token_labels = decode_multilabel_indices(all_predictions[:batch_size].reshape(-1, num_classes),
+                                                 self.threshold, self.max_heads, outside_index)
+
+        # Create the list of tags to append for the output
+        index_to_token = self.vocab.get_index_to_token_vocabulary(self.task)
+        tags = [[index_to_token[label] for label in labels] for labels in token_labels]
+        output_dict[self.task] = [tags[i * sequence_length:(i + 1) * sequence_length] for i in range(batch_size)]
 
         return output_dict
 
@@ -4,6 +4,7 @@ The base UDify model for training and prediction
 
 from typing import Optional, Any, Dict, List, Tuple
 from overrides import overrides
+import os
 import logging
 
 import torch
@@ -18,17 +19,25 @@ from allennlp.nn import InitializerApplicator, RegularizerApplicator
 from allennlp.nn.util import get_text_field_mask
 
 from udify.modules.scalar_mix import ScalarMixWithDropout
+from udify.modules.embedding_cache import EmbeddingCache
 
 import udify.dataset_readers.universal_dependencies as reader
 
 logger = logging.getLogger(__name__)
 
+# The relative head positions are clamped to [-k, k] by reader.dep_encoding
+DEP_ENCODING_K = 10
+
 
 @Model.register("udify_model")
 class UdifyModel(Model):
     """
     The UDify model base class. Applies a sequence of shared encoders before decoding in a multi-task configuration.
     Uses TagDecoder and DependencyDecoder to decode each UD task.
+
+    :param embedding_cache: an optional directory of embeddings cached by ``cache_embeddings.py``. The cached
+        embedder must be frozen: its output is read from the cache instead of being computed, for the batches
+        whose sentences are all cached. A missing cache is ignored, e.g., when loading the trained model later.
     """
 
     def __init__(self,
@@ -47,6 +56,7 @@ class UdifyModel(Model):
                  layer_dropout: int = 0.0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  bert_path: str = "config/archive/bert-base-multilingual-cased/vocab.txt",
+                 embedding_cache: str = None,
                  regularizer: Optional[RegularizerApplicator] = None) -> None:
         super(UdifyModel, self).__init__(vocab, regularizer)
 
@@ -82,6 +92,25 @@ class UdifyModel(Model):
 
         self.metrics = {}
 
+        # Built on the first forward pass of a "dependency" task, see _get_dep_encoding_table
+        self._dep_encoding_table = None
+
+        self.embedding_cache = None
+        if embedding_cache and not os.path.isdir(embedding_cache):
+            # The path stays in the config of the archived model, the cache may be gone when it is loaded again
+            logger.warning(f"No embedding cache in {embedding_cache}, the embeddings are computed")
+        elif embedding_cache:
+            self.embedding_cache = EmbeddingCache(embedding_cache)
+        if self.embedding_cache is not None:
+            embedder = getattr(text_field_embedder, f"token_embedder_{self.embedding_cache.embedder}")
+            if any(parameter.requires_grad for parameter in embedder.parameters()):
+                raise ConfigurationError(f"The embedding cache holds the output of a frozen embedder, set "
+                                         f"requires_grad to false for {self.embedding_cache.embedder}")
+            cached_layers = (self.embedding_cache.combine_layers, self.embedding_cache.max_layers)
+            if cached_layers != (embedder.combine_layers, embedder.max_layers):
+                raise ConfigurationError(f"The embedding cache holds combine_layers, max_layers = {cached_layers}, "
+                                         f"but the embedder has {(embedder.combine_layers, embedder.max_layers)}")
+
         for task in self.tasks:
             if task not in self.decoders:
                 raise ConfigurationError(f"Task {task} has no corresponding decoder. Make sure their names match.")
@@ -110,7 +139,13 @@ class UdifyModel(Model):
         mask = get_text_field_mask(tokens)
         self._apply_token_dropout(tokens)
 
-        embedded_text_input = self.text_field_embedder(tokens)
+        precomputed = None
+        if self.embedding_cache is not None and metadata is not None:
+            embeddings = self.embedding_cache.get([x["words"] for x in metadata], mask.size(1), mask.device)
+            if embeddings is not None:
+                precomputed = {self.embedding_cache.embedder: embeddings}
+
+        embedded_text_input = self.text_field_embedder(tokens, precomputed=precomputed)
 
         if self.post_encoder_embedder:
             post_embeddings = self.post_encoder_embedder(tokens)
@@ -148,17 +183,15 @@ class UdifyModel(Model):
                                                   gold_tags.get("head_tags", None), gold_tags.get("head_indices", None), metadata)
                 for key in ["heads", "head_tags", "arc_loss", "tag_loss", "mask"]:
                     output_dict[key] = pred_output[key]
-                tmp_tensor = torch.zeros((decoder_input.shape[0], decoder_input.shape[1]))
-                for sent in range(tmp_tensor.shape[0]):
-                    for idx in range(tmp_tensor.shape[1]):
-                        if pred_output['mask'][sent][idx].item() == 1:
-                            encoded_dep = reader.dep_encoding(idx, output_dict['heads'][sent][idx].item(),
-                                                            self.vocab.get_token_from_index(output_dict['head_tags'][sent][idx].item(), 'head_tags'))
-                            encoded_dep_id = self.vocab.get_token_index(encoded_dep,'dep_encoded')
-                            tmp_tensor[sent][idx] = encoded_dep_id
-                        else:
-                            tmp_tensor[sent][idx] = 0
-                pred_classes = tuple([tmp_tensor.long().to(decoder_input.device), False])
+                # The predictions start with the ROOT sentinel, only the first sequence_length are encoded
+                sequence_length = decoder_input.shape[1]
+                heads = output_dict['heads'][:, :sequence_length].long()
+                head_tags = output_dict['head_tags'][:, :sequence_length].long()
+                positions = torch.arange(sequence_length, device=heads.device).unsqueeze(0) + 1 - heads
+                positions = positions.masked_fill(heads == 0, 0).clamp(-DEP_ENCODING_K, DEP_ENCODING_K)
+                encoded_deps = self._get_dep_encoding_table(heads.device)[positions + DEP_ENCODING_K, head_tags]
+                encoded_deps = encoded_deps.masked_fill(pred_output['mask'][:, :sequence_length] != 1, 0)
+                pred_classes = tuple([encoded_deps.to(decoder_input.device), False])
             else:
                 pred_output = self.decoders[task](decoder_input, mask, gold_tags, pred_classes, metadata)
                 logits[task] = pred_output["logits"]
@@ -191,6 +224,24 @@ class UdifyModel(Model):
 
         return output_dict
 
+    def _get_dep_encoding_table(self, device: torch.device) -> torch.LongTensor:
+        """
+        Builds (once) the lookup table from the relative head position, shifted by ``DEP_ENCODING_K``,
+        and the head tag index to the index of its ``reader.dep_encoding`` in the 'dep_encoded' namespace.
+        """
+        table = self._dep_encoding_table
+        if table is None:
+            head_tags = [self.vocab.get_token_from_index(tag_idx, 'head_tags')
+                         for tag_idx in range(self.vocab.get_vocab_size('head_tags'))]
+            # dep_encoding(position, 1, tag) encodes exactly the relative position "position"
+            table = torch.LongTensor([[self.vocab.get_token_index(reader.dep_encoding(position, 1, tag), 'dep_encoded')
+                                       for tag in head_tags]
+                                      for position in range(-DEP_ENCODING_K, DEP_ENCODING_K + 1)])
+        if table.device != device:
+            table = table.to(device)
+        self._dep_encoding_table = table
+        return table
+
     def _apply_token_dropout(self, tokens):
         # Word dropout
         if "tokens" in tokens:
@@ -3,7 +3,10 @@ An extension of AllenNLP's BERT pretrained helper classes. Supports modification
 a sliding window approach for long sentences.
 """
 
-from typing import Dict, List, Callable, Tuple
+from typing import Dict, List, Callable, Tuple, Iterator, Optional
+from collections import OrderedDict, deque
+import os
+import json
 import logging
 
 from overrides import overrides
@@ -14,6 +17,7 @@ import torch.nn.functional as F
 from pytorch_pretrained_bert.tokenization import BertTokenizer
 from pytorch_pretrained_bert.modeling import BertModel, BertConfig
 
+from allennlp.common.checks import ConfigurationError
 from allennlp.common.util import pad_sequence_to_length
 from allennlp.modules.token_embedders import TokenEmbedder
 from allennlp.data.vocabulary import Vocabulary
@@ -72,6 +76,20 @@ class WordpieceIndexer(TokenIndexer[int]):
         By default, long sequences will be truncated to the maximum sequence
         length. Otherwise, they will be split apart and batched using a
         sliding window.
+    windowing : ``str``, optional (default=``"stride"``)
+        How long sequences are split into windows, unless truncated. With "stride", the windows
+        overlap by half their length, regardless of word boundaries. With "word", the windows are
+        made of whole words and overlap by at most ``window_overlap`` wordpieces; the indices to
+        recombine them are then computed here (the ``{index_name}-select`` key), to be passed to
+        the embedder.
+    window_overlap : ``int``, optional (default=``None``)
+        With "word" windowing, the maximum number of wordpieces of a window that are repeated in the
+        next one, for context. By default, a quarter of the window.
+    cache_size : ``int``, optional (default=100000)
+        The wordpiece ids of the (possibly lowercased) tokens are cached, as the same words occur
+        over and over, keeping up to this many of the most recently used ones. 0 disables the cache.
+    cache_file : ``str``, optional (default=``None``)
+        A file saved by ``save_cache`` to fill the cache from, if it exists.
     """
     def __init__(self,
                  vocab: Dict[str, int],
@@ -85,7 +103,11 @@ class WordpieceIndexer(TokenIndexer[int]):
                  end_tokens: List[str] = None,
                  separator_token: str = "[SEP]",
                  truncate_long_sequences: bool = True,
-                 token_min_padding_length: int = 0) -> None:
+                 token_min_padding_length: int = 0,
+                 windowing: str = "stride",
+                 window_overlap: int = None,
+                 cache_size: int = 100000,
+                 cache_file: str = None) -> None:
 
         super().__init__(token_min_padding_length)
         self.vocab = vocab
@@ -103,6 +125,11 @@ class WordpieceIndexer(TokenIndexer[int]):
         self._do_lowercase = do_lowercase
         self._truncate_long_sequences = truncate_long_sequences
 
+        if windowing not in ("stride", "word"):
+            raise ConfigurationError(f"windowing should be 'stride' or 'word', got '{windowing}'")
+        self._windowing = windowing
+        self._window_overlap = window_overlap
+
         if never_lowercase is None:
             # Use the defaults
             self._never_lowercase = set(_NEVER_LOWERCASE)
@@ -121,6 +148,118 @@ class WordpieceIndexer(TokenIndexer[int]):
         self._separator_ids = [vocab[wordpiece]
                                for wordpiece in wordpiece_tokenizer(separator_token)]
 
+        window_length = self.max_pieces - len(self._start_piece_ids) - len(self._end_piece_ids)
+        if self._window_overlap is None:
+            self._window_overlap = window_length // 4
+        if not 0 <= self._window_overlap < window_length:
+            raise ConfigurationError(f"window_overlap should be between 0 and {window_length - 1}, "
+                                     f"got {self._window_overlap}")
+
+        # An LRU cache from the token text to its wordpiece ids, shared by all the instances
+        self._cache_size = cache_size
+        self._cache: Dict[str, List[int]] = OrderedDict()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        if cache_file and os.path.exists(cache_file):
+            self.load_cache(cache_file)
+
+    def _get_wordpiece_ids(self, text: str) -> List[int]:
+        wordpiece_ids = self._cache.get(text)
+        if wordpiece_ids is not None:
+            self._cache.move_to_end(text)
+            self._cache_hits += 1
+            return wordpiece_ids
+
+        self._cache_misses += 1
+        wordpiece_ids = [self.vocab[wordpiece] for wordpiece in self.wordpiece_tokenizer(text)]
+        if self._cache_size:
+            self._cache[text] = wordpiece_ids
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return wordpiece_ids
+
+    def _window_by_words(self,
+                         token_wordpiece_ids: List[List[int]],
+                         window_length: int) -> Tuple[List[int], List[int]]:
+        """
+        Splits the wordpieces into windows of whole words (only a word longer than a window is split),
+        each repeating at most ``window_overlap`` wordpieces of the previous one. The windows get the
+        start/end wordpieces and all but the last are padded to ``max_pieces``, so that the embedder can
+        split them apart. Returns the wordpiece ids of the windows and, for each position of the
+        unwindowed sequence (start wordpieces, wordpieces, end wordpieces), the position of its
+        wordpiece in the window where it has the most context on both sides.
+        """
+        # The units that are not split between windows
+        units = [word[i:i + window_length]
+                 for word in token_wordpiece_ids for i in range(0, len(word), window_length)]
+
+        windows: List[Tuple[int, int]] = []
+        start = 0
+        while True:
+            end, length = start, 0
+            while end < len(units) and length + len(units[end]) <= window_length:
+                length += len(units[end])
+                end += 1
+            windows.append((start, end))
+            if end == len(units):
+                break
+
+            # The next window starts with as many of the last units as fit in the overlap,
+            # while leaving room for the unit that did not fit in this one
+            next_start, overlap = end, 0
+            while (next_start - 1 > start
+                   and overlap + len(units[next_start - 1]) <= self._window_overlap
+                   and overlap + len(units[next_start - 1]) + len(units[end]) <= window_length):
+                next_start -= 1
+                overlap += len(units[next_start])
+            start = next_start
+
+        # The units shared by two windows are split between them in the middle
+        bounds = ([0] + [(windows[i + 1][0] + windows[i][1]) // 2 for i in range(len(windows) - 1)]
+                  + [len(units)])
+
+        num_start_pieces, num_end_pieces = len(self._start_piece_ids), len(self._end_piece_ids)
+        wordpiece_ids: List[int] = []
+        select_indices = list(range(num_start_pieces))
+        for i, (start, end) in enumerate(windows):
+            position = len(wordpiece_ids) + num_start_pieces
+            for unit in range(start, end):
+                if bounds[i] <= unit < bounds[i + 1]:
+                    select_indices.extend(range(position, position + len(units[unit])))
+                position += len(units[unit])
+
+            window = (self._start_piece_ids + [wordpiece for unit in units[start:end] for wordpiece in unit]
+                      + self._end_piece_ids)
+            if i < len(windows) - 1:
+                window += [0] * (self.max_pieces - len(window))
+            wordpiece_ids.extend(window)
+        select_indices.extend(range(len(wordpiece_ids) - num_end_pieces, len(wordpiece_ids)))
+
+        return wordpiece_ids, select_indices
+
+    def get_cache_statistics(self) -> Dict[str, float]:
+        lookups = self._cache_hits + self._cache_misses
+        return {"size": len(self._cache),
+                "hits": self._cache_hits,
+                "misses": self._cache_misses,
+                "hit_rate": self._cache_hits / lookups if lookups else 0.0}
+
+    def save_cache(self, cache_file: str) -> None:
+        """
+        Saves the cached wordpiece ids, e.g. next to the vocabulary, to be loaded with ``cache_file``.
+        """
+        with open(cache_file, "w") as f:
+            json.dump(self._cache, f)
+
+    def load_cache(self, cache_file: str) -> None:
+        with open(cache_file) as f:
+            for text, wordpiece_ids in json.load(f).items():
+                self._cache[text] = wordpiece_ids
+        # Keep the most recently saved ones if the cache is smaller than the file
+        while self._cache_size and len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        logger.info(f"Loaded {len(self._cache)} cached wordpiece tokenizations from {cache_file}")
+
     @overrides
     def count_vocab_items(self, token: Token, counter: Dict[str, Dict[str, int]]):
         # If we only use pretrained models, we don't need to do anything here.
@@ -148,10 +287,7 @@ class WordpieceIndexer(TokenIndexer[int]):
                 for token in tokens)
 
         # Obtain a nested sequence of wordpieces, each represented by a list of wordpiece ids
-        token_wordpiece_ids = [
-            [self.vocab[wordpiece] for wordpiece in self.wordpiece_tokenizer(token)]
-            for token in text
-        ]
+        token_wordpiece_ids = [self._get_wordpiece_ids(token) for token in text]
 
         # offsets[i] will give us the index into wordpiece_ids
         # for the wordpiece "corresponding to" the i-th input token.
@@ -199,6 +335,7 @@ class WordpieceIndexer(TokenIndexer[int]):
         # Specify the stride to be half of `self.max_pieces`, minus any additional start/end wordpieces
         window_length = self.max_pieces - len(self._start_piece_ids) - len(self._end_piece_ids)
         stride = window_length // 2
+        select_indices = None
 
         if len(flat_wordpiece_ids) <= window_length:
             # If all the wordpieces fit, then we don't need to do anything special
@@ -208,11 +345,14 @@ class WordpieceIndexer(TokenIndexer[int]):
                            "`truncate_long_sequences` to False"
                            f"{[token.text for token in tokens]}")
             wordpiece_windows = [self._start_piece_ids + flat_wordpiece_ids[:window_length] + self._end_piece_ids]
+        elif self._windowing == "word":
+            wordpiece_windows = None
+            wordpiece_ids, select_indices = self._window_by_words(token_wordpiece_ids, window_length)
         else:
             # Create a sliding window of wordpieces of length `max_pieces` that advances by `stride` steps and
             # add start/end wordpieces to each window
-            # TODO: this currently does not respect word boundaries, so words may be cut in half between windows
-            # However, this would increase complexity, as sequences would need to be padded/unpadded in the middle
+            # This does not respect word boundaries, so words may be cut in half between windows
+            # (see the "word" windowing, which does, at the cost of padding the windows in the middle)
             wordpiece_windows = [self._start_piece_ids + flat_wordpiece_ids[i:i+window_length] + self._end_piece_ids
                                  for i in range(0, len(flat_wordpiece_ids), stride)]
 
@@ -222,11 +362,18 @@ class WordpieceIndexer(TokenIndexer[int]):
             if last_window == penultimate_window[-len(last_window):]:
                 wordpiece_windows = wordpiece_windows[:-1]
 
-        # Flatten the wordpiece windows
-        wordpiece_ids = [wordpiece for sequence in wordpiece_windows for wordpiece in sequence]
+        if wordpiece_windows is not None:
+            # Flatten the wordpiece windows
+            wordpiece_ids = [wordpiece for sequence in wordpiece_windows for wordpiece in sequence]
 
-        # Constructing `token_type_ids` by `self._separator`
-        token_type_ids = _get_token_type_ids(wordpiece_ids, self._separator_ids)
+        if self._windowing == "word":
+            # A single window needs no recombination. Each window is a segment of its own
+            if select_indices is None:
+                select_indices = list(range(len(wordpiece_ids)))
+            token_type_ids = [0] * len(wordpiece_ids)
+        else:
+            # Constructing `token_type_ids` by `self._separator`
+            token_type_ids = _get_token_type_ids(wordpiece_ids, self._separator_ids)
 
         # Our mask should correspond to the original tokens,
         # because calling util.get_text_field_mask on the
@@ -237,12 +384,15 @@ class WordpieceIndexer(TokenIndexer[int]):
         # is captured by the offsets.
         mask = [1 for _ in offsets]
 
-        return {
+        indices = {
             index_name: wordpiece_ids,
             f"{index_name}-offsets": offsets,
             f"{index_name}-type-ids": token_type_ids,
             "mask": mask
         }
+        if select_indices is not None:
+            indices[f"{index_name}-select"] = select_indices
+        return indices
 
     @overrides
     def get_padding_token(self) -> int:
@@ -269,8 +419,10 @@ class WordpieceIndexer(TokenIndexer[int]):
         """
         We need to override this because the indexer generates multiple keys.
         """
-        # pylint: disable=no-self-use
-        return [index_name, f"{index_name}-offsets", f"{index_name}-type-ids", "mask"]
+        keys = [index_name, f"{index_name}-offsets", f"{index_name}-type-ids", "mask"]
+        if self._windowing == "word":
+            keys.append(f"{index_name}-select")
+        return keys
 
 
 @TokenIndexer.register("udify-bert-pretrained")
@@ -306,6 +458,14 @@ class PretrainedBertIndexer(WordpieceIndexer):
         By default, long sequences will be truncated to the maximum sequence
         length. Otherwise, they will be split apart and batched using a
         sliding window.
+    windowing : ``str``, optional (default=``"stride"``)
+        How long sequences are split into windows, "stride" or "word", see ``WordpieceIndexer``.
+    window_overlap : ``int``, optional (default=``None``)
+        With "word" windowing, the maximum overlap of the windows, see ``WordpieceIndexer``.
+    cache_size : ``int``, optional (default=100000)
+        How many tokenized words to cache, see ``WordpieceIndexer``.
+    cache_file : ``str``, optional (default=``None``)
+        A file saved by ``save_cache`` to fill the cache from, if it exists.
     """
 
     def __init__(self,
@@ -314,7 +474,11 @@ class PretrainedBertIndexer(WordpieceIndexer):
                  do_lowercase: bool = True,
                  never_lowercase: List[str] = None,
                  max_pieces: int = 512,
-                 truncate_long_sequences: bool = False) -> None:
+                 truncate_long_sequences: bool = False,
+                 windowing: str = "stride",
+                 window_overlap: int = None,
+                 cache_size: int = 100000,
+                 cache_file: str = None) -> None:
         if pretrained_model.endswith("-cased") and do_lowercase:
             logger.warning("Your BERT model appears to be cased, "
                            "but your indexer is lowercasing tokens.")
@@ -333,7 +497,11 @@ class PretrainedBertIndexer(WordpieceIndexer):
                          start_tokens=["[CLS]"],
                          end_tokens=["[SEP]"],
                          separator_token="[SEP]",
-                         truncate_long_sequences=truncate_long_sequences)
+                         truncate_long_sequences=truncate_long_sequences,
+                         windowing=windowing,
+                         window_overlap=window_overlap,
+                         cache_size=cache_size,
+                         cache_file=cache_file)
 
 
 def _get_token_type_ids(wordpiece_ids: List[int],
@@ -386,6 +554,18 @@ class BertEmbedder(TokenEmbedder):
         The number of ending tokens input to BERT (usually 1, i.e., [SEP])
     combine_layers : str, optional (default: "mix")
         Options: "mix", "last", "all"
+    max_layers : int, optional (default: None)
+        If set, only the first ``max_layers`` BERT layers are computed, and they are the ones that are
+        mixed ("mix"), returned ("all"), or the last of which is returned ("last"). E.g., when the model
+        only uses the first ``max(layers_for_tasks)`` layers, the remaining ones need not be computed.
+    pack_sequences : bool, optional (default: False)
+        At inference (i.e., not training), pack the (windows of the) sentences of a batch into as few
+        sequences of at most ``packed_length`` wordpieces as possible, each sentence attending only to
+        itself and with its own position ids, and unpack the output. This saves the computation spent on
+        padding when the sentences of a batch have very different lengths, e.g., many short ones and a
+        few long ones. Nothing is packed if it would not make the input smaller.
+    packed_length : int, optional (default: None)
+        The maximum length of the packed sequences, ``max_pieces`` by default.
     """
     def __init__(self,
                  bert_model: BertModel,
@@ -393,7 +573,10 @@ class BertEmbedder(TokenEmbedder):
                  start_tokens: int = 1,
                  end_tokens: int = 1,
                  layer_dropout: float = 0.0,
-                 combine_layers: str = "mix") -> None:
+                 combine_layers: str = "mix",
+                 max_layers: int = None,
+                 pack_sequences: bool = False,
+                 packed_length: int = None) -> None:
         super().__init__()
         self.bert_model = bert_model
         self.output_dim = bert_model.config.hidden_size
@@ -401,9 +584,16 @@ class BertEmbedder(TokenEmbedder):
         self.start_tokens = start_tokens
         self.end_tokens = end_tokens
         self.combine_layers = combine_layers
+        self.pack_sequences = pack_sequences
+        self.packed_length = packed_length or max_pieces
+
+        num_layers = bert_model.config.num_hidden_layers
+        if max_layers is not None and not 0 < max_layers <= num_layers:
+            raise ConfigurationError(f"max_layers should be between 1 and {num_layers}, got {max_layers}")
+        self.max_layers = max_layers or num_layers
 
         if self.combine_layers == "mix":
-            self._scalar_mix = ScalarMixWithDropout(bert_model.config.num_hidden_layers,
+            self._scalar_mix = ScalarMixWithDropout(self.max_layers,
                                                     do_layer_norm=False,
                                                     dropout=layer_dropout)
         else:
@@ -415,7 +605,8 @@ class BertEmbedder(TokenEmbedder):
     def forward(self,
                 input_ids: torch.LongTensor,
                 offsets: torch.LongTensor = None,
-                token_type_ids: torch.LongTensor = None) -> torch.Tensor:
+                token_type_ids: torch.LongTensor = None,
+                select_indices: torch.LongTensor = None) -> torch.Tensor:
         """
         Parameters
         ----------
@@ -440,6 +631,10 @@ class BertEmbedder(TokenEmbedder):
             tokens from the first sentence should have type 0 and tokens from
             the second sentence should have type 1.  If you don't provide this
             (the default BertIndexer doesn't) then it's assumed to be all 0s.
+        select_indices : ``torch.LongTensor``, optional
+            The (batch_size, ..., unwindowed_sequence_length) positions of the windowed wordpieces
+            that make up the unwindowed sequence, computed by the indexer with "word" windowing. If not
+            provided, the windows are assumed to overlap by half their length.
         """
         # pylint: disable=arguments-differ
         batch_size, full_seq_len = input_ids.size(0), input_ids.size(-1)
@@ -468,6 +663,11 @@ class BertEmbedder(TokenEmbedder):
             # Now combine the sequences along the batch dimension
             input_ids = torch.cat(split_input_ids, dim=0)
 
+            if token_type_ids is not None:
+                split_token_type_ids = list(token_type_ids.split(self.max_pieces, dim=-1))
+                split_token_type_ids[-1] = F.pad(split_token_type_ids[-1], pad=[0, padding_amount], value=0)
+                token_type_ids = torch.cat(split_token_type_ids, dim=0)
+
         if token_type_ids is None:
             token_type_ids = torch.zeros_like(input_ids)
 
@@ -475,16 +675,43 @@ class BertEmbedder(TokenEmbedder):
 
         # input_ids may have extra dimensions, so we reshape down to 2-d
         # before calling the BERT model and then reshape back at the end.
-        all_encoder_layers, _ = self.bert_model(input_ids=util.combine_initial_dims(input_ids),
-                                                token_type_ids=util.combine_initial_dims(token_type_ids),
-                                                attention_mask=util.combine_initial_dims(input_mask))
-        all_encoder_layers = torch.stack(all_encoder_layers)
+        encoded_layers = self._encode(input_ids=util.combine_initial_dims(input_ids),
+                                      token_type_ids=util.combine_initial_dims(token_type_ids),
+                                      attention_mask=util.combine_initial_dims(input_mask))
+
+        # The layers are combined as they are computed, rather than stacking (a copy of) all of them.
+        # Mixing (a weighted sum) commutes with the selection of the windows and offsets below, so
+        # from here on all_encoder_layers is (layers, batch_size * d1 * ... * dn, sequence_length, embedding_dim)
+        # with a single layer, unless all of them are to be returned.
+        if self._scalar_mix is not None:
+            mixture = 0
+            for weight, layer in zip(self._scalar_mix.get_normed_weights(), encoded_layers):
+                mixture = mixture + weight * layer
+            all_encoder_layers = (self._scalar_mix.gamma * mixture).unsqueeze(0)
+        elif self.combine_layers == "last":
+            # Run all the layers, keeping only the output of the last one
+            all_encoder_layers = deque(encoded_layers, maxlen=1)[0].unsqueeze(0)
+        else:
+            all_encoder_layers = None
+            for i, layer in enumerate(encoded_layers):
+                if all_encoder_layers is None:
+                    all_encoder_layers = layer.new_empty((self.max_layers,) + layer.size())
+                all_encoder_layers[i] = layer
 
         if needs_split:
             # First, unpack the output embeddings into one long sequence again
             unpacked_embeddings = torch.split(all_encoder_layers, batch_size, dim=1)
             unpacked_embeddings = torch.cat(unpacked_embeddings, dim=2)
 
+        if needs_split and select_indices is not None:
+            # The windows follow word boundaries, and the indexer already knows what to select
+            select_indices2d = util.combine_initial_dims(select_indices)
+            range_vector = util.get_range_vector(select_indices2d.size(0),
+                                                 device=util.get_device_of(unpacked_embeddings)).unsqueeze(1)
+            initial_dims.append(select_indices2d.size(-1))
+
+            recombined_embeddings = unpacked_embeddings[:, range_vector, select_indices2d]
+        elif needs_split:
             # Next, select indices of the sequence such that it will result in embeddings representing the original
             # sentence. To capture maximal context, the indices will be the middle part of each embedded window
             # sub-sequence (plus any leftover start and final edge windows), e.g.,
@@ -517,9 +744,6 @@ class BertEmbedder(TokenEmbedder):
         # Recombine the outputs of all layers
         # (layers, batch_size * d1 * ... * dn, sequence_length, embedding_dim)
         # recombined = torch.cat(combined, dim=2)
-        input_mask = (recombined_embeddings != 0).long()
-
-        # At this point, mix is (batch_size * d1 * ... * dn, sequence_length, embedding_dim)
 
         if offsets is None:
             # Resize to (batch_size, d1, ..., dn, sequence_length, embedding_dim)
@@ -536,13 +760,117 @@ class BertEmbedder(TokenEmbedder):
 
             layers = util.uncombine_initial_dims(selected_embeddings, offsets.size())
 
-        if self._scalar_mix is not None:
-            return self._scalar_mix(layers, input_mask)
-        elif self.combine_layers == "last":
-            return layers[-1]
+        if self._scalar_mix is not None or self.combine_layers == "last":
+            return layers[0]
         else:
             return layers
 
+    def _encode(self,
+                input_ids: torch.LongTensor,
+                token_type_ids: torch.LongTensor,
+                attention_mask: torch.LongTensor) -> Iterator[torch.Tensor]:
+        """
+        Runs the first ``max_layers`` layers of BERT, as ``BertModel.forward`` does, yielding the
+        output of each layer as soon as it is computed. The pooler is skipped, as it is not used.
+        """
+        if self.pack_sequences and not self.training:
+            packing = self._get_packing(attention_mask)
+            if packing is not None:
+                yield from self._encode_packed(input_ids, token_type_ids, *packing)
+                return
+
+        extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
+        extended_attention_mask = extended_attention_mask.to(dtype=next(self.bert_model.parameters()).dtype)
+        extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+
+        hidden_states = self.bert_model.embeddings(input_ids, token_type_ids)
+        for layer_module in self.bert_model.encoder.layer[:self.max_layers]:
+            hidden_states = layer_module(hidden_states, extended_attention_mask)
+            yield hidden_states
+
+    def _get_packing(self, attention_mask: torch.LongTensor) -> Optional[Tuple[torch.Tensor, ...]]:
+        """
+        Packs the sequences (ignoring their padding, which is at the end) into packed sequences of at most
+        ``packed_length`` wordpieces, first-fit by decreasing length. Returns None if the packed sequences
+        would not be smaller than the input, else (1) the position in the flattened input of each packed
+        wordpiece, (2) the index of the sequence each packed wordpiece belongs to in its packed sequence,
+        -1 for padding, (3) its position id and (4) the position in the flattened packed sequences of each
+        input wordpiece, one past the end for padding.
+        """
+        num_sequences, sequence_length = attention_mask.size()
+        lengths = attention_mask.sum(-1).tolist()
+
+        bins, fills = [], []
+        for sequence in sorted(range(num_sequences), key=lambda i: -lengths[i]):
+            if lengths[sequence] == 0:
+                break
+            for i, fill in enumerate(fills):
+                if fill + lengths[sequence] <= self.packed_length:
+                    bins[i].append(sequence)
+                    fills[i] += lengths[sequence]
+                    break
+            else:
+                bins.append([sequence])
+                fills.append(lengths[sequence])
+
+        packed_length = max(fills, default=1)
+        if len(bins) * packed_length >= num_sequences * sequence_length:
+            return None
+
+        source = [[0] * packed_length for _ in bins]
+        segments = [[-1] * packed_length for _ in bins]
+        positions = [[0] * packed_length for _ in bins]
+        unpack = [[len(bins) * packed_length] * sequence_length for _ in range(num_sequences)]
+        for i, bin_sequences in enumerate(bins):
+            start = 0
+            for segment, sequence in enumerate(bin_sequences):
+                length = lengths[sequence]
+                source[i][start:start + length] = range(sequence * sequence_length,
+                                                        sequence * sequence_length + length)
+                segments[i][start:start + length] = [segment] * length
+                positions[i][start:start + length] = range(length)
+                unpack[sequence][:length] = range(i * packed_length + start, i * packed_length + start + length)
+                start += length
+
+        device = attention_mask.device
+        return tuple(torch.tensor(indices, dtype=torch.long, device=device)
+                     for indices in (source, segments, positions, unpack))
+
+    def _encode_packed(self,
+                       input_ids: torch.LongTensor,
+                       token_type_ids: torch.LongTensor,
+                       source: torch.LongTensor,
+                       segments: torch.LongTensor,
+                       position_ids: torch.LongTensor,
+                       unpack: torch.LongTensor) -> Iterator[torch.Tensor]:
+        """
+        Like ``_encode``, but runs BERT on the sequences packed by ``_get_packing``, with block-diagonal
+        attention masks, and yields the output of each layer unpacked to the shape of the input.
+        """
+        padding = segments < 0
+        input_ids = input_ids.view(-1)[source].masked_fill(padding, 0)
+        token_type_ids = token_type_ids.view(-1)[source].masked_fill(padding, 0)
+
+        # Each wordpiece attends to the wordpieces of its own sequence only
+        attention_mask = (segments.unsqueeze(2) == segments.unsqueeze(1)) & ~padding.unsqueeze(1)
+        extended_attention_mask = attention_mask.unsqueeze(1)
+        extended_attention_mask = extended_attention_mask.to(dtype=next(self.bert_model.parameters()).dtype)
+        extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+
+        # As BertEmbeddings.forward, but with the position ids restarting at each sequence
+        embeddings = self.bert_model.embeddings
+        hidden_states = (embeddings.word_embeddings(input_ids)
+                         + embeddings.position_embeddings(position_ids)
+                         + embeddings.token_type_embeddings(token_type_ids))
+        hidden_states = embeddings.dropout(embeddings.LayerNorm(hidden_states))
+
+        for layer_module in self.bert_model.encoder.layer[:self.max_layers]:
+            hidden_states = layer_module(hidden_states, extended_attention_mask)
+            flat_states = hidden_states.view(-1, hidden_states.size(-1))
+            # The padding of the input is unpacked from an extra zero vector
+            flat_states = torch.cat([flat_states, flat_states.new_zeros(1, flat_states.size(-1))])
+            yield flat_states[unpack]
+
 
 @TokenEmbedder.register("udify-bert-pretrained")
 class UdifyPretrainedBertEmbedder(BertEmbedder):
@@ -550,7 +878,10 @@ class UdifyPretrainedBertEmbedder(BertEmbedder):
                  requires_grad: bool = False,
                  dropout: float = 0.1,
                  layer_dropout: float = 0.1,
-                 combine_layers: str = "mix") -> None:
+                 combine_layers: str = "mix",
+                 max_layers: int = None,
+                 pack_sequences: bool = False,
+                 packed_length: int = None) -> None:
         model = BertModel.from_pretrained(pretrained_model)
 
         for param in model.parameters():
@@ -558,7 +889,10 @@ class UdifyPretrainedBertEmbedder(BertEmbedder):
 
         super().__init__(bert_model=model,
                          layer_dropout=layer_dropout,
-                         combine_layers=combine_layers)
+                         combine_layers=combine_layers,
+                         max_layers=max_layers,
+                         pack_sequences=pack_sequences,
+                         packed_length=packed_length)
 
         self.model = model
         self.dropout = dropout
@@ -585,7 +919,10 @@ class UdifyPredictionBertEmbedder(BertEmbedder):
                  requires_grad: bool = False,
                  dropout: float = 0.1,
                  layer_dropout: float = 0.1,
-                 combine_layers: str = "mix") -> None:
+                 combine_layers: str = "mix",
+                 max_layers: int = None,
+                 pack_sequences: bool = False,
+                 packed_length: int = None) -> None:
         model = BertModel(BertConfig.from_json_file(bert_config))
 
         for param in model.parameters():
@@ -593,7 +930,10 @@ class UdifyPredictionBertEmbedder(BertEmbedder):
 
         super().__init__(bert_model=model,
                          layer_dropout=layer_dropout,
-                         combine_layers=combine_layers)
+                         combine_layers=combine_layers,
+                         max_layers=max_layers,
+                         pack_sequences=pack_sequences,
+                         packed_length=packed_length)
 
         self.model = model
         self.dropout = dropout
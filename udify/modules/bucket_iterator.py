@@ -1,5 +1,6 @@
 import logging
 import random
+import itertools
 from collections import deque
 from typing import List, Tuple, Iterable, cast, Dict, Deque
 
@@ -16,15 +17,26 @@ from allennlp.data.vocabulary import Vocabulary
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
-def group_by_data_type(instances: List[Instance]) -> List[Instance]:
+def group_by_data_type(instances: List[Instance]) -> List[List[Instance]]:
     d = defaultdict(list)
 
+    # The dataset reader stores the dataset of each token in the metadata
     for item in instances:
-        d[item['dataset'][0]].append(item)
+        datasets = item.fields['metadata'].metadata['dataset']
+        d[datasets[0] if datasets else None].append(item)
 
     return [v for v in d.values()]
 
 
+def interleave_round_robin(groups: List[List]) -> List:
+    """
+    Takes an item from each group in turn, skipping the groups already exhausted.
+    """
+    missing = object()
+    return [item for items in itertools.zip_longest(*groups, fillvalue=missing)
+            for item in items if item is not missing]
+
+
 def sort_by_padding(instances: List[Instance],
                     sorting_keys: List[Tuple[str, str]],  # pylint: disable=invalid-sequence-index
                     vocab: Vocabulary,
@@ -34,11 +46,23 @@ def sort_by_padding(instances: List[Instance],
     ``sorting_keys`` (in the order in which they are provided).  ``sorting_keys`` is a list of
     ``(field_name, padding_key)`` tuples.
     """
+    return [instance for instance, _ in sort_by_padding_with_lengths(instances, sorting_keys, vocab, padding_noise)]
+
+
+def sort_by_padding_with_lengths(instances: List[Instance],
+                                 sorting_keys: List[Tuple[str, str]],  # pylint: disable=invalid-sequence-index
+                                 vocab: Vocabulary,
+                                 padding_noise: float = 0.0) -> List[Tuple[Instance, List[int]]]:
+    """
+    Like ``sort_by_padding``, but returns each instance with its padding lengths for ``sorting_keys``
+    (without noise), i.e., its ``get_sorting_lengths``.
+    """
     instances_with_lengths = []
     for instance in instances:
         # Make sure instance is indexed before calling .get_padding
         instance.index_fields(vocab)
         padding_lengths = cast(Dict[str, Dict[str, float]], instance.get_padding_lengths())
+        lengths = [padding_lengths[field_name][padding_key] for (field_name, padding_key) in sorting_keys]
         if padding_noise > 0.0:
             noisy_lengths = {}
             for field_name, field_lengths in padding_lengths.items():
@@ -46,10 +70,48 @@ def sort_by_padding(instances: List[Instance],
             padding_lengths = noisy_lengths
         instance_with_lengths = ([padding_lengths[field_name][padding_key]
                                   for (field_name, padding_key) in sorting_keys],
-                                 instance)
+                                 instance,
+                                 lengths)
         instances_with_lengths.append(instance_with_lengths)
     instances_with_lengths.sort(key=lambda x: x[0])
-    return [instance_with_lengths[-1] for instance_with_lengths in instances_with_lengths]
+    return [(instance, lengths) for _, instance, lengths in instances_with_lengths]
+
+
+def get_sorting_lengths(instance: Instance,
+                        sorting_keys: List[Tuple[str, str]],  # pylint: disable=invalid-sequence-index
+                        vocab: Vocabulary) -> List[int]:
+    """
+    Returns the padding lengths of the instance for the ``(field_name, padding_key)`` pairs in
+    ``sorting_keys``, as used by ``sort_by_padding`` (without noise).
+    """
+    instance.index_fields(vocab)
+    padding_lengths = cast(Dict[str, Dict[str, int]], instance.get_padding_lengths())
+    return [padding_lengths[field_name][padding_key] for (field_name, padding_key) in sorting_keys]
+
+
+def group_by_token_budget(lengths: List[int],
+                          batch_size: int,
+                          maximum_tokens: int = None) -> List[List[int]]:
+    """
+    Splits the positions of the given lengths, in order, into groups of at most ``batch_size``
+    positions whose padded size (the number of positions times the longest length) stays within
+    ``maximum_tokens``, like ``maximum_samples_per_batch`` does. A length over the budget gets a group
+    of its own. The lengths are expected to be sorted, so that each group wastes little padding.
+    """
+    groups: List[List[int]] = []
+    group: List[int] = []
+    longest = 0
+    for position, length in enumerate(lengths):
+        candidate_longest = max(longest, length)
+        too_many_tokens = maximum_tokens is not None and candidate_longest * (len(group) + 1) > maximum_tokens
+        if group and (len(group) == batch_size or too_many_tokens):
+            groups.append(group)
+            group, candidate_longest = [], length
+        group.append(position)
+        longest = candidate_longest
+    if group:
+        groups.append(group)
+    return groups
 
 
 @DataIterator.register("data-type-bucket")
@@ -96,7 +158,16 @@ class BucketIterator(DataIterator):
     skip_smaller_batches : bool, optional, (default = False)
         When the number of data samples is not dividable by `batch_size`,
         some batches might be smaller than `batch_size`.
-        If set to `True`, those smaller batches will be discarded.
+        If set to `True`, those smaller batches will be discarded. With ``maximum_tokens_per_batch``,
+        where most batches are smaller, only the last one (the remainder) is discarded, if smaller.
+    maximum_tokens_per_batch : int, optional, (default = None)
+        If set, a batch is closed before its padded size (the number of its instances times the
+        first sorting key of the longest one) would exceed this many tokens.
+
+    The instances of each dataset are batched separately, and the batches of the datasets are
+    interleaved (taking one from each dataset in turn). With ``biggest_batch_first``, the batch with
+    the largest padded size, among all of them, comes first. The padding efficiency (the share of
+    real tokens among the padded ones) of the batches is logged at each epoch.
     """
 
     def __init__(self,
@@ -109,7 +180,8 @@ class BucketIterator(DataIterator):
                  cache_instances: bool = False,
                  track_epoch: bool = False,
                  maximum_samples_per_batch: Tuple[str, int] = None,
-                 skip_smaller_batches: bool = False) -> None:
+                 skip_smaller_batches: bool = False,
+                 maximum_tokens_per_batch: int = None) -> None:
         if not sorting_keys:
             raise ConfigurationError("BucketIterator requires sorting_keys to be specified")
 
@@ -123,52 +195,74 @@ class BucketIterator(DataIterator):
         self._padding_noise = padding_noise
         self._biggest_batch_first = biggest_batch_first
         self._skip_smaller_batches = skip_smaller_batches
+        self._maximum_tokens_per_batch = maximum_tokens_per_batch
+
+    def _bucket_batches(self, instance_list: List[Instance]) -> List[Tuple[List[Instance], List[int]]]:
+        """
+        Sorts the instances by padding and splits them into batches, returned with the lengths of
+        their instances (by the first sorting key).
+        """
+        instances_with_lengths = sort_by_padding_with_lengths(instance_list,
+                                                              self._sorting_keys,
+                                                              self.vocab,
+                                                              self._padding_noise)
+        instance_list = [instance for instance, _ in instances_with_lengths]
+        lengths = {id(instance): instance_lengths[0] for instance, instance_lengths in instances_with_lengths}
+
+        budgeted = self._maximum_tokens_per_batch is not None
+        if budgeted:
+            groups = group_by_token_budget([lengths[id(instance)] for instance in instance_list],
+                                           self._batch_size,
+                                           self._maximum_tokens_per_batch)
+            grouped_instances = ([instance_list[position] for position in group] for group in groups)
+        else:
+            grouped_instances = lazy_groups_of(iter(instance_list), self._batch_size)
+
+        batches = []
+        excess: Deque[Instance] = deque()
+        for batch_instances in grouped_instances:
+            for possibly_smaller_batches in self._ensure_batch_is_sufficiently_small(batch_instances, excess):
+                # The batches within the token budget are meant to be smaller, see below
+                if self._skip_smaller_batches and not budgeted and len(possibly_smaller_batches) < self._batch_size:
+                    continue
+                batches.append(possibly_smaller_batches)
+        if excess and (budgeted or not self._skip_smaller_batches or len(excess) == self._batch_size):
+            batches.append(list(excess))
+        if self._skip_smaller_batches and budgeted and batches and len(batches[-1]) < self._batch_size:
+            # Only the remainder of the instances is skipped
+            batches.pop()
+
+        return [(batch, [lengths[id(instance)] for instance in batch]) for batch in batches]
 
     @overrides
     def _create_batches(self, instances: Iterable[Instance], shuffle: bool) -> Iterable[Batch]:
-        instances_by_data = group_by_data_type(instances)
-        all_batches = []
-        for instances in instances_by_data:
-            for instance_list in self._memory_sized_lists(instances):
-
-                instance_list = sort_by_padding(instance_list,
-                                                self._sorting_keys,
-                                                self.vocab,
-                                                self._padding_noise)
-
-                batches = []
-                excess: Deque[Instance] = deque()
-                for batch_instances in lazy_groups_of(iter(instance_list), self._batch_size):
-                    for possibly_smaller_batches in self._ensure_batch_is_sufficiently_small(batch_instances, excess):
-                        if self._skip_smaller_batches and len(possibly_smaller_batches) < self._batch_size:
-                            continue
-                        batches.append(Batch(possibly_smaller_batches))
-                if excess and (not self._skip_smaller_batches or len(excess) == self._batch_size):
-                    batches.append(Batch(excess))
-                # TODO: Add multi-GPU friendly grouping, i.e. group
-                # num_gpu batches together, shuffle and then expand the groups.
-                # This guards against imbalanced batches across GPUs.
-                # TODO: Look at biggest batch first thing..
-                '''
-                move_to_front = self._biggest_batch_first and len(batches) > 1
-                if move_to_front:
-                    # We'll actually pop the last _two_ batches, because the last one might not be full.
-                    last_batch = batches.pop()
-                    penultimate_batch = batches.pop()  
-                '''
-                if shuffle:
-                    # NOTE: if shuffle is false, the data will still be in a different order
-                    # because of the bucket sorting.
-                    random.shuffle(batches)
-                '''
-                if move_to_front:
-                    batches.insert(0, penultimate_batch)
-                    batches.insert(0, last_batch)
-                '''
-            all_batches.extend(batches)
-        if shuffle:
-            # NOTE: if shuffle is false, the data will still be in a different order
-            # because of the bucket sorting.
-            random.shuffle(all_batches)
-        for batch in batches:
-            yield batch
+        batches_by_data = []
+        for data_instances in group_by_data_type(instances):
+            batches = []
+            for instance_list in self._memory_sized_lists(data_instances):
+                batches.extend(self._bucket_batches(instance_list))
+            if shuffle:
+                # NOTE: if shuffle is false, the data will still be in a different order
+                # because of the bucket sorting.
+                random.shuffle(batches)
+            batches_by_data.append(batches)
+
+        # TODO: Add multi-GPU friendly grouping, i.e. group
+        # num_gpu batches together, shuffle and then expand the groups.
+        # This guards against imbalanced batches across GPUs.
+        all_batches = interleave_round_robin(batches_by_data)
+
+        # Surface out-of-memory errors at the start of the epoch rather than at its end
+        if self._biggest_batch_first and len(all_batches) > 1:
+            biggest = max(range(len(all_batches)),
+                          key=lambda index: len(all_batches[index][1]) * max(all_batches[index][1]))
+            all_batches.insert(0, all_batches.pop(biggest))
+
+        num_tokens = sum(sum(lengths) for _, lengths in all_batches)
+        num_padded_tokens = sum(len(lengths) * max(lengths) for _, lengths in all_batches)
+        if num_padded_tokens:
+            logger.info(f"Padding efficiency: {num_tokens / num_padded_tokens:.1%} "
+                        f"({num_tokens} tokens in {num_padded_tokens} padded, {len(all_batches)} batches)")
+
+        for batch, _ in all_batches:
+            yield Batch(batch)
@@ -0,0 +1,76 @@
+"""
+A memory-mapped, float16 cache of the per-token output of a frozen BERT embedder, so that the decoders can be
+trained (e.g., to tune their hyperparameters) without running BERT again at every epoch. The cache is a
+directory with a ``meta.json`` file, mapping each sentence (by its words) to its rows, and the
+(num_tokens, num_layers, embedding_dim) array of the layer outputs of all the tokens.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import os
+import json
+import hashlib
+
+import numpy
+import torch
+
+META_FILE = "meta.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+
+def get_key(words: List[str]) -> str:
+    return hashlib.sha1(json.dumps(words).encode("utf-8")).hexdigest()
+
+
+def save_embedding_cache(directory: str, embedder: str, combine_layers: str, max_layers: int,
+                         sentences: Dict[str, Tuple[int, int]], num_tokens: int,
+                         embedding_dim: int) -> numpy.ndarray:
+    """
+    Creates the cache of the given sentences (the rows of each, by key) in the directory, and returns its
+    memory-mapped embeddings array, to be filled in by the caller.
+    :param embedder: the name of the token embedder (in the text field embedder) whose output is cached
+    :param combine_layers: how the embedder combines its first ``max_layers`` layers, "all" or "last"
+    """
+    os.makedirs(directory, exist_ok=True)
+    num_layers = max_layers if combine_layers == "all" else 1
+    meta = {"embedder": embedder, "combine_layers": combine_layers, "max_layers": max_layers,
+            "embedding_dim": embedding_dim, "sentences": sentences}
+    with open(os.path.join(directory, META_FILE), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    return numpy.lib.format.open_memmap(os.path.join(directory, EMBEDDINGS_FILE), mode="w+",
+                                        dtype=numpy.float16, shape=(num_tokens, num_layers, embedding_dim))
+
+
+class EmbeddingCache:
+    """
+    The embeddings saved by ``cache_embeddings.py``, memory-mapped.
+    """
+    def __init__(self, directory: str) -> None:
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self.embedder = meta["embedder"]
+        self.combine_layers = meta["combine_layers"]
+        self.max_layers = meta["max_layers"]
+        self.num_layers = self.max_layers if self.combine_layers == "all" else 1
+        self.embedding_dim = meta["embedding_dim"]
+        self._sentences = meta["sentences"]
+        self._embeddings = numpy.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+
+    def get(self, sentences: List[List[str]], sequence_length: int,
+            device: torch.device = None) -> Optional[torch.Tensor]:
+        """
+        Returns the cached embeddings of the sentences (by their words), padded to ``sequence_length`` tokens,
+        as the embedder would: (num_layers, batch_size, sequence_length, embedding_dim) for "all" layers,
+        without the first dimension for the "last" one. Returns None if any of the sentences is not cached.
+        """
+        rows = [self._sentences.get(get_key(words)) for words in sentences]
+        if any(row is None for row in rows):
+            return None
+
+        embeddings = numpy.zeros((self.num_layers, len(rows), sequence_length, self.embedding_dim),
+                                 dtype=numpy.float32)
+        for i, (start, length) in enumerate(rows):
+            embeddings[:, i, :length] = self._embeddings[start:start + length].transpose(1, 0, 2)
+
+        embeddings = torch.from_numpy(embeddings).to(device)
+        return embeddings if self.combine_layers == "all" else embeddings[0]
@@ -75,19 +75,14 @@ class ScalarMixWithDropout(torch.nn.Module):
             variance = torch.sum(((tensor_masked - mean) * broadcast_mask)**2) / num_elements_not_masked
             return (tensor - mean) / torch.sqrt(variance + 1E-12)
 
-        weights = torch.cat([parameter for parameter in self.scalar_parameters])
-
-        if self.dropout:
-            weights = torch.where(self.dropout_mask.uniform_() > self.dropout, weights, self.dropout_fill)
-
-        normed_weights = torch.nn.functional.softmax(weights, dim=0)
-        normed_weights = torch.split(normed_weights, split_size_or_sections=1)
+        normed_weights = self.get_normed_weights()
 
+        # The weighted tensors are summed as they are computed, so that only one of them is held at a time
         if not self.do_layer_norm:
-            pieces = []
+            mixture = 0
             for weight, tensor in zip(normed_weights, tensors):
-                pieces.append(weight * tensor)
-            return self.gamma * sum(pieces)
+                mixture = mixture + weight * tensor
+            return self.gamma * mixture
 
         else:
             mask_float = mask.float()
@@ -95,8 +90,22 @@ class ScalarMixWithDropout(torch.nn.Module):
             input_dim = tensors[0].size(-1)
             num_elements_not_masked = torch.sum(mask_float) * input_dim
 
-            pieces = []
+            mixture = 0
             for weight, tensor in zip(normed_weights, tensors):
-                pieces.append(weight * _do_layer_norm(tensor,
-                                                      broadcast_mask, num_elements_not_masked))
-            return self.gamma * sum(pieces)
+                mixture = mixture + weight * _do_layer_norm(tensor,
+                                                            broadcast_mask, num_elements_not_masked)
+            return self.gamma * mixture
+
+    def get_normed_weights(self) -> List[torch.Tensor]:
+        """
+        Returns the softmax-normalized weight of each tensor (after the dropout, if any), which allows
+        mixing (without layer normalization) tensors that are produced one at a time, as
+        ``gamma * sum(weight_k * tensor_k)``, without keeping all of them.
+        """
+        weights = torch.cat([parameter for parameter in self.scalar_parameters])
+
+        if self.dropout:
+            weights = torch.where(self.dropout_mask.uniform_() > self.dropout, weights, self.dropout_fill)
+
+        normed_weights = torch.nn.functional.softmax(weights, dim=0)
+        return torch.split(normed_weights, split_size_or_sections=1)
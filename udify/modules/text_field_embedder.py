@@ -16,6 +16,8 @@ from allennlp.modules.text_field_embedders import TextFieldEmbedder
 from allennlp.modules.time_distributed import TimeDistributed
 from allennlp.modules.token_embedders.token_embedder import TokenEmbedder
 
+from udify.modules.bert_pretrained import BertEmbedder
+
 
 @TextFieldEmbedder.register("udify_embedder")
 class UdifyTextFieldEmbedder(TextFieldEmbedder):
@@ -64,7 +66,12 @@ class UdifyTextFieldEmbedder(TextFieldEmbedder):
     def get_output_dim(self) -> int:
         return self._output_dim
 
-    def forward(self, text_field_input: Dict[str, torch.Tensor], num_wrapping_dims: int = 0) -> torch.Tensor:
+    def forward(self, text_field_input: Dict[str, torch.Tensor], num_wrapping_dims: int = 0,
+                precomputed: Dict[str, torch.Tensor] = None) -> torch.Tensor:
+        """
+        :param precomputed: the output of some of the token embedders, by key, e.g., from an ``EmbeddingCache``,
+            used instead of running them. Their output is combined with that of the others as usual.
+        """
         embedder_keys = self._token_embedders.keys()
         input_keys = text_field_input.keys()
 
@@ -90,20 +97,31 @@ class UdifyTextFieldEmbedder(TextFieldEmbedder):
                 raise ConfigurationError(message)
 
         def embed(key):
+            if precomputed is not None and key in precomputed:
+                return precomputed[key]
+
             # If we pre-specified a mapping explictly, use that.
             if self._embedder_to_indexer_map is not None:
-                tensors = [text_field_input[indexer_key] for
-                           indexer_key in self._embedder_to_indexer_map[key]]
+                indexer_keys = self._embedder_to_indexer_map[key]
             else:
                 # otherwise, we assume the mapping between indexers and embedders
                 # is bijective and just use the key directly.
-                tensors = [text_field_input[key]]
+                indexer_keys = [key]
+            tensors = [text_field_input[indexer_key] for indexer_key in indexer_keys]
             # Note: need to use getattr here so that the pytorch voodoo
             # with submodules works with multiple GPUs.
             embedder = getattr(self, 'token_embedder_{}'.format(key))
+
+            # The windows of the "word" windowing can only be recombined with the indices computed by the
+            # indexer, so they are always passed to the BERT embedder, whether they are mapped or not
+            kwargs = {}
+            select_key = f"{indexer_keys[0]}-select"
+            if isinstance(embedder, BertEmbedder) and select_key in text_field_input and select_key not in indexer_keys:
+                kwargs["select_indices"] = text_field_input[select_key]
+
             for _ in range(num_wrapping_dims):
                 embedder = TimeDistributed(embedder)
-            token_vectors = embedder(*tensors)
+            token_vectors = embedder(*tensors, **kwargs)
 
             return token_vectors
 
@@ -1 +1,2 @@
 from udify.predictors.predictor import UdifyPredictor
+from udify.predictors.predict_manager import UdifyPredictManager
@@ -0,0 +1,87 @@
+"""
+Runs a predictor over a whole input file, writing the predictions as they are produced
+"""
+
+from typing import Iterator, List, Tuple
+
+from allennlp.common.util import JsonDict, lazy_groups_of
+from allennlp.data import Instance
+from allennlp.predictors.predictor import Predictor
+
+from udify.modules.bucket_iterator import get_sorting_lengths, group_by_token_budget
+
+
+class UdifyPredictManager:
+    """
+    Like allennlp's ``_PredictManager``, but meant for very large inputs. When the dataset reader of the
+    predictor is lazy, sentences are read from the input file one batch at a time and the predictions of
+    each batch are written (in input order) before the next one is read, so memory use does not grow with
+    the size of the file.
+
+    With ``sort_by_length``, the sentences are read ``max_instances_in_memory`` at a time (all of them, or
+    100 batches when the reader is lazy, by default) and batched by length, as the ``BucketIterator``
+    does, so that a long sentence does not pad a batch of short ones. A batch is further split when its
+    padded size would exceed ``maximum_tokens_per_batch``. The predictions are still written in input order.
+    """
+    def __init__(self,
+                 predictor: Predictor,
+                 input_file: str,
+                 output_file: str,
+                 batch_size: int = 1,
+                 sort_by_length: bool = False,
+                 maximum_tokens_per_batch: int = None,
+                 max_instances_in_memory: int = None,
+                 sorting_keys: List[Tuple[str, str]] = None) -> None:
+        self._predictor = predictor
+        self._dataset_reader = predictor._dataset_reader  # pylint: disable=protected-access
+        self._input_file = input_file
+        self._output_file = output_file
+        self._batch_size = batch_size
+        self._sort_by_length = sort_by_length
+        self._maximum_tokens_per_batch = maximum_tokens_per_batch
+        self._max_instances_in_memory = max_instances_in_memory
+        self._sorting_keys = sorting_keys or [("tokens", "num_tokens")]
+
+    def _get_windows(self) -> Iterator[List[Instance]]:
+        """
+        Groups the input instances into the ones that are predicted (and held in memory) together.
+        """
+        instances = self._dataset_reader.read(self._input_file)
+        if not self._sort_by_length:
+            window_size = self._batch_size
+        elif self._max_instances_in_memory:
+            window_size = self._max_instances_in_memory
+        elif self._dataset_reader.lazy:
+            window_size = 100 * self._batch_size
+        else:
+            yield list(instances)
+            return
+        yield from lazy_groups_of(iter(instances), window_size)
+
+    def _get_batches(self, instances: List[Instance]) -> List[List[int]]:
+        """
+        Splits the positions of the given instances into batches.
+        """
+        if not self._sort_by_length:
+            return [list(range(len(instances)))]
+
+        vocab = self._predictor._model.vocab  # pylint: disable=protected-access
+        lengths = [get_sorting_lengths(instance, self._sorting_keys, vocab) for instance in instances]
+        order = sorted(range(len(instances)), key=lambda position: lengths[position])
+        groups = group_by_token_budget([lengths[position][0] for position in order],
+                                       self._batch_size,
+                                       self._maximum_tokens_per_batch)
+        return [[order[position] for position in group] for group in groups]
+
+    def _predict_batch(self, batch: List[Instance]) -> List[JsonDict]:
+        return self._predictor.predict_batch_instance(batch)
+
+    def run(self) -> None:
+        with open(self._output_file, "w") as output_file:
+            for instances in self._get_windows():
+                predictions = [None] * len(instances)
+                for positions in self._get_batches(instances):
+                    results = self._predict_batch([instances[position] for position in positions])
+                    for position, result in zip(positions, results):
+                        predictions[position] = self._predictor.dump_line(result)
+                output_file.writelines(predictions)
@@ -73,41 +73,48 @@ class UdifyPredictor(Predictor):
 
     @overrides
     def dump_line(self, outputs: JsonDict) -> str:
-        lines = []
-        #R: Warning, hacky!, allennlp requires each item to be in the length of metadata, but I just need it once
-        #outputs['tasks'] = outputs['tasks'][0]
-        #outputs['transformers'] = outputs['transformers'][0]
-        for i in range(len(outputs['fullData'])):
-            oppIdx = len(outputs['fullData']) -1 -i
-            oppIdxProc = len(outputs['words']) -1 - i
-            tok = outputs['fullData'][oppIdx]
-            if oppIdxProc >= 0:
-                #somehow a list of length 1 is transformed to a string by allennlp?, so I put it back in a list here..
-                for taskIdx, task in enumerate(outputs['tasks'] if type(outputs['tasks']) is list else [outputs['tasks']]):
-                    colIdx = outputs['colIdxs'][task]
-                    tok[colIdx] = outputs[task][oppIdxProc]
-                    if 'lemma' == (outputs['transformers'][taskIdx] if type(outputs['transformers']) is list else outputs['transformers']):
-                        tok[colIdx] = apply_lemma_rule(outputs['words'][oppIdxProc], tok[colIdx])
-            
-                # ALSO FOR TRIGGERS
-                # To generalize to multiple columns
-                # if (len(tok[-1]) > 1):
-                if isinstance(tok[-2], list):
-                    #print(tok[-1])
-                    prevlast_tok = "$".join(sorted(tok[-2]))
-                    #print(last_tok)
-                    tok = tok[:-2] + [prevlast_tok] + [tok[-1]]
-                    #print(tok)
+        return '\n'.join('\t'.join(tok) for tok in get_output_rows(outputs)) + '\n\n'
 
-                # To generalize to multiple columns
-                # if (len(tok[-1]) > 1):
-                if isinstance(tok[-1], list):
-                    #print(tok[-1])
-                    last_tok = "$".join(sorted(tok[-1]))
-                    #print(last_tok)
-                    tok = tok[:-1] + [last_tok]
-                    #print(tok)
-            lines.append('\t'.join(tok))
-        lines.reverse()
-        return '\n'.join(lines) + '\n\n'
 
+def get_output_rows(outputs: JsonDict) -> List[List[str]]:
+    """
+    Returns the rows (comments included) of the sentence in the given predictor outputs, i.e., its
+    ``fullData`` columns with the predicted labels of each task, as ``UdifyPredictor.dump_line`` writes them.
+    """
+    lines = []
+    #R: Warning, hacky!, allennlp requires each item to be in the length of metadata, but I just need it once
+    #outputs['tasks'] = outputs['tasks'][0]
+    #outputs['transformers'] = outputs['transformers'][0]
+    for i in range(len(outputs['fullData'])):
+        oppIdx = len(outputs['fullData']) -1 -i
+        oppIdxProc = len(outputs['words']) -1 - i
+        tok = list(outputs['fullData'][oppIdx])
+        if oppIdxProc >= 0:
+            #somehow a list of length 1 is transformed to a string by allennlp?, so I put it back in a list here..
+            for taskIdx, task in enumerate(outputs['tasks'] if type(outputs['tasks']) is list else [outputs['tasks']]):
+                colIdx = outputs['colIdxs'][task]
+                tok[colIdx] = outputs[task][oppIdxProc]
+                if 'lemma' == (outputs['transformers'][taskIdx] if type(outputs['transformers']) is list else outputs['transformers']):
+                    tok[colIdx] = apply_lemma_rule(outputs['words'][oppIdxProc], tok[colIdx])
+        
+            # ALSO FOR TRIGGERS
+            # To generalize to multiple columns
+            # if (len(tok[-1]) > 1):
+            if isinstance(tok[-2], list):
+                #print(tok[-1])
+                prevlast_tok = "$".join(sorted(tok[-2]))
+                #print(last_tok)
+                tok = tok[:-2] + [prevlast_tok] + [tok[-1]]
+                #print(tok)
+
+            # To generalize to multiple columns
+            # if (len(tok[-1]) > 1):
+            if isinstance(tok[-1], list):
+                #print(tok[-1])
+                last_tok = "$".join(sorted(tok[-1]))
+                #print(last_tok)
+                tok = tok[:-1] + [last_tok]
+                #print(tok)
+        lines.append(tok)
+    lines.reverse()
+    return lines
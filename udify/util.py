@@ -6,6 +6,9 @@ from typing import List, Tuple, Dict, Any
 
 import os
 import glob
+import shutil
+import tempfile
+import multiprocessing
 import json
 import logging
 import tarfile
@@ -18,16 +21,24 @@ import numpy
 from allennlp.common.checks import ConfigurationError
 from allennlp.common import Params
 from allennlp.common.params import with_fallback
+from allennlp.common.util import import_submodules
 from allennlp.commands.make_vocab import make_vocab_from_params
-from allennlp.commands.predict import _PredictManager
 from allennlp.common.checks import check_for_gpu
 from allennlp.models.archival import load_archive
 from allennlp.predictors.predictor import Predictor
+from allennlp.data import DatasetReader, Vocabulary
 
 from udify.dataset_readers.ge11_eval import evaluate_asrm
+from udify.dataset_readers.universal_dependencies import read_columns
+from udify.dataset_readers.indexed_dataset import save_indexed_instances, VOCABULARY_DIR, WORDPIECE_CACHE_FILE
+from udify.modules.bert_pretrained import BertEmbedder, WordpieceIndexer
+from udify.predictors.predict_manager import UdifyPredictManager
 
 VOCAB_CONFIG_PATH = "config/create_vocab.json"
 
+# The splits of each dataset, by the name allennlp gives them when creating the vocabulary
+SPLITS = {"train": "train", "validation": "dev", "test": "test"}
+
 logger = logging.getLogger(__name__)
 
 
@@ -108,6 +119,11 @@ def merge_configs(parameters_config: str, dataset_config: str, overrides: Dict)
         mergedSettings['trainer']['cuda_device'] = overrides['trainer']['cuda_device']
 
     mergedSettings['model']['bert_path'] = mergedSettings['dataset_reader']['token_indexers']['bert']['pretrained_model']
+
+    # The tasks only use the first layers of BERT, so there is no need to compute the others
+    bert_embedder = mergedSettings['model']['text_field_embedder']['token_embedders']['bert']
+    if bert_embedder.get('combine_layers', 'mix') == 'all' and 'max_layers' not in bert_embedder:
+        bert_embedder['max_layers'] = max(orderedLayers)
     
     return mergedSettings
 
@@ -140,6 +156,68 @@ def cache_vocab(params: Params, vocab_config_path: str = None):
     make_vocab_from_params(params, os.path.split(vocab_path)[0])
 
 
+def index_datasets(params: Params, output_dir: str):
+    """
+    Indexes the splits of the datasets of the (merged) params once and saves them in binary form, with the
+    vocabulary created as train.py does, to be loaded by the dataset reader, see ``use_indexed_datasets``.
+    """
+    params = params.duplicate()
+    reader_params = params.pop("dataset_reader")
+    reader_params.pop("indexed_dir", None)
+    reader = DatasetReader.from_params(reader_params)
+
+    instances = {}
+    for split in SPLITS.values():
+        for dataset in reader.datasets:
+            logger.info(f"Reading the {split} split of {dataset}")
+            instances[(dataset, split)] = [reader.sentence_to_instance(dataset, sent, fullData)
+                                           for sent, fullData in read_columns(reader.datasets[dataset][split])]
+
+    # Create the vocabulary as train.py does
+    vocab_params = params.pop("vocabulary", Params({}))
+    vocab_params.pop("non_padded_namespaces", None)
+    datasets_for_vocab_creation = set(params.pop("datasets_for_vocab_creation", SPLITS.keys()))
+    vocab = Vocabulary.from_params(vocab_params,
+                                   (instance for key, split in SPLITS.items() if key in datasets_for_vocab_creation
+                                    for (dataset, instance_split), split_instances in instances.items()
+                                    if instance_split == split for instance in split_instances))
+    vocab.save_to_files(os.path.join(output_dir, VOCABULARY_DIR))
+
+    for (dataset, split), split_instances in instances.items():
+        logger.info(f"Indexing the {split} split of {dataset}")
+        save_indexed_instances(split_instances, vocab, os.path.join(output_dir, dataset, split),
+                               reader.datasets[dataset][split])
+
+    # Keep the wordpiece tokenizations next to the vocabulary, for the readers of the trained model
+    for name, indexer in reader._token_indexers.items():  # pylint: disable=protected-access
+        if isinstance(indexer, WordpieceIndexer):
+            logger.info(f"Wordpiece cache of the {name} indexer: {indexer.get_cache_statistics()}")
+            indexer.save_cache(os.path.join(output_dir, WORDPIECE_CACHE_FILE.format(name)))
+
+
+def use_indexed_datasets(params: Params, indexed_dir: str):
+    """
+    Sets the params to load the splits, the vocabulary and the wordpiece tokenizations indexed in the given
+    directory by ``index_datasets``.
+    """
+    # The indexed instances are only valid with the vocabulary they were indexed with
+    params["dataset_reader"]["indexed_dir"] = indexed_dir
+    params["vocabulary"] = {"directory_path": os.path.join(indexed_dir, VOCABULARY_DIR)}
+    for name, indexer in params["dataset_reader"]["token_indexers"].items():
+        if indexer.get("type") == "udify-bert-pretrained":
+            indexer["cache_file"] = os.path.join(indexed_dir, WORDPIECE_CACHE_FILE.format(name))
+
+
+def use_embedding_cache(params: Params, embedding_cache: str):
+    """
+    Sets the params to train the decoders on the BERT embeddings cached in the directory by cache_embeddings.py.
+    """
+    # The cached embeddings are those of the frozen BERT
+    params["model"]["embedding_cache"] = embedding_cache
+    for embedder in params["model"]["text_field_embedder"]["token_embedders"].values():
+        embedder["requires_grad"] = False
+
+
 def get_ud_treebank_files(dataset_dir: str, treebanks: List[str] = None) -> Dict[str, Tuple[str, str, str]]:
     """
     Retrieves all treebank data paths in the given directory.
@@ -188,33 +266,157 @@ def get_ud_treebank_names(dataset_dir: str) -> List[Tuple[str, str]]:
     return list(zip(treebanks, short_names))
 
 
-def predict_model_with_archive(predictor: str, params: Params, archive: str,
-                               input_file: str, output_file: str, batch_size: int = 1):
+def load_predictor_with_archive(predictor: str, params: Params, archive: str, quantize: bool = False,
+                                pack_sequences: bool = False) -> Predictor:
+    """
+    Loads the model from the given archive once and wraps it in a predictor, which can then be kept
+    in memory to serve many predictions.
+    :param predictor: the type of predictor to use, e.g., "udify_predictor"
+    :param params: the Params of the model
+    :param archive: the saved model archive
+    :param quantize: apply dynamic int8 quantization to the model, see ``quantize_model``
+    :param pack_sequences: pack the short sentences of a batch together in BERT, see ``BertEmbedder``
+    """
     cuda_device = params["trainer"]["cuda_device"]
 
     check_for_gpu(cuda_device)
     archive = load_archive(archive,
                            cuda_device=cuda_device)
 
-    predictor = Predictor.from_archive(archive, predictor)
+    if quantize:
+        if cuda_device >= 0:
+            raise ConfigurationError("Quantized inference only runs on CPU, set the device to -1")
+        quantize_model(archive.model)
+
+    if pack_sequences:
+        for module in archive.model.modules():
+            if isinstance(module, BertEmbedder):
+                module.pack_sequences = True
 
-    manager = _PredictManager(predictor,
-                              input_file,
-                              output_file,
-                              batch_size,
-                              print_to_console=False,
-                              has_dataset_reader=True)
+    return Predictor.from_archive(archive, predictor)
+
+
+def quantize_model(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Replaces (in place) all the ``Linear`` layers of the model, i.e., those of BERT and the decoder heads,
+    with dynamically quantized int8 ones. This speeds up CPU inference at some cost in accuracy,
+    see benchmarks/quantized_inference.py.
+    """
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def predict_model_with_archive(predictor: str, params: Params, archive: str,
+                               input_file: str, output_file: str, batch_size: int = 1,
+                               sort_by_length: bool = False, maximum_tokens_per_batch: int = None,
+                               workers: int = 1, quantize: bool = False, pack_sequences: bool = False):
+    """
+    Predict output annotations with the model in the given archive. If ``dataset_reader.lazy`` is set in
+    the params, the input file is streamed: only one batch of sentences is in memory at a time.
+    :param sort_by_length: batch sentences of similar length together, the output keeps the input order
+    :param maximum_tokens_per_batch: with sort_by_length, split the batches that would pad to more tokens
+    :param workers: predict with this many processes, see ``predict_model_with_archive_in_shards``
+    :param quantize: predict with a dynamically quantized int8 model (CPU only)
+    :param pack_sequences: pack the short sentences of a batch together in BERT
+    """
+    if workers > 1:
+        predict_model_with_archive_in_shards(predictor, params, archive, input_file, output_file, batch_size,
+                                             workers=workers, sort_by_length=sort_by_length,
+                                             maximum_tokens_per_batch=maximum_tokens_per_batch,
+                                             quantize=quantize, pack_sequences=pack_sequences)
+        return
+
+    predictor = load_predictor_with_archive(predictor, params, archive, quantize=quantize,
+                                            pack_sequences=pack_sequences)
+    predictor._dataset_reader.lazy = params["dataset_reader"].get("lazy", False)
+
+    manager = UdifyPredictManager(predictor,
+                                  input_file,
+                                  output_file,
+                                  batch_size,
+                                  sort_by_length=sort_by_length,
+                                  maximum_tokens_per_batch=maximum_tokens_per_batch)
     manager.run()
 
 
+def predict_model_with_archive_in_shards(predictor: str, params: Params, archive: str,
+                                         input_file: str, output_file: str, batch_size: int = 1,
+                                         workers: int = 2, threads_per_worker: int = None, **kwargs):
+    """
+    Like ``predict_model_with_archive``, but splits the input file by sentence into ``workers`` contiguous
+    shards, predicts each of them in its own process (loading the archive once per process) and
+    concatenates the predictions, in input order, into the output file.
+    :param workers: the number of processes
+    :param threads_per_worker: the torch threads of each process, the available cores split among the
+    workers by default
+    """
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    with tempfile.TemporaryDirectory() as shard_dir:
+        shards = split_sentences(input_file, shard_dir, workers)
+        jobs = [(predictor, params.as_dict(quiet=True), archive, shard, shard + ".pred", batch_size,
+                 threads_per_worker, kwargs) for shard in shards]
+
+        # spawn, so that no torch or allennlp state is inherited by the workers
+        with multiprocessing.get_context("spawn").Pool(max(1, len(jobs))) as pool:
+            pool.starmap(_predict_shard, jobs)
+
+        with open(output_file, "w") as output:
+            for shard in shards:
+                with open(shard + ".pred") as predictions:
+                    shutil.copyfileobj(predictions, output)
+
+
+def _predict_shard(predictor: str, params: Dict[str, Any], archive: str, input_file: str, output_file: str,
+                   batch_size: int, num_threads: int, kwargs: Dict[str, Any]):
+    import_submodules("udify")
+    torch.set_num_threads(num_threads)
+    predict_model_with_archive(predictor, Params(params), archive, input_file, output_file, batch_size, **kwargs)
+
+
+def split_sentences(input_file: str, output_dir: str, num_shards: int) -> List[str]:
+    """
+    Splits a BeeSL file into (at most) ``num_shards`` files of contiguous sentences of about the same size.
+    Sentences end at the same (empty) lines as in ``read_columns``, so reading the shards one after the
+    other gives back the same sentences as reading the whole file.
+    :return: the paths of the shards, in order
+    """
+    def sentences():
+        lines = []
+        for line in open(input_file):
+            lines.append(line)
+            if len(line) < 2 and len(lines) > 1:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
+    num_sentences = sum(1 for _ in sentences())
+    shard_size = max(1, -(-num_sentences // num_shards))
+
+    shards = []
+    shard_file = None
+    for sentence_idx, lines in enumerate(sentences()):
+        if sentence_idx % shard_size == 0:
+            if shard_file:
+                shard_file.close()
+            shards.append(os.path.join(output_dir, f"shard{len(shards)}"))
+            shard_file = open(shards[-1], "w")
+        shard_file.writelines(lines)
+    if shard_file:
+        shard_file.close()
+    return shards
+
+
 def predict_and_evaluate_model_with_archive(predictor: str, params: Params, archive: str, gold_file: str,
-                               pred_file: str, output_file: str, eval_type: str, segment_file: str = None, batch_size: int = 1):
+                               pred_file: str, output_file: str, eval_type: str, segment_file: str = None, batch_size: int = 1,
+                               **kwargs):
     if not gold_file or not os.path.isfile(gold_file):
         logger.warning(f"No file exists for {gold_file}")
         return
 
     segment_file = segment_file if segment_file else gold_file
-    predict_model_with_archive(predictor, params, archive, segment_file, pred_file, batch_size)
+    predict_model_with_archive(predictor, params, archive, segment_file, pred_file, batch_size, **kwargs)
 
     if eval_type == "conll18_ud_eval":
         try: